@@ -0,0 +1,375 @@
+"""Stand-in for the docker daemon API, served over a unix socket
+
+Simulates containers writing logs at a configurable rate, and optionally
+restarting and being removed (and replaced), plus exited leftovers (e.g. of CI
+jobs), with the endpoints CaptainsLog and docker-py use: /version, /_ping,
+/containers/json (filters), /containers/<id>/json, /containers/<id>/logs
+(follow, since, until, tail, timestamps) and /events (filters).
+"""
+import asyncio
+import collections
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+# lines kept per container for non-follow requests and reconnects
+HISTORY_LINES = 100_000
+# seconds between two batches of lines written by a container
+WRITE_INTERVAL = 0.01
+# seconds a restarting container stays stopped
+RESTART_DOWNTIME = 0.5
+# compose projects the containers are spread over (com.docker.compose.project label)
+N_PROJECTS = 4
+
+API_VERSION = '1.43'
+VERSION_PREFIX = re.compile(r'^/v\d+\.\d+')
+
+CONTENT_KINDS = ('ascii', 'multibyte', 'ansi', 'json')
+
+
+def make_line(kind: str, number: int) -> str:
+    """Log line number of a container writing content of the given kind"""
+    if kind == 'multibyte':
+        return f'requête n°{number} traitée — ✓ 日本語のログ 🚀 durée={number % 97}ms'
+    if kind == 'ansi':
+        return f'\x1b[32mINFO\x1b[0m [\x1b[36mworker-{number % 8}\x1b[0m] processed job {number} in \x1b[1m{number % 97}ms\x1b[0m'
+    if kind == 'json':
+        level = 'error' if number % 50 == 0 else 'info'
+        return json.dumps({'level': level, 'service': 'api', 'latency_ms': number % 500,
+                           'msg': f'handled request {number}'})
+    return f'GET /api/items/{number} 200 {number % 97}ms user-agent="bench/1.0"'
+
+
+def match_filters(filters: Dict[str, List[str]], status: str, name: str, labels: Dict[str, str]) -> bool:
+    """Whether a container passes the filters parameter of the API (status, name, label)"""
+    if 'status' in filters and status not in filters['status']:
+        return False
+    if 'name' in filters and not any(re.search(pattern, name) for pattern in filters['name']):
+        return False
+    for label in filters.get('label', []):
+        key, sep, value = label.partition('=')
+        if key not in labels or (sep and labels[key] != value):
+            return False
+    return True
+
+
+def format_timestamp(timestamp: int) -> str:
+    seconds, nanos = divmod(timestamp, 1_000_000_000)
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + f'.{nanos:09d}Z'
+
+
+def parse_since(value: str) -> int:
+    seconds, _, nanos = value.partition('.')
+    return int(seconds) * 1_000_000_000 + int(nanos.ljust(9, '0')[:9] or 0)
+
+
+class FakeContainer:
+
+    def __init__(self, number: int, rate: float, kind: str, tty: bool, daemon_id: str = ''):
+        self.name = f'bench-{number}'
+        self.id = hashlib.sha256(f'{daemon_id}/{self.name}'.encode()).hexdigest()
+        self.rate = rate
+        self.kind = kind
+        self.tty = tty
+        self.labels = {'com.docker.compose.project': f'bench-project-{number % N_PROJECTS}'}
+        self.running = True
+        self.removed = False
+        self.history: Deque[Tuple[int, bytes]] = collections.deque(maxlen=HISTORY_LINES)
+        self.written = 0
+        self.last_timestamp = 0
+        # set and replaced whenever lines are written or the container stops
+        self.changed = asyncio.Event()
+
+    def summary(self) -> dict:
+        return {'Id': self.id, 'Names': [f'/{self.name}'], 'State': 'running' if self.running else 'exited',
+                'Labels': self.labels}
+
+    def inspect(self) -> dict:
+        return {'Id': self.id, 'Name': f'/{self.name}', 'Config': {'Tty': self.tty},
+                'State': {'Status': 'running' if self.running else 'exited', 'Running': self.running}}
+
+    def write(self, n_lines: int):
+        # timestamps are unique and increasing, as the engine skips lines it already received on reconnects
+        timestamp = max(time.time_ns(), self.last_timestamp + 1)
+        for _ in range(n_lines):
+            self.history.append((timestamp, make_line(self.kind, self.written).encode()))
+            self.written += 1
+            timestamp += 1
+        self.last_timestamp = timestamp - 1
+        self.wake()
+
+    def wake(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class FakeDockerDaemon:
+    """Fake daemon running its own event loop in a background thread
+
+    Args:
+        socket_path (str): unix socket to listen on
+        n_containers (int): number of containers kept running
+        rate (float): lines per second written by each container
+        kind (str): content of the lines, one of CONTENT_KINDS or 'mixed'
+        restart_interval (Optional[float]): seconds between restarts of a random container
+        remove_interval (Optional[float]): seconds between removals of a random container
+            (each removed container is replaced by a new one)
+        seed (int): seed of the random choices
+        n_exited (int): number of exited containers, listed but never writing
+    """
+
+    def __init__(self, socket_path: str, n_containers: int = 10, rate: float = 100.0, kind: str = 'mixed',
+                 restart_interval: Optional[float] = None, remove_interval: Optional[float] = None,
+                 seed: int = 0, n_exited: int = 0):
+        self.socket_path = socket_path
+        self.rate = rate
+        self.kind = kind
+        self.restart_interval = restart_interval
+        self.remove_interval = remove_interval
+        self.random = random.Random(seed)
+        self.containers: Dict[str, FakeContainer] = {}
+        self.requests: Dict[str, int] = collections.Counter()
+        self.lines_written = 0
+        self.listeners: List[Callable[[str, FakeContainer], None]] = []
+        self._numbers = itertools.count()
+        self._events: List[asyncio.Queue] = []
+        self._n_containers = n_containers
+        self._n_exited = n_exited
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fake-docker', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+            self._thread.join(5)
+
+    def add_listener(self, listener: Callable[[str, 'FakeContainer'], None]):
+        """Call listener(action, container) on container events (from the daemon thread)"""
+        self.listeners.append(listener)
+
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+        self._started.set()
+        self.loop.run_forever()
+
+    async def _serve(self):
+        self._server = await asyncio.start_unix_server(self._handle, self.socket_path)
+        for _ in range(self._n_containers):
+            self._create()
+        for _ in range(self._n_exited):
+            self._create(running=False)
+        self.loop.create_task(self._write_logs())
+        if self.restart_interval:
+            self.loop.create_task(self._every(self.restart_interval, self._restart_one))
+        if self.remove_interval:
+            self.loop.create_task(self._every(self.remove_interval, self._remove_one))
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks(self.loop) if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def _create(self, running: bool = True) -> FakeContainer:
+        number = next(self._numbers)
+        kind = self.kind if self.kind != 'mixed' else CONTENT_KINDS[number % len(CONTENT_KINDS)]
+        container = FakeContainer(number, self.rate, kind, tty=number % 5 == 4, daemon_id=self.socket_path)
+        container.running = running
+        self.containers[container.id] = container
+        self._emit('create', container)
+        if running:
+            self._emit('start', container)
+        return container
+
+    def _emit(self, action: str, container: FakeContainer):
+        event = {'Type': 'container', 'Action': action, 'status': action, 'id': container.id,
+                 'Actor': {'ID': container.id, 'Attributes': {'name': container.name, **container.labels}},
+                 'time': int(time.time()), 'timeNano': time.time_ns()}
+        for queue in self._events:
+            queue.put_nowait(event)
+        for listener in self.listeners:
+            listener(action, container)
+
+    async def _write_logs(self):
+        owed: Dict[str, float] = collections.defaultdict(float)
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(WRITE_INTERVAL)
+            now = time.monotonic()
+            for container in list(self.containers.values()):
+                if not container.running:
+                    continue
+                owed[container.id] += container.rate * (now - last)
+                n_lines = int(owed[container.id])
+                if n_lines:
+                    owed[container.id] -= n_lines
+                    container.write(n_lines)
+                    self.lines_written += n_lines
+            last = now
+
+    async def _every(self, interval: float, action: Callable):
+        while True:
+            await asyncio.sleep(interval)
+            running = [container for container in self.containers.values() if container.running]
+            if running:
+                await action(self.random.choice(running))
+
+    async def _restart_one(self, container: FakeContainer):
+        container.running = False
+        container.wake()
+        self._emit('die', container)
+        await asyncio.sleep(RESTART_DOWNTIME)
+        if not container.removed:
+            container.running = True
+            self._emit('start', container)
+
+    async def _remove_one(self, container: FakeContainer):
+        container.running = False
+        container.removed = True
+        container.wake()
+        del self.containers[container.id]
+        self._emit('die', container)
+        self._emit('destroy', container)
+        self._create()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                url = urllib.parse.urlsplit(target)
+                path = VERSION_PREFIX.sub('', url.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                keep_alive = await self._route(path, params, writer)
+                if not keep_alive or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, path: str, params: Dict[str, str], writer: asyncio.StreamWriter) -> bool:
+        parts = path.strip('/').split('/')
+        endpoint = parts[0] if parts[0] != 'containers' or len(parts) < 3 else f'containers/{parts[2]}'
+        self.requests[endpoint] += 1
+        if path == '/_ping':
+            return await self._respond(writer, 200, b'OK', 'text/plain')
+        if path == '/version':
+            return await self._respond_json(writer, 200, {'ApiVersion': API_VERSION, 'Version': '24.0.0',
+                                                          'MinAPIVersion': '1.12'})
+        filters = json.loads(params.get('filters', '{}'))
+        if path == '/containers/json':
+            summaries = [container.summary() for container in self.containers.values()]
+            return await self._respond_json(writer, 200, [
+                summary for summary in summaries
+                if match_filters(filters, summary['State'], summary['Names'][0], summary['Labels'])])
+        if path == '/events':
+            await self._stream_events(writer, filters)
+            return False
+        if parts[0] == 'containers' and len(parts) == 3:
+            container = self.containers.get(parts[1])
+            if container is None:
+                return await self._respond_json(writer, 404, {'message': f'No such container: {parts[1]}'})
+            if parts[2] == 'json':
+                return await self._respond_json(writer, 200, container.inspect())
+            if parts[2] == 'logs':
+                await self._stream_logs(writer, container, params)
+                return True
+        return await self._respond_json(writer, 404, {'message': 'page not found'})
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str) -> bool:
+        writer.write(f'HTTP/1.1 {status} X\r\nContent-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await writer.drain()
+        return True
+
+    async def _respond_json(self, writer: asyncio.StreamWriter, status: int, value: object) -> bool:
+        return await self._respond(writer, status, json.dumps(value).encode(), 'application/json')
+
+    @staticmethod
+    async def _write_chunk(writer: asyncio.StreamWriter, data: bytes):
+        writer.write(b'%x\r\n' % len(data) + data + b'\r\n')
+        await writer.drain()
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, filters: Dict[str, List[str]]):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n')
+        queue: asyncio.Queue = asyncio.Queue()
+        self._events.append(queue)
+        # events can only be filtered by label (their attributes)
+        filters = {'label': filters['label']} if 'label' in filters else {}
+        try:
+            while True:
+                event = await queue.get()
+                if not match_filters(filters, '', '', event['Actor']['Attributes']):
+                    continue
+                await self._write_chunk(writer, json.dumps(event).encode() + b'\n')
+        finally:
+            self._events.remove(queue)
+
+    async def _stream_logs(self, writer: asyncio.StreamWriter, container: FakeContainer, params: Dict[str, str]):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/vnd.docker.raw-stream\r\n'
+                     b'Transfer-Encoding: chunked\r\n\r\n')
+        timestamps = params.get('timestamps') in ('1', 'true')
+        since = parse_since(params['since']) if 'since' in params else None
+        until = parse_since(params['until']) if 'until' in params else None
+
+        def encode(lines) -> bytes:
+            out = []
+            for timestamp, text in lines:
+                line = (format_timestamp(timestamp).encode() + b' ' + text if timestamps else text) + b'\n'
+                if container.tty:
+                    out.append(line)
+                else:
+                    out.append(bytes((1, 0, 0, 0)) + len(line).to_bytes(4, 'big') + line)
+            return b''.join(out)
+
+        # the daemon applies tail before since/until
+        lines = list(container.history)
+        tail = params.get('tail', 'all')
+        if tail != 'all' and int(tail) >= 0:
+            lines = lines[len(lines) - int(tail):] if int(tail) else []
+        lines = [line for line in lines
+                 if (since is None or line[0] >= since) and (until is None or line[0] < until)]
+        if lines:
+            await self._write_chunk(writer, encode(lines))
+
+        if params.get('follow') in ('1', 'true') and until is None:
+            sent = container.written
+            while container.running:
+                changed = container.changed
+                await changed.wait()
+                new = container.written - sent
+                if new:
+                    await self._write_chunk(writer, encode(list(itertools.islice(
+                        container.history, max(len(container.history) - new, 0), None))))
+                    sent = container.written
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
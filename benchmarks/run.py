@@ -0,0 +1,501 @@
+"""Benchmark CaptainsLog against a fake docker daemon
+
+Measures end-to-end latency from a line being written by a container to it
+being displayed, lines ingested per second, main loop stalls, memory growth
+and the request rate seen by the daemon.
+
+The headless mode (default, for CI) drives the core classes the viewer is
+built from (LogIngestionEngine, ContainerLog, SearchWorker, LogCacheWorker),
+with a stand-in for the GTK main loop applying the merged view updates once
+per frame. The gui mode runs the viewer itself (needs GTK):
+
+    python benchmarks/run.py --containers 50 --rate 200 --duration 30
+    python benchmarks/run.py --restart-interval 2 --remove-interval 5 --json bench_output.json
+    python benchmarks/run.py --mode gui --open 3
+    python benchmarks/run.py --mode gui --containers 500 --max-startup-ms 1500
+    CAPTAINSLOG_FILTER=status=running python benchmarks/run.py --mode gui --exited 5000
+    python benchmarks/run.py --containers 25 --timeline
+
+The gui mode also reports the startup milestones of the viewer (first frame,
+containers listed, sidebar filled). With --max-p99-latency-ms / --max-stall-ms /
+--min-lines-per-s / --max-startup-ms the exit status is 1 when a result is out of bounds.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from fake_daemon import CONTENT_KINDS, FakeContainer, FakeDockerDaemon  # noqa: E402
+
+from CaptainsLog.ansi import parse_ansi  # noqa: E402
+from CaptainsLog.container_log import ContainerLog  # noqa: E402
+from CaptainsLog.ingestion import LogIngestionEngine  # noqa: E402
+from CaptainsLog.log_cache import LogCache, LogCacheWorker, cache_directory  # noqa: E402
+from CaptainsLog.search import SearchWorker  # noqa: E402
+from CaptainsLog.startup import STARTUP_SIDEBAR  # noqa: E402
+from CaptainsLog.structured import parse_filter  # noqa: E402
+from CaptainsLog.timeline import TIMELINE_FLUSH_INTERVAL, MergedTimeline  # noqa: E402
+
+logger = logging.getLogger(__file__)
+
+# seconds between frames of the headless main loop (60 Hz)
+FRAME_INTERVAL = 1 / 60
+# main loop time (seconds) spent applying updates per frame, as UiUpdateScheduler.FRAME_BUDGET
+FRAME_BUDGET = 0.004
+# rows of a log view bound (ANSI parsed) when it is refreshed
+VISIBLE_ROWS = 50
+# seconds after startup before memory and rates are measured, so the initial backlog is not counted
+WARMUP_S = 1.0
+# milliseconds between heartbeats of the gui main loop, their lateness is the stall time
+HEARTBEAT_MS = 10
+# queries run on every container after the run
+SEARCH_QUERIES = [('request 4', False), ('error', False), (r'\d{3}ms', True)]
+FIELD_FILTER = 'level>=error'
+
+
+def rss_bytes() -> int:
+    """Current resident memory of the process (peak on systems without /proc)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # kilobytes on Linux, bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max of samples (in the unit of the samples), None when there are none"""
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None, 'count': 0}
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return round(ordered[min(int(fraction * len(ordered)), len(ordered) - 1)], 3)
+
+    return {'p50': at(0.5), 'p95': at(0.95), 'p99': at(0.99), 'max': round(ordered[-1], 3), 'count': len(ordered)}
+
+
+class FrameLoop:
+    """Headless stand-in for the GTK main loop and its UiUpdateScheduler
+
+    Updates requested from any thread are merged like UiUpdateScheduler does,
+    and applied on a thread once per frame until the frame budget is used up.
+    The time each frame spends applying updates is recorded as main loop stall.
+    """
+
+    def __init__(self, interval: float = FRAME_INTERVAL, budget: float = FRAME_BUDGET):
+        self.interval = interval
+        self.budget = budget
+        # seconds spent applying updates, per frame that had any
+        self.stalls: List[float] = []
+        self.dropped_frames = 0
+        self._pending: 'OrderedDict[Tuple[Callable, tuple], None]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='frame-loop', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def schedule(self, callback: Callable, *args):
+        with self._lock:
+            self._pending[(callback, args)] = None
+
+    def _run(self):
+        next_frame = time.perf_counter()
+        while not self._stop.is_set():
+            next_frame += self.interval
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.dropped_frames += 1
+                next_frame = time.perf_counter()
+            start = time.perf_counter()
+            deadline = start + self.budget
+            ran = False
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    (callback, args), _ = self._pending.popitem(last=False)
+                ran = True
+                try:
+                    callback(*args)
+                except Exception:
+                    logger.exception(f"UI update {callback} failed")
+                if time.perf_counter() >= deadline:
+                    break
+            if ran:
+                self.stalls.append(time.perf_counter() - start)
+
+
+class HeadlessViewer:
+    """The parts of MainWindow that ingest, index, cache and display logs, without GTK
+
+    Args:
+        socket_path (str): unix socket of the (fake) daemon
+        n_open (Optional[int]): number of containers whose page is open (displayed), None for all
+        cache_root (Optional[Path]): directory of the on-disk log caches, None to disable caching
+        timeline (bool): also merge the logs of every container into a timeline
+    """
+
+    def __init__(self, socket_path: str, n_open: Optional[int], cache_root: Optional[Path], timeline: bool = False):
+        self.frames = FrameLoop()
+        self.ingestion = LogIngestionEngine(dispatch=self.frames.schedule, docker_host=f'unix://{socket_path}')
+        self.search_worker = SearchWorker(dispatch=self.frames.schedule)
+        self.cache_worker = LogCacheWorker()
+        self.cache_root = cache_root
+        self.n_open = n_open
+        self.container_logs: Dict[str, ContainerLog] = {}
+        self.removed: List[ContainerLog] = []
+        # end_seq of each open page when it was last displayed
+        self.displayed: Dict[str, int] = {}
+        # seconds from a line being written to it being displayed
+        self.latencies: List[float] = []
+        self.measuring = False
+        self.lock = threading.Lock()
+        self.timeline = MergedTimeline() if timeline else None
+        # seconds each merge of the timeline took, and from a line being written to it being merged
+        self.timeline_flushes: List[float] = []
+        self.timeline_latencies: List[float] = []
+        self._stop = threading.Event()
+        self._timeline_thread = threading.Thread(target=self._flush_timeline, name='timeline', daemon=True)
+
+    def start(self):
+        self.frames.start()
+        self.ingestion.start()
+        if self.timeline is not None:
+            self._timeline_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.ingestion.stop()
+        self.frames.stop()
+        self.cache_worker.stop()
+
+    def _flush_timeline(self):
+        """Merge the timeline every TIMELINE_FLUSH_INTERVAL, like MainWindow.flush_timeline"""
+        while not self._stop.wait(TIMELINE_FLUSH_INTERVAL):
+            start = time.perf_counter()
+            n_lines = self.timeline.flush()
+            if self.measuring and n_lines:
+                self.timeline_flushes.append(time.perf_counter() - start)
+                store = self.timeline.store
+                newest = store.get_timestamp(store.end_seq - 1)
+                self.timeline_latencies.append((time.time_ns() - newest) / 1e9)
+
+    def on_container_event(self, action: str, container: FakeContainer):
+        """Add and remove containers like MainWindow.on_inventory_changed (called on the daemon thread)"""
+        with self.lock:
+            if action == 'create':
+                cache = LogCache(cache_directory(container.name, self.cache_root)) if self.cache_root else None
+                container_log = ContainerLog(container.id, cache)
+                self.container_logs[container.id] = container_log
+                container_log.store.add_listener(partial(self.schedule_index_updates, container_log))
+                if self.timeline is not None:
+                    self.timeline.add_source(container.name, container_log.store)
+                if self.n_open is None or len(self.displayed) < self.n_open:
+                    container_log.open()
+                    self.displayed[container.id] = 0
+                self.cache_worker.submit(self.start_following, container_log)
+            elif action == 'destroy':
+                self.ingestion.unfollow(container.id)
+                container_log = self.container_logs.pop(container.id, None)
+                if container_log is not None:
+                    self.removed.append(container_log)
+
+    def start_following(self, container_log: ContainerLog):
+        last_timestamp = container_log.load_cache(self.cache_worker)
+        self.ingestion.follow(container_log.container_id, container_log.store,
+                              partial(self.sync_container_page, container_log.container_id),
+                              tail=0, since=last_timestamp)
+
+    def schedule_index_updates(self, container_log: ContainerLog, timestamps: List[int], lines: List[str]):
+        self.search_worker.schedule_update(container_log.index)
+        self.search_worker.schedule_update(container_log.fields)
+
+    def sync_container_page(self, container_id: str):
+        """Display new lines of an open page: bind the visible rows and record the latency of the newest line"""
+        if container_id not in self.displayed:
+            return
+        container_log = self.container_logs.get(container_id)
+        if container_log is None:
+            return
+        store = container_log.store
+        with store.lock:
+            end_seq = store.end_seq
+            newest = store.get_timestamp(end_seq - 1) if end_seq else None
+        if end_seq == self.displayed[container_id]:
+            return
+        self.displayed[container_id] = end_seq
+        start_seq, lines = store.read(max(end_seq - VISIBLE_ROWS, store.first_seq), end_seq)
+        for line in lines:
+            parse_ansi(line)
+        if newest and self.measuring:
+            self.latencies.append((time.time_ns() - newest) / 1e9)
+
+    def ingested_lines(self) -> int:
+        with self.lock:
+            container_logs = list(self.container_logs.values()) + self.removed
+        return sum(container_log.metrics.total_lines for container_log in container_logs)
+
+    def search(self) -> Dict[str, float]:
+        """Index everything left to index, then time the benchmark queries over all containers (milliseconds)"""
+        with self.lock:
+            container_logs = list(self.container_logs.values())
+        timings = {}
+        start = time.perf_counter()
+        for container_log in container_logs:
+            container_log.index.update()
+            container_log.fields.update()
+        timings['index_catch_up'] = (time.perf_counter() - start) * 1000
+        for query, regex in SEARCH_QUERIES:
+            start = time.perf_counter()
+            for container_log in container_logs:
+                container_log.index.search(query, regex)
+            timings[f'search {query!r}'] = (time.perf_counter() - start) * 1000
+        filters = parse_filter(FIELD_FILTER)
+        start = time.perf_counter()
+        for container_log in container_logs:
+            container_log.fields.filter(filters)
+        timings[f'filter {FIELD_FILTER!r}'] = (time.perf_counter() - start) * 1000
+        return {name: round(value, 3) for name, value in timings.items()}
+
+
+def run_headless(args: argparse.Namespace, daemon: FakeDockerDaemon, work_dir: Path) -> dict:
+    viewer = HeadlessViewer(daemon.socket_path, args.open, None if args.no_cache else work_dir / 'cache',
+                            timeline=args.timeline)
+    daemon.add_listener(viewer.on_container_event)
+    viewer.start()
+    daemon.start()
+    try:
+        time.sleep(WARMUP_S)
+        viewer.frames.stalls.clear()
+        viewer.measuring = True
+        start = measure_start(daemon, viewer.ingested_lines())
+        time.sleep(args.duration)
+        result = measure_end(daemon, viewer.ingested_lines(), start)
+        viewer.measuring = False
+        result['latency_ms'] = percentiles([latency * 1000 for latency in viewer.latencies])
+        result['main_loop'] = stall_summary(viewer.frames.stalls, args.duration,
+                                            dropped_frames=viewer.frames.dropped_frames)
+        result['search_ms'] = viewer.search()
+        if viewer.timeline is not None:
+            result['timeline'] = {'sources': len(viewer.timeline.sources),
+                                  'merged_lines': viewer.timeline.store.end_seq,
+                                  'late_lines': viewer.timeline.merge.late_lines,
+                                  'flush_ms': percentiles([flush * 1000 for flush in viewer.timeline_flushes]),
+                                  'latency_ms': percentiles([latency * 1000
+                                                             for latency in viewer.timeline_latencies])}
+    finally:
+        viewer.stop()
+    return result
+
+
+def run_gui(args: argparse.Namespace, daemon: FakeDockerDaemon, work_dir: Path) -> dict:
+    os.environ['DOCKER_HOST'] = f'unix://{daemon.socket_path}'
+    os.environ['XDG_CACHE_HOME'] = str(work_dir / 'cache')
+    from gi.repository import GLib
+
+    from CaptainsLog.main import MyApp
+    from CaptainsLog.startup import startup
+
+    daemon.start()
+    app = MyApp(application_id='com.alexdlukens.CaptainsLog.Benchmark')
+    result: dict = {}
+    stalls: List[float] = []
+    latencies: List[float] = []
+    state = {'measuring': False, 'last_beat': time.perf_counter()}
+
+    def heartbeat():
+        now = time.perf_counter()
+        if state['measuring']:
+            stalls.append(max(now - state['last_beat'] - HEARTBEAT_MS / 1000, 0))
+        state['last_beat'] = now
+        return GLib.SOURCE_CONTINUE
+
+    def ingested_lines() -> int:
+        return sum(container_log.metrics.total_lines for container_log in app.win.container_logs.values())
+
+    def on_activate(app):
+        win = app.win
+        sync_container_page = win.sync_container_page
+
+        def timed_sync_container_page(container_id: str):
+            sync_container_page(container_id)
+            container_log = win.container_logs.get(container_id)
+            if state['measuring'] and container_id in win.container_pages and container_log is not None:
+                store = container_log.store
+                with store.lock:
+                    newest = store.get_timestamp(store.end_seq - 1) if store.end_seq else None
+                if newest:
+                    latencies.append((time.time_ns() - newest) / 1e9)
+
+        # looked up when each container starts being followed, which happens after activation
+        win.sync_container_page = timed_sync_container_page
+        GLib.timeout_add(HEARTBEAT_MS, heartbeat)
+        GLib.timeout_add(int(WARMUP_S * 1000), start_measuring)
+
+    def start_measuring():
+        # open the first pages (the last one stays visible), then measure
+        for container_id in list(app.win.container_logs)[:args.open or 1]:
+            app.win.show_page(container_id)
+        state['measuring'] = True
+        state['start'] = measure_start(daemon, ingested_lines())
+        GLib.timeout_add(int(args.duration * 1000), finish)
+        return GLib.SOURCE_REMOVE
+
+    def finish():
+        state['measuring'] = False
+        result.update(measure_end(daemon, ingested_lines(), state['start']))
+        result['latency_ms'] = percentiles([latency * 1000 for latency in latencies])
+        result['main_loop'] = stall_summary(stalls, args.duration)
+        result['startup_ms'] = {milestone: round(elapsed * 1000, 1) for milestone, elapsed in startup.marks}
+        app.win.shutdown()
+        app.quit()
+        return GLib.SOURCE_REMOVE
+
+    app.connect('activate', on_activate)
+    app.run(sys.argv[:1])
+    return result
+
+
+def measure_start(daemon: FakeDockerDaemon, ingested: int) -> dict:
+    return {'time': time.perf_counter(), 'ingested': ingested, 'written': daemon.lines_written,
+            'requests': daemon.total_requests(), 'rss': rss_bytes()}
+
+
+def measure_end(daemon: FakeDockerDaemon, ingested: int, start: dict) -> dict:
+    elapsed = time.perf_counter() - start['time']
+    rss = rss_bytes()
+    requests = daemon.total_requests() - start['requests']
+    return {
+        'elapsed_s': round(elapsed, 3),
+        'lines_written': daemon.lines_written - start['written'],
+        'lines_ingested': ingested - start['ingested'],
+        'ingested_lines_per_s': round((ingested - start['ingested']) / elapsed, 1),
+        'memory_mb': {'start': round(start['rss'] / 2 ** 20, 1), 'end': round(rss / 2 ** 20, 1),
+                      'growth': round((rss - start['rss']) / 2 ** 20, 1)},
+        'daemon': {'requests': requests, 'requests_per_s': round(requests / elapsed, 2),
+                   'by_endpoint': dict(daemon.requests)},
+    }
+
+
+def stall_summary(stalls: List[float], duration: float, dropped_frames: Optional[int] = None) -> dict:
+    summary = {'stall_ms': percentiles([stall * 1000 for stall in stalls]),
+               'busy_fraction': round(sum(stalls) / duration, 4)}
+    if dropped_frames is not None:
+        summary['dropped_frames'] = dropped_frames
+    return summary
+
+
+def print_report(result: dict):
+    latency = result['latency_ms']
+    stall = result['main_loop']['stall_ms']
+    memory = result['memory_mb']
+    daemon = result['daemon']
+    print(f"{result['containers']} containers x {result['rate']} lines/s ({result['content']}), "
+          f"{result['mode']} mode, {result['elapsed_s']}s")
+    print(f"  ingested      {result['lines_ingested']} of {result['lines_written']} lines written, "
+          f"{result['ingested_lines_per_s']} lines/s")
+    print(f"  latency (ms)  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}")
+    print(f"  stall (ms)    p50 {stall['p50']}  p99 {stall['p99']}  max {stall['max']}  "
+          f"busy {result['main_loop']['busy_fraction']:.1%}")
+    print(f"  memory (MB)   {memory['start']} -> {memory['end']} ({memory['growth']:+})")
+    print(f"  daemon        {daemon['requests']} requests, {daemon['requests_per_s']}/s")
+    for name, value in result.get('search_ms', {}).items():
+        print(f"  {name:<22}{value} ms")
+    for milestone, elapsed in result.get('startup_ms', {}).items():
+        print(f"  startup       {milestone:<18}{elapsed} ms")
+    timeline = result.get('timeline')
+    if timeline is not None:
+        print(f"  timeline      {timeline['merged_lines']} lines of {timeline['sources']} containers merged, "
+              f"{timeline['late_lines']} out of order")
+        print(f"  merge (ms)    p50 {timeline['flush_ms']['p50']}  p99 {timeline['flush_ms']['p99']}  "
+              f"latency p99 {timeline['latency_ms']['p99']}")
+
+
+def check_bounds(args: argparse.Namespace, result: dict) -> List[str]:
+    failures = []
+    p99 = result['latency_ms']['p99']
+    if args.max_p99_latency_ms is not None and (p99 is None or p99 > args.max_p99_latency_ms):
+        failures.append(f"p99 latency {p99} ms above {args.max_p99_latency_ms} ms")
+    max_stall = result['main_loop']['stall_ms']['max'] or 0
+    if args.max_stall_ms is not None and max_stall > args.max_stall_ms:
+        failures.append(f"main loop stall {max_stall} ms above {args.max_stall_ms} ms")
+    if args.min_lines_per_s is not None and result['ingested_lines_per_s'] < args.min_lines_per_s:
+        failures.append(f"ingested {result['ingested_lines_per_s']} lines/s, below {args.min_lines_per_s}")
+    startup_ms = result.get('startup_ms', {}).get(STARTUP_SIDEBAR)
+    if args.max_startup_ms is not None and (startup_ms is None or startup_ms > args.max_startup_ms):
+        failures.append(f"sidebar filled after {startup_ms} ms, above {args.max_startup_ms} ms")
+    return failures
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark CaptainsLog against a fake docker daemon")
+    parser.add_argument('--mode', choices=('headless', 'gui'), default='headless')
+    parser.add_argument('-c', '--containers', type=int, default=20, help="containers kept running")
+    parser.add_argument('-r', '--rate', type=float, default=100.0, help="lines per second per container")
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help="seconds measured, after a warm-up")
+    parser.add_argument('--content', choices=CONTENT_KINDS + ('mixed',), default='mixed',
+                        help="log lines written: ASCII, multibyte UTF-8, ANSI coloured, JSON or a mix")
+    parser.add_argument('--restart-interval', type=float, help="seconds between restarts of a random container")
+    parser.add_argument('--remove-interval', type=float,
+                        help="seconds between removals of a random container (replaced by a new one)")
+    parser.add_argument('--exited', type=int, default=0,
+                        help="exited containers listed by the daemon besides the running ones (e.g. CI leftovers)")
+    parser.add_argument('--open', type=int, help="container pages open (default: all headless, 1 in the gui)")
+    parser.add_argument('--no-cache', action='store_true', help="do not write the on-disk log cache (headless)")
+    parser.add_argument('--timeline', action='store_true',
+                        help="also merge every container into a timeline and time the merge (headless)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--max-p99-latency-ms', type=float)
+    parser.add_argument('--max-stall-ms', type=float)
+    parser.add_argument('--min-lines-per-s', type=float)
+    parser.add_argument('--max-startup-ms', type=float, help="bound of the time until the sidebar is filled (gui)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory(prefix='captainslog-bench-') as work_dir:
+        daemon = FakeDockerDaemon(os.path.join(work_dir, 'docker.sock'), n_containers=args.containers,
+                                  rate=args.rate, kind=args.content, restart_interval=args.restart_interval,
+                                  remove_interval=args.remove_interval, seed=args.seed, n_exited=args.exited)
+        try:
+            run = run_gui if args.mode == 'gui' else run_headless
+            result = run(args, daemon, Path(work_dir))
+        finally:
+            daemon.stop()
+    result.update(mode=args.mode, containers=args.containers, rate=args.rate, content=args.content)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    failures = check_bounds(args, result)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,6 @@ import os
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'src')))
 
-from CaptainsLog.main import app
+from CaptainsLog.main import main
 
-app.run(sys.argv)
\ No newline at end of file
+main(sys.argv)
\ No newline at end of file
@@ -0,0 +1,177 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+ESC = '\x1b'
+# select graphic rendition: colours and text attributes
+SGR_SEQUENCE = re.compile(r'\x1b\[([0-9;:]*)m')
+# any escape sequence: CSI (including SGR), OSC (e.g. window title, hyperlinks) and two character sequences
+ESCAPE_SEQUENCE = re.compile(r'\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_]|$)')
+# maximum number of distinct styles kept for reuse, further styles are still returned but not kept
+MAX_STYLES = 1024
+
+# the 16 standard colours (xterm defaults)
+BASE_COLORS = [
+    (0x00, 0x00, 0x00), (0xcd, 0x00, 0x00), (0x00, 0xcd, 0x00), (0xcd, 0xcd, 0x00),
+    (0x00, 0x00, 0xee), (0xcd, 0x00, 0xcd), (0x00, 0xcd, 0xcd), (0xe5, 0xe5, 0xe5),
+    (0x7f, 0x7f, 0x7f), (0xff, 0x00, 0x00), (0x00, 0xff, 0x00), (0xff, 0xff, 0x00),
+    (0x5c, 0x5c, 0xff), (0xff, 0x00, 0xff), (0x00, 0xff, 0xff), (0xff, 0xff, 0xff),
+]
+
+Color = Tuple[int, int, int]
+
+
+def palette_color(number: int) -> Color:
+    """RGB value of a colour of the 256 colour palette"""
+    if number < 16:
+        return BASE_COLORS[number]
+    if number < 232:
+        number -= 16
+        levels = [0 if level == 0 else 55 + 40 * level for level in (number // 36, number // 6 % 6, number % 6)]
+        return levels[0], levels[1], levels[2]
+    grey = 8 + 10 * (number - 232)
+    return grey, grey, grey
+
+
+class AnsiStyle(NamedTuple):
+    foreground: Optional[Color] = None
+    background: Optional[Color] = None
+    bold: bool = False
+    dim: bool = False
+    italic: bool = False
+    underline: bool = False
+    inverse: bool = False
+    strikethrough: bool = False
+
+
+DEFAULT_STYLE = AnsiStyle()
+# (start, end, style) of a run of styled text, start/end are character offsets in the plain text
+StyleSpan = Tuple[int, int, AnsiStyle]
+
+_styles: Dict[AnsiStyle, AnsiStyle] = {DEFAULT_STYLE: DEFAULT_STYLE}
+
+
+def _intern(style: AnsiStyle) -> AnsiStyle:
+    """Return the shared instance of style, so equal styles are one object"""
+    shared = _styles.get(style)
+    if shared is not None:
+        return shared
+    if len(_styles) < MAX_STYLES:
+        _styles[style] = style
+    return style
+
+
+def _extended_color(codes: List[int], i: int) -> Tuple[Optional[Color], int]:
+    """Parse the colour of a 38/48 code starting at codes[i], return it and the index of the next code"""
+    if i + 1 < len(codes) and codes[i + 1] == 5:
+        if i + 2 < len(codes):
+            return palette_color(codes[i + 2] % 256), i + 3
+        return None, i + 3
+    if i + 1 < len(codes) and codes[i + 1] == 2:
+        if i + 4 < len(codes):
+            r, g, b = (value % 256 for value in codes[i + 2:i + 5])
+            return (r, g, b), i + 5
+        return None, i + 5
+    return None, i + 1
+
+
+def apply_sgr(style: AnsiStyle, parameters: str) -> AnsiStyle:
+    """Return style after applying the parameters of an SGR sequence (e.g. '1;31')"""
+    codes = [int(code) if code else 0 for code in re.split('[;:]', parameters)]
+    changes = style._asdict()
+    i = 0
+    while i < len(codes):
+        code = codes[i]
+        i += 1
+        if code == 0:
+            changes = DEFAULT_STYLE._asdict()
+        elif code == 1:
+            changes['bold'] = True
+        elif code == 2:
+            changes['dim'] = True
+        elif code == 3:
+            changes['italic'] = True
+        elif code == 4:
+            changes['underline'] = True
+        elif code == 7:
+            changes['inverse'] = True
+        elif code == 9:
+            changes['strikethrough'] = True
+        elif code == 22:
+            changes['bold'] = changes['dim'] = False
+        elif code == 23:
+            changes['italic'] = False
+        elif code == 24:
+            changes['underline'] = False
+        elif code == 27:
+            changes['inverse'] = False
+        elif code == 29:
+            changes['strikethrough'] = False
+        elif 30 <= code <= 37:
+            changes['foreground'] = BASE_COLORS[code - 30]
+        elif 90 <= code <= 97:
+            changes['foreground'] = BASE_COLORS[code - 90 + 8]
+        elif 40 <= code <= 47:
+            changes['background'] = BASE_COLORS[code - 40]
+        elif 100 <= code <= 107:
+            changes['background'] = BASE_COLORS[code - 100 + 8]
+        elif code == 39:
+            changes['foreground'] = None
+        elif code == 49:
+            changes['background'] = None
+        elif code in (38, 48):
+            color, i = _extended_color(codes, i - 1)
+            changes['foreground' if code == 38 else 'background'] = color
+    return _intern(AnsiStyle(**changes))
+
+
+def parse_ansi(text: str) -> Tuple[str, List[StyleSpan]]:
+    """Remove the escape sequences of a line, returning the plain text and its styled runs
+
+    Styles only last until the end of the line. Escape sequences other than
+    SGR (cursor movement, window titles, ...) are dropped.
+
+    Args:
+        text (str): line as written by the container
+
+    Returns:
+        Tuple[str, List[StyleSpan]]: plain text, and (start, end, style) of every run
+        of non-default style in it
+    """
+    if ESC not in text:
+        return text, []
+    parts: List[str] = []
+    spans: List[StyleSpan] = []
+    style = DEFAULT_STYLE
+    length = 0
+    position = 0
+    for escape in ESCAPE_SEQUENCE.finditer(text):
+        if escape.start() > position:
+            part = text[position:escape.start()]
+            if style is not DEFAULT_STYLE:
+                spans.append((length, length + len(part), style))
+            parts.append(part)
+            length += len(part)
+        position = escape.end()
+        sgr = SGR_SEQUENCE.fullmatch(escape.group())
+        if sgr is not None:
+            style = apply_sgr(style, sgr.group(1))
+    if position < len(text):
+        part = text[position:]
+        if style is not DEFAULT_STYLE:
+            spans.append((length, length + len(part), style))
+        parts.append(part)
+    return ''.join(parts), spans
+
+
+def strip_ansi(text: str) -> str:
+    """Return text without escape sequences"""
+    if ESC not in text:
+        return text
+    return ESCAPE_SEQUENCE.sub('', text)
+
+
+def plain_offset(text: str, offset: int) -> int:
+    """Convert a character offset in text to the offset in the text without escape sequences"""
+    if ESC not in text:
+        return offset
+    return len(strip_ansi(text[:offset]))
@@ -0,0 +1,322 @@
+import argparse
+import datetime
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TextIO, Tuple
+
+# first, so the startup time includes importing the other modules
+from .startup import startup
+from .docker_api import HOSTS_ENV, docker_hosts
+from .docker_utils import FILTER_ENV, ContainerFilter, ContainerInventory, ContainerState, parse_container_filter
+from .export import (COMPRESSIONS, ExportCancelled, ExportError, ExportOptions, ExportSource, FileOutput,
+                     compression_for, export_logs)
+from .ingestion import LogIngestionEngine
+from .log_cache import LogCache, LogCacheLocked, LogCacheWorker, cache_directory, default_cache_root
+from .log_stream import format_timestamp
+from .profiling import profiler
+
+logger = logging.getLogger(__file__)
+
+# existing lines printed per container when starting to tail
+DEFAULT_TAIL_LINES = 10
+# units of relative times given to export --since/--until, in seconds
+TIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 24 * 3600, 'w': 7 * 24 * 3600}
+FILTER_HELP = ("only list and follow the containers matching KEY=VALUE (status, name, label or project), "
+               "applied by the docker daemons; repeat for several")
+HOST_HELP = ("docker host to connect to, e.g. unix:///var/run/docker.sock, tcp://build:2375 or ssh://me@web1; "
+             f"repeat for several hosts (default: {HOSTS_ENV}, else DOCKER_HOST)")
+
+
+class LineWriter:
+    """Log sink writing the lines of one container to a text stream, prefixed with the container name
+
+    Used in place of a LogStore: the ingestion engine calls extend with each batch.
+    """
+
+    def __init__(self, name: str, output: TextIO, lock: threading.Lock, on_closed: Callable[[], object],
+                 timestamps: bool = False):
+        self.prefix = f'{name} | '
+        self.output = output
+        self.lock = lock
+        self.on_closed = on_closed
+        self.timestamps = timestamps
+
+    def extend(self, timestamps: List[int], lines: List[str]):
+        if self.timestamps:
+            text = ''.join([f'{self.prefix}{format_timestamp(timestamp)} {line}\n'
+                            for timestamp, line in zip(timestamps, lines)])
+        else:
+            text = ''.join([f'{self.prefix}{line}\n' for line in lines])
+        with self.lock:
+            try:
+                self.output.write(text)
+                self.output.flush()
+            except BrokenPipeError:
+                # e.g. piped into head
+                self.on_closed()
+
+
+class CacheRecorder:
+    """Log sink appending the lines of one container to its on-disk cache, on the cache worker thread"""
+
+    def __init__(self, cache: LogCache, worker: LogCacheWorker):
+        self.cache = cache
+        self.worker = worker
+
+    def extend(self, timestamps: List[int], lines: List[str]):
+        self.worker.submit(self.cache.append, timestamps, lines)
+
+
+class Follower:
+    """Follow the logs of a set of containers, picking up new containers as they appear
+
+    Args:
+        start (Callable[[ContainerState], None]): set up the sink of a container and start following it
+        selectors (List[str]): container names or (prefixes of) ids to follow, empty for every container
+        engine (LogIngestionEngine): engine watching the docker hosts
+        hosts (List[str]): docker hosts to follow containers of
+        container_filter (ContainerFilter): containers listed by the docker daemons
+    """
+
+    def __init__(self, start: Callable[[ContainerState], None], selectors: List[str], engine: LogIngestionEngine,
+                 hosts: List[str], container_filter: ContainerFilter = ContainerFilter()):
+        self.start = start
+        self.selectors = selectors
+        self.engine = engine
+        self.hosts = hosts
+        self.followed: Dict[str, ContainerState] = {}
+        self.changed = threading.Event()
+        self.inventory = ContainerInventory(on_change=self.changed.set, label_hosts=len(hosts) > 1)
+        self.inventory.set_filter(container_filter)
+
+    def selected(self, state: ContainerState) -> bool:
+        if not self.selectors:
+            return True
+        # with several hosts names are qualified (name@host), the bare name selects the container on every host
+        return any(selector in (state.name, state.name.rpartition('@')[0], state.id) or state.id.startswith(selector)
+                   for selector in self.selectors)
+
+    def run(self, stop: threading.Event):
+        """Follow containers until stop is set"""
+        for docker_host in self.hosts:
+            self.engine.watch(self.inventory, docker_host)
+        while not stop.is_set():
+            self.changed.wait(0.5)
+            self.changed.clear()
+            for container_id, state in self.inventory.pop_changes().items():
+                if state is None:
+                    self.followed.pop(container_id, None)
+                elif container_id not in self.followed and self.selected(state):
+                    self.followed[container_id] = state
+                    self.start(state)
+
+
+def _run(start: Callable[[ContainerState], None], args: argparse.Namespace, engine: LogIngestionEngine,
+         hosts: List[str], stop: threading.Event):
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    engine.start()
+    try:
+        Follower(start, args.containers, engine, hosts, args.container_filter).run(stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+
+
+def tail(args: argparse.Namespace) -> int:
+    """Stream the logs of many containers to stdout"""
+    hosts = docker_hosts(args.host)
+    engine = LogIngestionEngine(dispatch=lambda callback, *callback_args: None, docker_host=hosts[0])
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def start(state: ContainerState):
+        writer = LineWriter(state.name, sys.stdout, lock, on_closed=stop.set, timestamps=args.timestamps)
+        engine.follow(state.id, writer, notify=lambda: None, tail=args.tail, docker_host=state.host)
+
+    _run(start, args, engine, hosts, stop)
+    return 0
+
+
+def record(args: argparse.Namespace) -> int:
+    """Archive the logs of many containers to per-container caches, resuming where the last run stopped"""
+    hosts = docker_hosts(args.host)
+    engine = LogIngestionEngine(dispatch=lambda callback, *callback_args: None, docker_host=hosts[0])
+    worker = LogCacheWorker()
+    root = Path(args.output).expanduser() if args.output else None
+
+    def start(state: ContainerState):
+        try:
+            cache = LogCache(cache_directory(state.name, root))
+        except LogCacheLocked as e:
+            print(f"Not recording {state.name}: {e}", file=sys.stderr)
+            return
+        worker.register(cache)
+        engine.follow(state.id, CacheRecorder(cache, worker), notify=lambda: None,
+                      since=cache.last_timestamp(), docker_host=state.host)
+
+    try:
+        _run(start, args, engine, hosts, threading.Event())
+    finally:
+        worker.stop()
+    return 0
+
+
+def parse_time(text: str) -> int:
+    """Timestamp (ns) of a time given on the command line: a local ISO 8601 time (e.g. 2024-05-01T12:00)
+    or a time relative to now (e.g. 90s, 15m, 2h, 7d)
+
+    Raises:
+        argparse.ArgumentTypeError: text is neither
+    """
+    unit = TIME_UNITS.get(text[-1:])
+    if unit is not None and text[:-1].isdigit():
+        return time.time_ns() - int(text[:-1]) * unit * 10 ** 9
+    try:
+        return int(datetime.datetime.fromisoformat(text).timestamp() * 10 ** 9)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid time {text!r}, expected e.g. 2h or 2024-05-01T12:00")
+
+
+def parse_line_range(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """(start, stop) slice given as START:STOP, negative values counting from the end (e.g. -1000: for the last 1000)
+
+    Raises:
+        argparse.ArgumentTypeError: text is not a slice
+    """
+    start, sep, stop = text.partition(':')
+    try:
+        if not sep:
+            raise ValueError()
+        return int(start) if start else None, int(stop) if stop else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid line range {text!r}, expected START:STOP, e.g. --lines=-1000:")
+
+
+def export(args: argparse.Namespace) -> int:
+    """Export the recorded logs of one container (as text) or several (as a tar archive) to a file"""
+    root = Path(args.cache).expanduser() if args.cache else default_cache_root()
+    if args.containers:
+        directories = [cache_directory(name, root) for name in args.containers]
+        missing = [name for name, directory in zip(args.containers, directories) if not directory.is_dir()]
+        if missing:
+            print(f"No recorded logs of {', '.join(missing)} in {root}", file=sys.stderr)
+            return 1
+    else:
+        directories = sorted(path for path in root.iterdir() if path.is_dir()) if root.is_dir() else []
+        if not directories:
+            print(f"No recorded logs in {root}", file=sys.stderr)
+            return 1
+    sources = [ExportSource(directory.name, cache=LogCache(directory, read_only=True)) for directory in directories]
+    options = ExportOptions(since=args.since, until=args.until, lines=args.lines, query=args.grep or '',
+                            regex=args.regex, timestamps=args.timestamps,
+                            compression=args.compress or compression_for(args.output))
+
+    def progress(done: int, total: int):
+        print(f"\rExporting {done * 100 // total if total else 100}%", end='', file=sys.stderr, flush=True)
+
+    to_stdout = args.output == '-'
+    output = sys.stdout.buffer if to_stdout else FileOutput(Path(args.output))
+    try:
+        n_lines, _ = export_logs(sources, output, options, progress=progress if sys.stderr.isatty() else None)
+    except (ExportError, re.error, OSError, ExportCancelled, KeyboardInterrupt) as e:
+        if not to_stdout:
+            output.abort()
+        if isinstance(e, KeyboardInterrupt):
+            return 130
+        if sys.stderr.isatty():
+            # end the progress line
+            print(file=sys.stderr)
+        print(f"Export failed: {e}", file=sys.stderr)
+        return 1
+    if not to_stdout:
+        output.close()
+    if sys.stderr.isatty():
+        print(f"\rExported {n_lines} lines", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='captainslog', description="A GUI Docker log viewer")
+    commands = parser.add_subparsers(dest='command')
+
+    gui_parser = commands.add_parser('gui', help="open the log viewer (default)")
+    gui_parser.add_argument('--profile', action='store_true',
+                            help="record timings of the hot paths and show them on a Profiling page")
+    gui_parser.add_argument('-H', '--host', action='append', help=HOST_HELP)
+    gui_parser.add_argument('-f', '--filter', action='append', metavar='KEY=VALUE', help=FILTER_HELP)
+    gui_parser.add_argument('--measure-startup', action='store_true',
+                            help="print how long the window took to show up and list the containers, then quit")
+
+    tail_parser = commands.add_parser('tail', help="stream the logs of many containers to stdout")
+    tail_parser.add_argument('containers', nargs='*', help="container names or ids (default: all)")
+    tail_parser.add_argument('-n', '--tail', type=int, default=DEFAULT_TAIL_LINES,
+                             help=f"existing lines to print per container (default: {DEFAULT_TAIL_LINES})")
+    tail_parser.add_argument('-t', '--timestamps', action='store_true', help="print the time of each line")
+    tail_parser.add_argument('-H', '--host', action='append', help=HOST_HELP)
+    tail_parser.add_argument('-f', '--filter', action='append', metavar='KEY=VALUE', help=FILTER_HELP)
+    tail_parser.add_argument('--profile', metavar='FILE', help="record timings and write a Chrome trace to FILE")
+    tail_parser.set_defaults(handler=tail)
+
+    record_parser = commands.add_parser('record', help="archive the logs of many containers to disk")
+    record_parser.add_argument('containers', nargs='*', help="container names or ids (default: all)")
+    record_parser.add_argument('-o', '--output',
+                               help="directory of the archive (default: the log cache shared with the viewer)")
+    record_parser.add_argument('-H', '--host', action='append', help=HOST_HELP)
+    record_parser.add_argument('-f', '--filter', action='append', metavar='KEY=VALUE', help=FILTER_HELP)
+    record_parser.add_argument('--profile', metavar='FILE', help="record timings and write a Chrome trace to FILE")
+    record_parser.set_defaults(handler=record)
+
+    export_parser = commands.add_parser('export', help="export recorded logs to a (compressed) file or archive")
+    export_parser.add_argument('containers', nargs='*',
+                               help="container names (default: all), several are exported as a tar archive")
+    export_parser.add_argument('-o', '--output', required=True, help="file to write, - for stdout")
+    export_parser.add_argument('--cache', help="directory of the recorded logs (default: the log cache)")
+    export_parser.add_argument('--since', type=parse_time, help="oldest time to export, e.g. 2h or 2024-05-01T12:00")
+    export_parser.add_argument('--until', type=parse_time, help="export lines logged before this time")
+    export_parser.add_argument('--lines', type=parse_line_range, metavar='START:STOP',
+                               help="lines of the time range to export, e.g. --lines=-1000: for the last 1000")
+    export_parser.add_argument('-g', '--grep', metavar='TEXT', help="only export lines containing TEXT")
+    export_parser.add_argument('-E', '--regex', action='store_true', help="TEXT is a regular expression")
+    export_parser.add_argument('-t', '--timestamps', action='store_true', help="prefix lines with their time")
+    export_parser.add_argument('-z', '--compress', choices=list(COMPRESSIONS),
+                               help="compression (default: from the file name, .gz or .zst)")
+    export_parser.set_defaults(handler=export)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point of the captainslog command"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        args.container_filter = parse_container_filter(getattr(args, 'filter', None) or [])
+    except ValueError as error:
+        parser.error(str(error))
+    if getattr(args, 'profile', None):
+        profiler.enabled = True
+    if args.command in (None, 'gui'):
+        if getattr(args, 'host', None):
+            os.environ[HOSTS_ENV] = ','.join(docker_hosts(args.host))
+        if getattr(args, 'filter', None):
+            os.environ[FILTER_ENV] = ' '.join(args.filter)
+        startup.measure = getattr(args, 'measure_startup', False)
+        # GTK is only imported when the viewer is opened
+        from .main import main as gui_main
+        return gui_main(sys.argv[:1])
+    try:
+        return args.handler(args)
+    finally:
+        if getattr(args, 'profile', None):
+            profiler.write_trace(args.profile)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
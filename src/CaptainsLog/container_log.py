@@ -0,0 +1,97 @@
+from typing import Optional
+
+from .log_cache import LogCache, LogCacheWorker
+from .log_store import DEFAULT_MAX_BYTES, DEFAULT_MAX_LINES, LogStore
+from .metrics import LogMetrics
+from .search import SearchIndex
+from .structured import StructuredFields
+
+# limits of the store of a container whose page has not been opened yet
+HIDDEN_MAX_LINES = 2000
+HIDDEN_MAX_BYTES = 512 * 2 ** 10
+# older lines loaded (from the cache, then the daemon) when the page of a container is opened for the first time,
+# and by each "load older" request
+BACKFILL_LINES = 10_000
+
+
+class ContainerLog:
+    """Log data kept for a single container
+
+    Until the page of the container is opened its store only keeps a small
+    buffer of the most recent lines (still searchable); open() raises the
+    limits, after which older lines can be backfilled from the on-disk cache
+    and the daemon.
+    """
+
+    def __init__(self, container_id: str, cache: Optional[LogCache] = None, docker_host: Optional[str] = None):
+        self.container_id = container_id
+        # host running the container, None for the default one
+        self.docker_host = docker_host
+        self.store = LogStore(max_lines=HIDDEN_MAX_LINES, max_bytes=HIDDEN_MAX_BYTES)
+        self.index = SearchIndex(self.store)
+        self.fields = StructuredFields(self.store)
+        self.metrics = LogMetrics()
+        self.cache = cache
+        self.opened = False
+
+    def load_cache(self, cache_worker: LogCacheWorker) -> Optional[int]:
+        """Fill the store with the most recent cached lines, then write new lines to the cache
+        and count them in the metrics from now on.
+        Call from the cache worker thread, before following the container.
+
+        Args:
+            cache_worker (LogCacheWorker): worker appending new lines to the cache
+
+        Returns:
+            Optional[int]: timestamp (ns) of the last cached line, None if nothing is cached
+        """
+        last_timestamp = None
+        cache = self.cache
+        if cache is not None:
+            timestamps, lines = cache.read_before(None, self.store.max_lines)
+            if lines:
+                self.store.extend(timestamps, lines)
+            self.store.add_listener(lambda timestamps, lines: cache_worker.submit(cache.append, timestamps, lines))
+            cache_worker.register(cache)
+            last_timestamp = cache.last_timestamp()
+        self.store.add_listener(self.metrics.record)
+        return last_timestamp
+
+    def backfill_capacity(self, n_lines: int) -> int:
+        """Number of older lines (at most n_lines) that can be inserted without evicting held lines"""
+        with self.store.lock:
+            return max(min(n_lines, self.store.max_lines - len(self.store)), 0)
+
+    def backfill_from_cache(self, n_lines: int, since: Optional[int] = None) -> int:
+        """Insert up to n_lines cached lines older than those held by the store.
+        Call from the cache worker thread.
+
+        Args:
+            n_lines (int): maximum number of lines to insert
+            since (Optional[int]): timestamp (ns) of the oldest line to insert, None for no limit
+
+        Returns:
+            int: number of lines inserted
+        """
+        if self.cache is None:
+            return 0
+        with self.store.lock:
+            until = self.store.get_timestamp(self.store.first_seq)
+        if not until:
+            return 0
+        timestamps, lines = self.cache.read_before(until, n_lines, since)
+        if lines:
+            self.store.backfill(timestamps, lines)
+        return len(lines)
+
+    def open(self) -> bool:
+        """Switch the store to the full limits of a visible page
+
+        Returns:
+            bool: whether this is the first time the container is opened
+        """
+        if self.opened:
+            return False
+        self.opened = True
+        self.store.resize(DEFAULT_MAX_LINES, DEFAULT_MAX_BYTES)
+        return True
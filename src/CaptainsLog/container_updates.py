@@ -1,24 +1,61 @@
+import bisect
 import gi
-import datetime
-import re
-import threading
-import time
-from typing import List
-
-import docker
-from docker.models.containers import Container
-from gi.repository import GLib, Gtk, Gio
-
-
-def remove_control_characters(s):
-    return re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F-\x9F]', '', s)
-
-
-def update_container_status_css(button: Gtk.Button, status: str):
+from typing import Callable, Dict, List, Optional, Tuple
+
+from gi.repository import GLib, GObject, Gtk, Gio, Pango
+
+from .ansi import plain_offset, strip_ansi
+from .container_log import BACKFILL_LINES
+from .docker_utils import ContainerFilter, ContainerState, split_filter_text
+from .export import COMPRESSIONS, ExportOptions, zstandard
+from .log_store import LogStore
+from .log_stream import format_timestamp
+from .log_view import ContainerLogView, match_attributes
+from .metrics import LogRates, format_rate
+from .profiling import profiler
+from .search import GlobalSearchHit, GlobalSearchJob, SearchIndex, SearchJob, SearchResult
+from .structured import FieldFilter, StructuredFields
+from .timeline import MergedTimeline
+
+# choices of the "load older" drop down: label, maximum number of lines (None for as many as
+# the store can hold) and time span (seconds) before the oldest held line (None for no limit)
+LOAD_OLDER_CHOICES: List[Tuple[str, Optional[int], Optional[int]]] = [
+    ("10 000 lines", BACKFILL_LINES, None),
+    ("1 hour", None, 3600),
+    ("1 day", None, 24 * 3600),
+    ("1 week", None, 7 * 24 * 3600),
+]
+
+# choices of the range of an export: id, label, time span (seconds) before now (None for no limit)
+# and number of most recent lines (None for no limit)
+EXPORT_RANGE_CHOICES: List[Tuple[str, str, Optional[int], Optional[int]]] = [
+    ("all", "Everything", None, None),
+    ("hour", "Last hour", 3600, None),
+    ("day", "Last day", 24 * 3600, None),
+    ("week", "Last week", 7 * 24 * 3600, None),
+    ("lines-10k", "Last 10 000 lines", None, 10_000),
+    ("lines-100k", "Last 100 000 lines", None, 100_000),
+]
+# labels of the compressions offered by the export dialog
+EXPORT_COMPRESSION_LABELS = {'none': "None", 'gzip': "gzip", 'zstd': "zstd"}
+# seconds the outcome of an export stays in the header bar
+EXPORT_STATUS_S = 8
+
+# tooltip of the field filter entry
+FILTER_HINT = "Show structured (JSON or logfmt) lines matching every term, e.g. level>=warn service=api latency_ms>500"
+# tooltip of the container filter entry of the sidebar
+CONTAINER_FILTER_HINT = ("Show containers whose name or compose project contains every word. "
+                         "status=running, name=REGEX, label=KEY[=VALUE] and project=NAME are applied by the "
+                         "docker daemons, so other containers are not even listed")
+# milliseconds without typing before the daemon side container filters are applied
+CONTAINER_FILTER_DELAY_MS = 600
+
+
+def update_container_status_css(button: Gtk.Widget, status: str):
     """Update button with css class based on docker container status
 
     Args:
-        button (Gtk.Button): button corresponding to docker container in sidebar
+        button (Gtk.Widget): row corresponding to docker container in sidebar
         status (str): current status of the docker container
     """
 
@@ -48,98 +85,636 @@ def update_container_status_css(button: Gtk.Button, status: str):
     return True
 
 
-def prepare_container_log_elements():
-    """Make GTK elements for individual container log
-    """
+class SidebarContainer(GObject.Object):
+    """Item of the container list of the sidebar, one per container"""
 
-    container_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL,
-                            hexpand=True,
-                            vexpand=True,
-                            visible=False)
+    def __init__(self, state: ContainerState):
+        super().__init__()
+        self.state = state
+        # log rate badge, its style classes and the tooltip of the row, see ContainerSidebar.set_badge
+        self.badge = ''
+        self.badge_classes: List[str] = []
+        self.tooltip = ''
 
-    # otherwise create new stack object for new container
-    container_scroll_window = Gtk.ScrolledWindow(
-        vexpand=True, hexpand=True)
 
-    container_info = Gtk.TextView()
-    container_info.add_css_class('container-text')
-    container_scroll_window.set_child(container_info)
+class ContainerSidebar:
+    """Filterable list of the containers in the sidebar, optionally grouped by compose project
 
-    container_action_bar = Gtk.ActionBar(hexpand=True,
-                                         css_classes=['container-action-bar'])
-    container_log_save_button = Gtk.Button(label="Save as")
-    container_action_bar.pack_start(container_log_save_button)
-    container_log_search = Gtk.SearchEntry(placeholder_text="Search Log")
-    container_action_bar.pack_end(container_log_search)
+    Only the rows in view exist (a Gtk.ListView over a Gio.ListStore), so thousands
+    of containers cost little. Words typed in the filter entry are matched against
+    container names and projects right away, key=value terms (see
+    split_filter_text) are handed to on_container_filter shortly after typing
+    stops, to be applied by the daemons.
 
-    container_box.append(container_action_bar)
-    container_box.append(container_scroll_window)
+    Args:
+        on_select (Callable[[str], None]): called with the id of the container selected by the user
+        on_container_filter (Callable[[ContainerFilter], None]): called when the daemon side filters change
+    """
 
-    return container_box, container_info, container_log_save_button, container_log_search
+    def __init__(self, on_select: Callable[[str], None], on_container_filter: Callable[[ContainerFilter], None]):
+        self.on_select = on_select
+        self.on_container_filter = on_container_filter
+        self.items: Dict[str, SidebarContainer] = {}
+        self.words: List[str] = []
+        self.container_filter = ContainerFilter()
+        self.grouped = False
+        # container selected, None if another page is shown
+        self.selected_id: Optional[str] = None
+        # row widget of each container in view
+        self.rows: Dict[str, Gtk.Widget] = {}
+        self._filter_source: Optional[int] = None
+
+        self.store = Gio.ListStore(item_type=SidebarContainer)
+        self.filter = Gtk.CustomFilter.new(self._matches, None)
+        self.sorter = Gtk.CustomSorter.new(lambda a, b, _: _ordering(self._sort_key(a), self._sort_key(b)), None)
+        self.sort_model = Gtk.SortListModel(model=Gtk.FilterListModel(model=self.store, filter=self.filter),
+                                            sorter=self.sorter)
+        self.selection = Gtk.SingleSelection(model=self.sort_model, autoselect=False, can_unselect=True)
+        self.selection.connect('notify::selected', self._on_selected)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', self._on_setup_row)
+        factory.connect('bind', self._on_bind_row)
+        factory.connect('unbind', self._on_unbind_row)
+        self.list_view = Gtk.ListView(model=self.selection, factory=factory)
+        # section headers need GTK 4.12, older versions only sort by project
+        self.sections = hasattr(Gtk, 'ListHeader')
+        if self.sections:
+            header_factory = Gtk.SignalListItemFactory()
+            header_factory.connect('setup', lambda _, header: header.set_child(
+                Gtk.Label(xalign=0, css_classes=['sidebar-section'])))
+            header_factory.connect('bind', lambda _, header: header.get_child().set_text(
+                header.get_item().state.project or "No project"))
+            self.list_view.set_header_factory(header_factory)
+
+        self.filter_entry = Gtk.SearchEntry(placeholder_text="Filter containers", hexpand=True,
+                                            tooltip_text=CONTAINER_FILTER_HINT)
+        self.filter_entry.connect('search-changed', self._on_filter_changed)
+        self.group_toggle = Gtk.ToggleButton(icon_name="view-list-symbolic", tooltip_text="Group by compose project")
+        self.group_toggle.connect('toggled', self._on_group_toggled)
+        filter_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4, css_classes=['sidebar-filter'])
+        filter_box.append(self.filter_entry)
+        filter_box.append(self.group_toggle)
+
+        scroll_window = Gtk.ScrolledWindow(vexpand=True, hscrollbar_policy=Gtk.PolicyType.NEVER)
+        scroll_window.set_child(self.list_view)
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, vexpand=True)
+        self.box.append(filter_box)
+        self.box.append(scroll_window)
+
+    def _sort_key(self, item: SidebarContainer) -> Tuple[int, str, str]:
+        state = item.state
+        if not self.grouped:
+            return 0, '', state.name.lower()
+        # containers without a project last
+        return int(not state.project), state.project, state.name.lower()
+
+    def _matches(self, item: SidebarContainer, _) -> bool:
+        state = item.state
+        return all(word in state.name.lower() or word in state.project.lower() for word in self.words)
+
+    def _on_setup_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        # container name and log rate badge
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6, css_classes=['sidebar-container'])
+        row.append(Gtk.Label(xalign=0, hexpand=True, ellipsize=Pango.EllipsizeMode.END))
+        row.append(Gtk.Label(css_classes=['sidebar-badge']))
+        list_item.set_child(row)
+
+    def _on_bind_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        item: SidebarContainer = list_item.get_item()
+        row = list_item.get_child()
+        self.rows[item.state.id] = row
+        row.get_first_child().set_text(item.state.name)
+        update_container_status_css(button=row, status=item.state.status)
+        self._show_badge(item, row)
+
+    def _on_unbind_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        item: SidebarContainer = list_item.get_item()
+        if self.rows.get(item.state.id) is list_item.get_child():
+            del self.rows[item.state.id]
+
+    @staticmethod
+    def _show_badge(item: SidebarContainer, row: Gtk.Widget):
+        badge = row.get_last_child()
+        badge.set_text(item.badge)
+        badge.set_css_classes(['sidebar-badge'] + item.badge_classes)
+        row.set_tooltip_text(item.tooltip or None)
+
+    def add(self, state: ContainerState):
+        item = self.items[state.id] = SidebarContainer(state)
+        self.store.append(item)
+
+    def update(self, state: ContainerState):
+        """Show the new name, status or project of a container, moving its row if needed"""
+        item = self.items[state.id]
+        item.state = state
+        found, position = self.store.find(item)
+        if found:
+            self.store.items_changed(position, 1, 1)
+
+    def remove(self, container_id: str):
+        item = self.items.pop(container_id, None)
+        if item is None:
+            return
+        if self.selected_id == container_id:
+            self.selected_id = None
+        found, position = self.store.find(item)
+        if found:
+            self.store.remove(position)
+
+    def set_badge(self, container_id: str, text: str, css_classes: List[str], tooltip: str):
+        """Set the log rate badge and tooltip of a container, updating its row only if it is in view"""
+        item = self.items.get(container_id)
+        if item is None:
+            return
+        item.badge = text
+        item.badge_classes = css_classes
+        item.tooltip = tooltip
+        row = self.rows.get(container_id)
+        if row is not None:
+            self._show_badge(item, row)
+
+    def select(self, container_id: Optional[str]):
+        """Highlight the row of a container (None for none) without calling on_select"""
+        self.selected_id = container_id
+        item = self.items.get(container_id) if container_id is not None else None
+        position = Gtk.INVALID_LIST_POSITION
+        if item is not None:
+            for index in range(self.sort_model.get_n_items()):
+                if self.sort_model.get_item(index) is item:
+                    position = index
+                    break
+        self.selection.set_selected(position)
+
+    def _on_selected(self, selection: Gtk.SingleSelection, _):
+        item = selection.get_selected_item()
+        # changes of the selected position caused by filtering or sorting are ignored
+        if item is None or item.state.id == self.selected_id:
+            return
+        self.selected_id = item.state.id
+        self.on_select(item.state.id)
 
+    def set_filter_text(self, text: str):
+        """Fill the filter entry, taking its key=value terms as the filters already applied by the daemons
 
-def update_container_log(text_view: Gtk.TextView, new_text: str):
-    """Perform the actual updating of the TextBuffer with additional text
+        Raises:
+            ValueError: a key=value term is invalid
+        """
+        self.container_filter, self.words = split_filter_text(text)
+        self.filter_entry.set_text(text)
+
+    def _on_filter_changed(self, entry: Gtk.SearchEntry):
+        try:
+            container_filter, words = split_filter_text(entry.get_text())
+        except ValueError as e:
+            entry.add_css_class('error')
+            entry.set_tooltip_text(str(e))
+            return
+        entry.remove_css_class('error')
+        entry.set_tooltip_text(CONTAINER_FILTER_HINT)
+        if words != self.words:
+            self.words = words
+            self.filter.changed(Gtk.FilterChange.DIFFERENT)
+        if self._filter_source is not None:
+            GLib.source_remove(self._filter_source)
+            self._filter_source = None
+        if container_filter != self.container_filter:
+            self._filter_source = GLib.timeout_add(CONTAINER_FILTER_DELAY_MS, self._apply_container_filter,
+                                                   container_filter)
+
+    def _apply_container_filter(self, container_filter: ContainerFilter) -> bool:
+        self._filter_source = None
+        self.container_filter = container_filter
+        self.on_container_filter(container_filter)
+        return GLib.SOURCE_REMOVE
+
+    def _on_group_toggled(self, button: Gtk.ToggleButton):
+        self.grouped = button.get_active()
+        self.sorter.changed(Gtk.SorterChange.DIFFERENT)
+        if self.sections:
+            self.sort_model.set_section_sorter(
+                Gtk.CustomSorter.new(lambda a, b, _: _ordering(self._sort_key(a)[:2], self._sort_key(b)[:2]), None)
+                if self.grouped else None)
+
+
+class ContainerPage:
+    """GTK elements for individual container log, and the state of its search"""
+
+    def __init__(self, store: LogStore, index: SearchIndex, fields: StructuredFields):
+        self.store = store
+        self.index = index
+        self.fields = fields
+        self.search_job: Optional[SearchJob] = None
+        self.search_result: Optional[SearchResult] = None
+        # position of the selected match in search_result.matches
+        self.match_number = 0
+        # field filter applied to the view (None to show every line), lines before filter_end were filtered
+        self.filter_text: Optional[str] = None
+        self.filters: Optional[List[FieldFilter]] = None
+        self.filter_end = 0
+        self.filter_pending = False
+
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL,
+                           hexpand=True,
+                           vexpand=True,
+                           visible=False)
+
+        self.log_view = ContainerLogView(store)
+
+        action_bar = Gtk.ActionBar(hexpand=True,
+                                   css_classes=['container-action-bar'])
+        self.save_button = Gtk.Button(label="Save as")
+        action_bar.pack_start(self.save_button)
+        self.load_older_button = Gtk.Button(label="Load older", tooltip_text="Load lines logged before the oldest shown line")
+        self.load_older_dropdown = Gtk.DropDown.new_from_strings([label for label, _, _ in LOAD_OLDER_CHOICES])
+        action_bar.pack_start(self.load_older_button)
+        action_bar.pack_start(self.load_older_dropdown)
+        self.filter_entry = Gtk.Entry(placeholder_text="Filter fields",
+                                      tooltip_text=FILTER_HINT,
+                                      primary_icon_name="view-filter-symbolic")
+        action_bar.pack_start(self.filter_entry)
+        self.search_entry = Gtk.SearchEntry(placeholder_text="Search Log")
+        self.search_regex_toggle = Gtk.ToggleButton(label=".*", tooltip_text="Regular expression")
+        self.search_status = Gtk.Label(css_classes=['search-status'])
+        action_bar.pack_end(self.search_regex_toggle)
+        action_bar.pack_end(self.search_entry)
+        action_bar.pack_end(self.search_status)
+
+        self.box.append(action_bar)
+        self.box.append(self.log_view.scroll_window)
+
+    def load_older_choice(self) -> Tuple[Optional[int], Optional[int]]:
+        """Return the maximum number of lines and time span (seconds) selected for loading older lines"""
+        _, n_lines, span = LOAD_OLDER_CHOICES[self.load_older_dropdown.get_selected()]
+        return n_lines, span
+
+    def search_is_current(self) -> bool:
+        """Whether search_result belongs to the text and mode currently in the search bar"""
+        return (self.search_result is not None
+                and self.search_result.query == self.search_entry.get_text()
+                and self.search_result.regex == self.search_regex_toggle.get_active())
+
+    def show_match(self):
+        """Highlight the selected match and show its number in the action bar"""
+        result = self.search_result
+        if result.error is not None:
+            self.search_status.set_text("Invalid pattern")
+            self.log_view.highlight_match(None)
+        elif not result.matches:
+            self.search_status.set_text("No matches" if result.query else "")
+            self.log_view.highlight_match(None)
+        else:
+            self.search_status.set_text(f"{self.match_number + 1} of {result.count}")
+            self.log_view.highlight_match(result.matches[self.match_number])
+
+
+def add_export_choices(dialog: Gtk.FileChooser, query: str):
+    """Add the range, compression and format options of an export to a save dialog
 
     Args:
-        container_textbuf (Gtk.TextBuffer): TextBuffer to append to
-        new_text (str): text to append to buffer
+        dialog (Gtk.FileChooser): dialog choosing the file to export to
+        query (str): current search, offered as a filter when not empty
     """
-    container_textbuf = text_view.get_buffer()
-    end_iter = container_textbuf.get_end_iter()
-    container_textbuf.insert(end_iter, new_text)
-    return
+    dialog.add_choice('range', "Range", [choice_id for choice_id, _, _, _ in EXPORT_RANGE_CHOICES],
+                      [label for _, label, _, _ in EXPORT_RANGE_CHOICES])
+    dialog.set_choice('range', EXPORT_RANGE_CHOICES[0][0])
+    compressions = [compression for compression in COMPRESSIONS if compression != 'zstd' or zstandard is not None]
+    dialog.add_choice('compression', "Compression", compressions,
+                      [EXPORT_COMPRESSION_LABELS[compression] for compression in compressions])
+    dialog.set_choice('compression', 'none')
+    dialog.add_choice('timestamps', "Prefix lines with their time", None, None)
+    dialog.set_choice('timestamps', 'false')
+    if query:
+        dialog.add_choice('matching', f"Only lines matching \"{query}\"", None, None)
+        dialog.set_choice('matching', 'true')
+
+
+def export_choices(dialog: Gtk.FileChooser, query: str, regex: bool) -> ExportOptions:
+    """Options of an export selected in a dialog set up by add_export_choices
 
-
-def clear_container_log(text_view: Gtk.TextView):
-    """Erase all content from passed text view
+    Args:
+        dialog (Gtk.FileChooser): dialog choosing the file to export to
+        query (str): search passed to add_export_choices
+        regex (bool): whether the search is a regular expression
     """
-    buffer = text_view.get_buffer()
-    buffer.delete(buffer.get_start_iter(), buffer.get_end_iter())
-
-
-def container_log_tailer(text_view: Gtk.TextView, container_name: str):
-    current_thread = threading.current_thread()
-    dc = docker.from_env()
-    container: Container = dc.containers.get(container_name)
-    text_view.set_wrap_mode(Gtk.WrapMode.WORD)
-
-    # erase container text view on thread start
-    if 'since_time' not in locals():
-        GLib.idle_add(clear_container_log, text_view)
-        since_time = None
-
-    text_to_append = ""
-    while True:
-        if current_thread.stopped():
-            # add text needing to be appended before stopping
-            if text_to_append:
-                GLib.idle_add(update_container_log, text_view, text_to_append)
-            # break from infinite loop when thread is stopped (e.g. on update)
+    range_id = dialog.get_choice('range')
+    span, n_lines = next((span, n_lines) for choice_id, _, span, n_lines in EXPORT_RANGE_CHOICES
+                         if choice_id == range_id)
+    matching = bool(query) and dialog.get_choice('matching') == 'true'
+    return ExportOptions(since=GLib.get_real_time() * 1000 - span * 10 ** 9 if span is not None else None,
+                         lines=(-n_lines, None) if n_lines is not None else None,
+                         query=query if matching else '',
+                         regex=regex and matching,
+                         timestamps=dialog.get_choice('timestamps') == 'true',
+                         compression=dialog.get_choice('compression') or 'none')
+
+
+class ExportProgress:
+    """Header bar widget showing the progress of an export, with a button to cancel it"""
+
+    def __init__(self):
+        self.box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6, visible=False)
+        self.progress_bar = Gtk.ProgressBar(show_text=True, valign=Gtk.Align.CENTER,
+                                            css_classes=['export-progress'])
+        self.cancel_button = Gtk.Button(icon_name="process-stop-symbolic", tooltip_text="Cancel the export")
+        self.box.append(self.progress_bar)
+        self.box.append(self.cancel_button)
+        # what is being exported, shown in the progress bar
+        self.name = ''
+        self._hide_source: Optional[int] = None
+
+    def start(self, name: str):
+        if self._hide_source is not None:
+            GLib.source_remove(self._hide_source)
+            self._hide_source = None
+        self.name = name
+        self.progress_bar.set_fraction(0)
+        self.progress_bar.set_text(f"Exporting {name}")
+        self.cancel_button.set_visible(True)
+        self.box.set_visible(True)
+
+    def update(self, done: int, total: int):
+        self.progress_bar.set_fraction(done / total if total else 1)
+        self.progress_bar.set_text(f"Exporting {self.name} {done * 100 // total if total else 100}%")
+
+    def finish(self, text: str, details: Optional[str] = None):
+        """Show the outcome of the export (or of another save) for EXPORT_STATUS_S seconds
+
+        Args:
+            text (str): outcome shown in the progress bar
+            details (Optional[str]): tooltip of the progress bar, e.g. the error
+        """
+        if self._hide_source is not None:
+            GLib.source_remove(self._hide_source)
+        self.progress_bar.set_text(text)
+        self.progress_bar.set_tooltip_text(details)
+        self.cancel_button.set_visible(False)
+        self.box.set_visible(True)
+        self._hide_source = GLib.timeout_add_seconds(EXPORT_STATUS_S, self._hide)
+
+    def _hide(self):
+        self._hide_source = None
+        self.box.set_visible(False)
+        return False
+
+
+class TimelinePage:
+    """GTK elements of the merged timeline of every container, or of the containers of one compose project"""
+
+    def __init__(self):
+        self.timeline: Optional[MergedTimeline] = None
+        # compose project of the containers in the timeline, None for every container
+        self.project: Optional[str] = None
+        # source number of each container merged into the timeline
+        self.sources: Dict[str, int] = {}
+        self.flush_pending = False
+        # compose projects offered after "All containers"
+        self.projects: List[str] = []
+
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL,
+                           hexpand=True,
+                           vexpand=True,
+                           visible=False)
+
+        action_bar = Gtk.ActionBar(hexpand=True,
+                                   css_classes=['container-action-bar'])
+        self.group_list = Gtk.StringList.new(["All containers"])
+        self.group_dropdown = Gtk.DropDown(model=self.group_list,
+                                           tooltip_text="Containers whose logs are interleaved in time order")
+        self.status = Gtk.Label(css_classes=['search-status'])
+        action_bar.pack_start(self.group_dropdown)
+        action_bar.pack_end(self.status)
+        self.box.append(action_bar)
+        self.log_view: Optional[ContainerLogView] = None
+
+    def selected_project(self) -> Optional[str]:
+        """Compose project selected, None for every container"""
+        selected = self.group_dropdown.get_selected()
+        return self.projects[selected - 1] if 0 < selected <= len(self.projects) else None
+
+    def set_projects(self, projects: List[str]):
+        """Offer the given compose projects, keeping the selected one selected"""
+        if projects == self.projects:
             return
-        new_since_time = datetime.datetime.utcnow()
-        try:
-            container_logs: bytes = container.logs(
-                since=since_time, until=new_since_time)
-            since_time = new_since_time
-            if container_logs:
-                # only update UI when new logs generated
-                new_text = container_logs.decode('utf-8')
-                # strip control characters other than newline
-                new_text = remove_control_characters(new_text)
-                text_to_append += new_text
-
-            if text_to_append:
-                # if we have text to add to log, and the container box is visible
-                # e.g. (stack page is currently selected)
-                if text_view.get_parent().get_parent().is_visible():
-                    GLib.idle_add(update_container_log,
-                                  text_view,
-                                  text_to_append,
-                                  priority=GLib.PRIORITY_HIGH)
-                    text_to_append = ""
-
-        except:
+        selected = self.selected_project()
+        self.projects = projects
+        self.group_list.splice(1, self.group_list.get_n_items() - 1, projects)
+        self.group_dropdown.set_selected(projects.index(selected) + 1 if selected in projects else 0)
+
+    def set_timeline(self, timeline: MergedTimeline, project: Optional[str]):
+        """Show a new timeline in place of the current one"""
+        if self.timeline is not None:
+            self.timeline.close()
+        if self.log_view is not None:
+            self.box.remove(self.log_view.scroll_window)
+        self.timeline = timeline
+        self.project = project
+        self.sources = {}
+        self.flush_pending = False
+        self.log_view = ContainerLogView(timeline.store, sources=True)
+        self.box.append(self.log_view.scroll_window)
+
+    def update_status(self):
+        merge = self.timeline.merge
+        status = f"{len(self.sources)} containers"
+        if merge.late_lines:
+            status += f", {merge.late_lines} lines arrived too late to be in order"
+        self.status.set_text(status)
+
+
+class GlobalSearchMatch(GObject.Object):
+    """Item of the global search results, one per matching line"""
+
+    def __init__(self, hit: GlobalSearchHit, container_name: str):
+        super().__init__()
+        self.hit = hit
+        self.container_name = container_name
+
+
+class GlobalSearchPage:
+    """GTK elements searching the logs of all containers at once"""
+
+    def __init__(self):
+        self.search_job: Optional[GlobalSearchJob] = None
+        self.count = 0
+        self.n_containers = 0
+        self.results = Gio.ListStore(item_type=GlobalSearchMatch)
+        # timestamp of each item of results, to find where the hits of the next container go
+        self.timestamps: List[int] = []
+
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL,
+                           hexpand=True,
+                           vexpand=True,
+                           visible=False)
+
+        action_bar = Gtk.ActionBar(hexpand=True,
+                                   css_classes=['container-action-bar'])
+        self.search_entry = Gtk.SearchEntry(placeholder_text="Search all logs", hexpand=True)
+        self.search_regex_toggle = Gtk.ToggleButton(label=".*", tooltip_text="Regular expression")
+        self.search_status = Gtk.Label(css_classes=['search-status'])
+        action_bar.pack_start(self.search_entry)
+        action_bar.pack_end(self.search_regex_toggle)
+        action_bar.pack_end(self.search_status)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', self._on_setup_row)
+        factory.connect('bind', self._on_bind_row)
+        self.list_view = Gtk.ListView(model=Gtk.SingleSelection(model=self.results),
+                                      factory=factory,
+                                      single_click_activate=True,
+                                      css_classes=['container-text'])
+        scroll_window = Gtk.ScrolledWindow(vexpand=True, hexpand=True)
+        scroll_window.set_child(self.list_view)
+
+        self.box.append(action_bar)
+        self.box.append(scroll_window)
+
+    def _on_setup_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        row = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        row.append(Gtk.Label(xalign=0, css_classes=['search-hit-container']))
+        row.append(Gtk.Label(xalign=0, css_classes=['search-hit-time']))
+        row.append(Gtk.Label(xalign=0, hexpand=True, ellipsize=Pango.EllipsizeMode.END))
+        list_item.set_child(row)
+
+    def _on_bind_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        match: GlobalSearchMatch = list_item.get_item()
+        hit = match.hit
+        name_label = list_item.get_child().get_first_child()
+        time_label = name_label.get_next_sibling()
+        text_label = time_label.get_next_sibling()
+        name_label.set_text(match.container_name)
+        time_label.set_text(format_timestamp(hit.timestamp))
+        text = strip_ansi(hit.text)
+        text_label.set_text(text)
+        text_label.set_attributes(match_attributes(text,
+                                                   plain_offset(hit.text, hit.start),
+                                                   plain_offset(hit.text, hit.end)))
+
+    def clear(self):
+        self.count = 0
+        self.n_containers = 0
+        self.timestamps = []
+        self.results.remove_all()
+
+    def add_hits(self, hits: List[GlobalSearchHit], count: int, container_name: str):
+        """Merge the matching lines of one container into the results, keeping timestamp order
+
+        Args:
+            hits (List[GlobalSearchHit]): matching lines, in timestamp order
+            count (int): total number of matches in the container
+            container_name (str): name shown next to the lines
+        """
+        self.count += count
+        if not hits:
             return
+        self.n_containers += 1
+        # hits falling between the same two results are inserted at once, the other results are left alone
+        runs: List[Tuple[int, List[GlobalSearchHit]]] = []
+        for hit in hits:
+            position = bisect.bisect_right(self.timestamps, hit.timestamp)
+            if runs and runs[-1][0] == position:
+                runs[-1][1].append(hit)
+            else:
+                runs.append((position, [hit]))
+        inserted = 0
+        for position, run in runs:
+            position += inserted
+            self.results.splice(position, 0, [GlobalSearchMatch(hit, container_name) for hit in run])
+            self.timestamps[position:position] = [hit.timestamp for hit in run]
+            inserted += len(run)
+
+
+class ContainerMetricsRow(GObject.Object):
+    """Row of the log rate summary, one per container"""
+
+    def __init__(self, container_id: str, name: str, rates: LogRates):
+        super().__init__()
+        self.container_id = container_id
+        self.name = name
+        self.rates = rates
+
+
+def _ordering(a, b) -> Gtk.Ordering:
+    if a < b:
+        return Gtk.Ordering.SMALLER
+    if a > b:
+        return Gtk.Ordering.LARGER
+    return Gtk.Ordering.EQUAL
+
+
+# columns of the log rate summary: title, sort key and displayed text of a row
+METRICS_COLUMNS: List[Tuple[str, Callable[[ContainerMetricsRow], object], Callable[[ContainerMetricsRow], str]]] = [
+    ("Container", lambda row: row.name.lower(), lambda row: row.name),
+    ("Lines/s", lambda row: row.rates.lines_per_s, lambda row: format_rate(row.rates.lines_per_s)),
+    ("Bytes/s", lambda row: row.rates.bytes_per_s, lambda row: format_rate(row.rates.bytes_per_s, 'B')),
+    ("Errors/s", lambda row: row.rates.errors_per_s, lambda row: format_rate(row.rates.errors_per_s)),
+    ("Errors", lambda row: row.rates.total_errors, lambda row: str(row.rates.total_errors)),
+]
+
+
+class MetricsOverview:
+    """Sortable summary of the log rates of every container, shown on the Overview page"""
+
+    def __init__(self):
+        self.rows = Gio.ListStore(item_type=ContainerMetricsRow)
+        self.column_view = Gtk.ColumnView(css_classes=['metrics-summary'])
+        sort_column = None
+        for title, key, text in METRICS_COLUMNS:
+            factory = Gtk.SignalListItemFactory()
+            factory.connect('setup', lambda _, list_item: list_item.set_child(Gtk.Label(xalign=0)))
+            factory.connect('bind', lambda _, list_item, text=text:
+                            list_item.get_child().set_text(text(list_item.get_item())))
+            column = Gtk.ColumnViewColumn(title=title, factory=factory, expand=sort_column is None)
+            column.set_sorter(Gtk.CustomSorter.new(lambda a, b, _, key=key: _ordering(key(a), key(b)), None))
+            self.column_view.append_column(column)
+            if title == "Lines/s":
+                sort_column = column
+        self.column_view.set_model(Gtk.NoSelection(model=Gtk.SortListModel(model=self.rows,
+                                                                            sorter=self.column_view.get_sorter())))
+        self.column_view.sort_by_column(sort_column, Gtk.SortType.DESCENDING)
+        self.scroll_window = Gtk.ScrolledWindow(vexpand=True, hexpand=True)
+        self.scroll_window.set_child(self.column_view)
+
+    def update(self, rows: List[ContainerMetricsRow]):
+        """Replace the rows with the current rates (sorted by the selected column)"""
+        self.rows.splice(0, self.rows.get_n_items(), rows)
+
+
+class ProfilingPage:
+    """Debug page showing what the profiler recorded (spans, queue depths, bytes per container),
+    with controls to pause, reset and export the recording
+    """
 
-        time.sleep(0.5)  # TODO: make this a setting in the application
+    def __init__(self):
+        self.box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL,
+                           hexpand=True,
+                           vexpand=True,
+                           visible=False)
+
+        action_bar = Gtk.ActionBar(hexpand=True,
+                                   css_classes=['container-action-bar'])
+        self.record_switch = Gtk.Switch(active=profiler.enabled, valign=Gtk.Align.CENTER,
+                                        tooltip_text="Record timings of the hot paths")
+        self.reset_button = Gtk.Button(label="Reset")
+        self.export_button = Gtk.Button(label="Export trace",
+                                        tooltip_text="Save the recording as a Chrome trace (JSON) file")
+        action_bar.pack_start(Gtk.Label(label="Record"))
+        action_bar.pack_start(self.record_switch)
+        action_bar.pack_end(self.export_button)
+        action_bar.pack_end(self.reset_button)
+        self.record_switch.connect('notify::active',
+                                   lambda switch, _: setattr(profiler, 'enabled', switch.get_active()))
+        self.reset_button.connect('clicked', lambda _: (profiler.reset(), self.refresh()))
+
+        self.summary_label = Gtk.Label(xalign=0, yalign=0, selectable=True, css_classes=['profiling-summary'])
+        scroll_window = Gtk.ScrolledWindow(vexpand=True, hexpand=True)
+        scroll_window.set_child(self.summary_label)
+
+        self.box.append(action_bar)
+        self.box.append(scroll_window)
+
+    def refresh(self) -> bool:
+        """Show the current summary while the page is visible (usable as a GLib timeout callback)"""
+        if self.box.get_visible():
+            self.summary_label.set_text(profiler.format_summary())
+        return True
@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import urllib.parse
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__file__)
+
+DEFAULT_DOCKER_HOST = 'unix:///var/run/docker.sock'
+# comma separated docker hosts to connect to at once, e.g. unix:///var/run/docker.sock,tcp://build:2375,ssh://me@web1
+HOSTS_ENV = 'CAPTAINSLOG_HOSTS'
+# maximum number of short API requests (e.g. inspect) in flight at the same time, per host
+DEFAULT_MAX_REQUESTS = 4
+# seconds to connect and receive the response headers before a daemon counts as unresponsive
+REQUEST_TIMEOUT = 10.0
+# delay (seconds) before connecting again to a host that failed, doubled on each consecutive failure
+HOST_BACKOFF_MIN = 1.0
+HOST_BACKOFF_MAX = 60.0
+# asyncio stream buffer limit, bounds the size of a single chunk header/status line
+STREAM_READ_LIMIT = 2 ** 20
+# ssh connections to a host are multiplexed over one master connection, kept open this long (seconds) when unused
+SSH_CONTROL_PERSIST = 60
+
+ResponseHead = Tuple[int, Dict[str, str], asyncio.StreamReader, asyncio.StreamWriter]
+
+
+def parse_docker_host(docker_host: Optional[str] = None) -> Tuple[str, str]:
+    """Parse a DOCKER_HOST style url
+
+    Args:
+        docker_host (Optional[str]): url such as unix:///var/run/docker.sock, tcp://host:2375 or ssh://user@host.
+            Defaults to the DOCKER_HOST environment variable, then the local unix socket.
+
+    Returns:
+        Tuple[str, str]: scheme ('unix', 'tcp' or 'ssh') and socket path, host:port or [user@]host[:port]
+    """
+    if docker_host is None:
+        docker_host = os.environ.get('DOCKER_HOST', DEFAULT_DOCKER_HOST)
+    scheme, sep, address = docker_host.partition('://')
+    if not sep or scheme not in ('unix', 'tcp', 'ssh'):
+        raise ValueError(f"Unsupported docker host {docker_host}")
+    return scheme, address.rstrip('/') if scheme != 'unix' else address
+
+
+def docker_hosts(hosts: Optional[List[str]] = None) -> List[str]:
+    """Docker hosts to connect to: the given ones, else CAPTAINSLOG_HOSTS, else DOCKER_HOST or the local socket"""
+    if not hosts:
+        hosts = [host.strip() for host in os.environ.get(HOSTS_ENV, '').split(',') if host.strip()]
+    if not hosts:
+        hosts = [os.environ.get('DOCKER_HOST', DEFAULT_DOCKER_HOST)]
+    for host in hosts:
+        parse_docker_host(host)
+    # keep the order, drop duplicates
+    return list(dict.fromkeys(hosts))
+
+
+def host_label(docker_host: str) -> str:
+    """Short name of a docker host for display, e.g. 'local' or the host name"""
+    scheme, address = parse_docker_host(docker_host)
+    if scheme == 'unix':
+        return 'local' if address == urllib.parse.urlsplit(DEFAULT_DOCKER_HOST).path else os.path.basename(address)
+    host = address.rpartition('@')[2]
+    return host.rsplit(':', 1)[0] if host.count(':') == 1 else host
+
+
+class HostStatus(NamedTuple):
+    docker_host: str
+    # no failure since the last successful connection
+    connected: bool
+    consecutive_failures: int
+    # seconds until the next connection attempt while failing
+    retry_in: float
+    last_error: Optional[str]
+
+
+class DockerEndpoint:
+    """Connection to one docker daemon, shared by everything the ingestion engine does with it
+    (container list, events, inspect and log streams)
+
+    Short requests reuse idle keep-alive connections; log and event streams hold
+    a connection of their own. When connecting fails or the daemon does not
+    answer within REQUEST_TIMEOUT, the host backs off exponentially: a single
+    attempt is made per backoff period, the other requests to the host wait for
+    it, and requests to other hosts are not affected. Runs on the event loop of
+    the engine.
+
+    Args:
+        docker_host (str): url of the daemon, see parse_docker_host
+        max_requests (int): maximum number of short API requests in flight at the same time
+        timeout (float): seconds to connect and receive response headers
+    """
+
+    def __init__(self, docker_host: str, max_requests: int = DEFAULT_MAX_REQUESTS, timeout: float = REQUEST_TIMEOUT):
+        self.docker_host = docker_host
+        self.scheme, self.address = parse_docker_host(docker_host)
+        self.label = host_label(docker_host)
+        self.timeout = timeout
+        self.request_slots = asyncio.Semaphore(max_requests)
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._max_idle = max_requests
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        # time.monotonic() before which no new connection is attempted
+        self._retry_at = 0.0
+        # held while retrying a failing host, so only one attempt is made at a time
+        self._probe = asyncio.Lock()
+
+    def status(self) -> HostStatus:
+        """Current health of the host (safe to call from any thread)"""
+        retry_in = max(self._retry_at - time.monotonic(), 0) if self.failures else 0.0
+        return HostStatus(docker_host=self.docker_host, connected=not self.failures,
+                          consecutive_failures=self.failures, retry_in=retry_in, last_error=self.last_error)
+
+    def _failed(self, error: BaseException):
+        self.failures += 1
+        self.last_error = str(error) or type(error).__name__
+        delay = min(HOST_BACKOFF_MIN * 2 ** (self.failures - 1), HOST_BACKOFF_MAX)
+        self._retry_at = time.monotonic() + delay
+        logger.warning(f"Docker host {self.label} unavailable ({self.last_error}), retrying in {delay:.0f}s")
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+    def _succeeded(self):
+        if self.failures:
+            logger.info(f"Docker host {self.label} reachable again")
+        self.failures = 0
+        self.last_error = None
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if self.scheme == 'unix':
+            return await asyncio.open_unix_connection(self.address, limit=STREAM_READ_LIMIT)
+        if self.scheme == 'ssh':
+            return await self._connect_ssh()
+        host, _, port = self.address.rpartition(':')
+        return await asyncio.open_connection(host, int(port), limit=STREAM_READ_LIMIT)
+
+    async def _connect_ssh(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Tunnel to the remote daemon through `docker system dial-stdio`, like the docker CLI does"""
+        destination, port = self.address, None
+        if destination.rpartition('@')[2].count(':') == 1:
+            destination, _, port = destination.rpartition(':')
+        control_path = os.path.join(tempfile.gettempdir(), 'captainslog-ssh-%C')
+        command = ['ssh', '-o', 'BatchMode=yes', '-o', 'ControlMaster=auto', '-o', f'ControlPath={control_path}',
+                   '-o', f'ControlPersist={SSH_CONTROL_PERSIST}']
+        if port:
+            command += ['-p', port]
+        command += ['--', destination, 'docker', 'system', 'dial-stdio']
+        process = await asyncio.create_subprocess_exec(*command,
+                                                       stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL,
+                                                       limit=STREAM_READ_LIMIT)
+        # closing stdin ends dial-stdio, reap the process then
+        asyncio.get_running_loop().create_task(process.wait())
+        return process.stdout, process.stdin
+
+    async def open_connection(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open a new connection, waiting for the backoff of a failing host
+
+        Raises:
+            OSError, asyncio.TimeoutError: the daemon is unreachable
+        """
+        if not self.failures:
+            return await self._attempt()
+        async with self._probe:
+            delay = self._retry_at - time.monotonic()
+            if self.failures and delay > 0:
+                await asyncio.sleep(delay)
+            return await self._attempt()
+
+    async def _attempt(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            connection = await asyncio.wait_for(self._connect(), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            self._failed(e)
+            raise
+        return connection
+
+    async def request(self, path: str, params: Optional[dict] = None, keep_alive: bool = False) -> ResponseHead:
+        """Send a GET request and read the response status and headers
+
+        Args:
+            path (str): API path, e.g. /containers/json
+            params (Optional[dict]): query parameters
+            keep_alive (bool): reuse an idle connection, and allow handing it back with release
+                once the body was read (for short requests). Streams get a connection of their own.
+        """
+        target = path
+        if params:
+            target += '?' + urllib.parse.urlencode(params)
+        connection = 'keep-alive' if keep_alive else 'close'
+        request = f'GET {target} HTTP/1.1\r\nHost: docker\r\nConnection: {connection}\r\n\r\n'.encode()
+        while True:
+            reused = keep_alive and bool(self._idle)
+            reader, writer = self._idle.pop() if reused else await self.open_connection()
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, headers = await asyncio.wait_for(_read_head(reader), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused:
+                    # the daemon closed the idle connection in the meantime
+                    continue
+                self._failed(e)
+                raise
+            except asyncio.TimeoutError as e:
+                writer.close()
+                self._failed(e)
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            self._succeeded()
+            return status, headers, reader, writer
+
+    def release(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: Dict[str, str]):
+        """Keep the connection of a fully read keep-alive response for the next short request"""
+        if headers.get('connection', '').lower() == 'close' or len(self._idle) >= self._max_idle or reader.at_eof():
+            writer.close()
+        else:
+            self._idle.append((reader, writer))
+
+    async def get_json(self, path: str, params: Optional[dict] = None) -> Tuple[int, object]:
+        """Perform a short API request on a pooled connection and decode the JSON response"""
+        async with self.request_slots:
+            status, headers, reader, writer = await self.request(path, params, keep_alive=True)
+            try:
+                body = await asyncio.wait_for(_read_body(reader, headers), self.timeout)
+            except BaseException:
+                writer.close()
+                raise
+            self.release(reader, writer, headers)
+        return status, json.loads(body) if body else None
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+async def _read_head(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str]]:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Docker daemon closed the connection")
+    status = int(status_line.split()[1])
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+    return b''.join([chunk async for chunk in iter_body(reader, headers)])
+
+
+async def iter_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+    """Yield the body of an HTTP response as it arrives, decoding chunked transfer encoding"""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size_line = await reader.readline()
+            if not size_line:
+                raise ConnectionError("Docker daemon closed the connection mid-response")
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                # end of the body (no trailers are sent by the daemon)
+                await reader.readline()
+                return
+            chunk = await reader.readexactly(size)
+            await reader.readexactly(2)
+            yield chunk
+    elif 'content-length' in headers:
+        length = int(headers['content-length'])
+        if length:
+            yield await reader.readexactly(length)
+    else:
+        while True:
+            chunk = await reader.read(2 ** 16)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def iter_json_stream(reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[dict]:
+    """Yield the objects of a newline delimited JSON stream, e.g. the events API"""
+    buffer = b''
+    async for chunk in iter_body(reader, headers):
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
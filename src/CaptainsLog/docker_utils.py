@@ -1,18 +1,288 @@
-import docker
-from docker.models.containers import Container
-from typing import List
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+import json
 import logging
+import re
+import threading
+
+from .docker_api import host_label
 
 logger = logging.getLogger(__file__)
 
-docker_client = docker.from_env()
-
-def list_containers() -> List[Container]:
-    
-    containers = []
-    try:
-        containers = docker_client.containers.list(all=True)
-    except:
-        logger.exception("Failed to retrieve docker container list from daemon")
-        pass
-    return containers
\ No newline at end of file
+# seconds between full container list resyncs (safety net for missed events)
+RESYNC_INTERVAL_S = 30
+# delay (seconds) before resubscribing to the events API after the stream ends
+EVENTS_RECONNECT_DELAY_MIN = 1.0
+EVENTS_RECONNECT_DELAY_MAX = 30.0
+# label docker compose puts on the containers of a project
+COMPOSE_PROJECT_LABEL = 'com.docker.compose.project'
+# keys of the container filters (key=value) passed down to the daemons
+FILTER_KEYS = ('status', 'name', 'label', 'project')
+# statuses the daemons can filter containers by
+DOCKER_STATUSES = ('created', 'restarting', 'running', 'removing', 'paused', 'exited', 'dead')
+# set (e.g. CAPTAINSLOG_FILTER="status=running project=shop") to only list and follow matching containers
+FILTER_ENV = 'CAPTAINSLOG_FILTER'
+
+# container status after each event action (other actions do not change the status)
+EVENT_STATUS = {
+    'create': 'created',
+    'start': 'running',
+    'restart': 'running',
+    'unpause': 'running',
+    'pause': 'paused',
+    'die': 'exited',
+}
+
+
+class ContainerState(NamedTuple):
+    id: str
+    name: str
+    status: str
+    # docker host running the container
+    host: str = ''
+    # docker compose project of the container, empty if it was not started by compose
+    project: str = ''
+
+
+def container_state_from_summary(summary: dict, docker_host: str = '') -> ContainerState:
+    """Build a ContainerState from an entry of the /containers/json response"""
+    return ContainerState(id=summary['Id'],
+                          name=summary['Names'][0].lstrip('/'),
+                          status=summary['State'],
+                          host=docker_host,
+                          project=(summary.get('Labels') or {}).get(COMPOSE_PROJECT_LABEL, ''))
+
+
+class ContainerFilter(NamedTuple):
+    """Containers to list and follow, passed down to the daemons so other containers are never fetched
+
+    A container matches when its status is one of status, its name matches one
+    of the regular expressions in names, it has every label in labels (key or
+    key=value) and belongs to the compose project. Empty fields match every container.
+    """
+    status: Tuple[str, ...] = ()
+    names: Tuple[str, ...] = ()
+    labels: Tuple[str, ...] = ()
+    project: Optional[str] = None
+
+    def daemon_filters(self) -> Dict[str, List[str]]:
+        """The filters parameter of the container list (the daemon matches any value of a key, but every label)"""
+        filters = {}
+        if self.status:
+            filters['status'] = list(self.status)
+        if self.names:
+            filters['name'] = list(self.names)
+        labels = list(self.labels)
+        if self.project is not None:
+            labels.append(f'{COMPOSE_PROJECT_LABEL}={self.project}')
+        if labels:
+            filters['label'] = labels
+        return filters
+
+    def list_params(self) -> dict:
+        """Query parameters of /containers/json"""
+        params = {'all': 1}
+        filters = self.daemon_filters()
+        if filters:
+            params['filters'] = json.dumps(filters)
+        return params
+
+    def event_filters(self) -> Dict[str, List[str]]:
+        """The filters parameter of /events: only labels, status and names are checked by matches"""
+        filters = {'type': ['container']}
+        labels = self.daemon_filters().get('label')
+        if labels:
+            filters['label'] = labels
+        return filters
+
+    def matches(self, state: ContainerState) -> bool:
+        """Whether a container passes the status, name and project filters (labels are left to the daemon)"""
+        if self.status and state.status not in self.status:
+            return False
+        # the daemon matched the bare name, without the @host suffix added when following several hosts
+        # (docker container names cannot contain '@')
+        name = state.name.partition('@')[0]
+        if self.names and not any(re.search(pattern, name) for pattern in self.names):
+            return False
+        return self.project is None or state.project == self.project
+
+
+def parse_container_filter(terms: List[str]) -> ContainerFilter:
+    """Build a ContainerFilter from terms in the syntax of docker ps --filter, e.g.
+    status=running, name=^api, label=tier=web, or project=shop for a compose project
+
+    Raises:
+        ValueError: a term has an unknown key, an unknown status, an invalid regular expression or no value
+    """
+    values: Dict[str, List[str]] = {key: [] for key in FILTER_KEYS}
+    for term in terms:
+        key, sep, value = term.partition('=')
+        if key not in values or not sep or not value:
+            raise ValueError(f"invalid filter {term!r}, expected {', '.join(key + '=...' for key in FILTER_KEYS)}")
+        if key == 'status' and value not in DOCKER_STATUSES:
+            raise ValueError(f"unknown status {value!r}, expected one of {', '.join(DOCKER_STATUSES)}")
+        if key == 'name':
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise ValueError(f"invalid name pattern {value!r}: {e}")
+        values[key].append(value)
+    if len(values['project']) > 1:
+        raise ValueError("only one project can be selected")
+    return ContainerFilter(status=tuple(values['status']),
+                           names=tuple(values['name']),
+                           labels=tuple(values['label']),
+                           project=values['project'][0] if values['project'] else None)
+
+
+def split_filter_text(text: str) -> Tuple[ContainerFilter, List[str]]:
+    """Split the text of a filter box into the terms passed down to the daemons (key=value, see
+    parse_container_filter) and the other words, lowercased
+
+    Raises:
+        ValueError: a key=value term is invalid
+    """
+    terms = []
+    words = []
+    for token in text.split():
+        key, sep, _ = token.partition('=')
+        if sep and key in FILTER_KEYS:
+            terms.append(token)
+        else:
+            words.append(token.lower())
+    return parse_container_filter(terms), words
+
+
+class ContainerInventory:
+    """In-memory model of the containers known to one or more docker daemons
+
+    The model is updated incrementally from the events API, with an occasional
+    full resync per host (see LogIngestionEngine.watch). Only the containers
+    matching container_filter are kept (see set_filter). Changes are collected
+    per container until the consumer calls pop_changes, and on_change is called
+    whenever the first change is pending, and when a host is first listed.
+
+    Args:
+        on_change (Callable[[], None]): called (from any thread) when the first change is pending, or a host
+            was listed for the first time (even without containers)
+        label_hosts (bool): append the host to container names (name@host), for several hosts
+    """
+
+    def __init__(self, on_change: Callable[[], None], label_hosts: bool = False):
+        self.containers: Dict[str, ContainerState] = {}
+        self.on_change = on_change
+        self.label_hosts = label_hosts
+        # hosts whose full container list was received at least once
+        self.listed_hosts: Set[str] = set()
+        # containers kept, requested from the daemons
+        self.container_filter = ContainerFilter()
+        self._changes: Dict[str, Optional[ContainerState]] = {}
+        self._lock = threading.Lock()
+
+    def _update(self, container_id: str, state: Optional[ContainerState]):
+        """Record new state for a container (None when removed). Call with the lock held"""
+        if self.containers.get(container_id) == state:
+            return
+        if state is None:
+            del self.containers[container_id]
+        else:
+            self.containers[container_id] = state
+        self._changes[container_id] = state
+
+    def pop_changes(self) -> Dict[str, Optional[ContainerState]]:
+        """Return the containers changed since the last call
+
+        Returns:
+            Dict[str, Optional[ContainerState]]: new state by container id, None for removed containers
+        """
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        return changes
+
+    def _name(self, name: str, docker_host: str) -> str:
+        """Displayed name of a container, qualified with its host when following several hosts"""
+        return f'{name}@{host_label(docker_host)}' if self.label_hosts and docker_host else name
+
+    def set_filter(self, container_filter: ContainerFilter):
+        """Keep only the containers matching container_filter from now on, dropping those that do not
+        (the daemons are asked for the new selection by LogIngestionEngine.set_container_filter)
+        """
+        with self._lock:
+            had_changes = bool(self._changes)
+            self.container_filter = container_filter
+            for container_id, state in list(self.containers.items()):
+                if not container_filter.matches(state):
+                    self._update(container_id, None)
+            notify = not had_changes and bool(self._changes)
+        if notify:
+            self.on_change()
+
+    def replace_host(self, docker_host: str, summaries: List[dict]):
+        """Replace the containers of a host with a full container list from its daemon
+
+        Args:
+            docker_host (str): host the list comes from
+            summaries (List[dict]): response of the /containers/json endpoint
+        """
+        states = [container_state_from_summary(summary, docker_host) for summary in summaries]
+        states = [state._replace(name=self._name(state.name, docker_host)) for state in states]
+        with self._lock:
+            # in case the list was requested before the filter changed
+            states = [state for state in states if self.container_filter.matches(state)]
+            had_changes = bool(self._changes)
+            current_ids = {state.id for state in states}
+            for container_id, state in list(self.containers.items()):
+                if state.host == docker_host and container_id not in current_ids:
+                    self._update(container_id, None)
+            for state in states:
+                self._update(state.id, state)
+            first_list = docker_host not in self.listed_hosts
+            self.listed_hosts.add(docker_host)
+            notify = (not had_changes and bool(self._changes)) or first_list
+        if notify:
+            self.on_change()
+
+    def apply_event(self, event: dict, docker_host: str = ''):
+        """Update the model from a decoded container event
+
+        Args:
+            event (dict): event from the events API
+            docker_host (str): host the event comes from
+        """
+        action = event.get('Action', '')
+        actor = event.get('Actor', {})
+        container_id = actor.get('ID', event.get('id'))
+        attributes = actor.get('Attributes', {})
+        if not container_id:
+            return
+
+        with self._lock:
+            had_changes = bool(self._changes)
+            current = self.containers.get(container_id)
+            if action == 'destroy':
+                if current is not None:
+                    self._update(container_id, None)
+            elif action == 'rename':
+                if current is not None:
+                    name = self._name(attributes['name'], docker_host) if 'name' in attributes else current.name
+                    state = current._replace(name=name)
+                    self._update(container_id, state if self.container_filter.matches(state) else None)
+            elif action in EVENT_STATUS:
+                if 'name' in attributes:
+                    name = self._name(attributes['name'], docker_host)
+                else:
+                    name = current.name if current else container_id[:12]
+                # events carry the labels of the container as attributes
+                project = attributes.get(COMPOSE_PROJECT_LABEL, current.project if current else '')
+                state = ContainerState(id=container_id,
+                                       name=name,
+                                       status=EVENT_STATUS[action],
+                                       host=docker_host,
+                                       project=project)
+                if self.container_filter.matches(state):
+                    self._update(container_id, state)
+                elif current is not None:
+                    # e.g. stopped while only running containers are followed
+                    self._update(container_id, None)
+            notify = not had_changes and bool(self._changes)
+        if notify:
+            self.on_change()
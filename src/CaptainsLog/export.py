@@ -0,0 +1,400 @@
+import gzip
+import logging
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .log_cache import LogCache
+from .log_store import LogStore
+from .log_stream import format_timestamp
+from .profiling import profiler
+
+logger = logging.getLogger(__file__)
+
+# lines read from a store and written at once
+EXPORT_CHUNK_LINES = 4096
+# seconds between two progress reports
+PROGRESS_INTERVAL = 0.1
+# compressions of exported files, with the suffix usually given to such files
+COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportOptions(NamedTuple):
+    # only export lines logged in [since, until), timestamps in ns (None for no limit)
+    since: Optional[int] = None
+    until: Optional[int] = None
+    # (start, stop) slice of the lines in the time range, negative values count from the end,
+    # e.g. (-10000, None) for the last 10 000 lines (None for every line)
+    lines: Optional[Tuple[Optional[int], Optional[int]]] = None
+    # only export lines containing query (case insensitive), a regular expression when regex is set
+    query: str = ''
+    regex: bool = False
+    # prefix each line with its time
+    timestamps: bool = False
+    # one of COMPRESSIONS
+    compression: str = 'none'
+
+
+class ExportResult(NamedTuple):
+    # lines and (uncompressed) bytes written
+    lines: int
+    bytes: int
+    error: Optional[str] = None
+    cancelled: bool = False
+
+
+def compression_for(path: str) -> str:
+    """Compression matching the suffix of a file name ('none' if it has no known suffix)"""
+    for compression, suffix in COMPRESSIONS.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return 'none'
+
+
+def line_matcher(query: str, regex: bool) -> Optional[Callable[[str], object]]:
+    """Predicate matching lines like the search bar (case insensitive), None for an empty query
+
+    Raises:
+        re.error: query is an invalid regular expression
+    """
+    if not query:
+        return None
+    if regex:
+        return re.compile(query, re.IGNORECASE).search
+    needle = query.lower()
+    return lambda line: needle in line.lower()
+
+
+class ExportSource:
+    """Lines of one container to export: the cached history older than the lines
+    held by its store, then the lines held by the store (either may be None)
+
+    The lines exported are fixed by snapshot(), lines logged afterwards are left out.
+    """
+
+    def __init__(self, name: str, store: Optional[LogStore] = None, cache: Optional[LogCache] = None):
+        self.name = name
+        self.store = store
+        self.cache = cache
+        self._seq_range = (0, 0)
+        # cached lines older than this (ns) are exported, None for every cached line
+        self._cache_until: Optional[int] = None
+
+    def snapshot(self):
+        """Fix the lines to export to those held now"""
+        self._cache_until = None
+        if self.store is None:
+            return
+        with self.store.lock:
+            self._seq_range = self.store.seq_range()
+            if self._seq_range[1] > self._seq_range[0]:
+                # 0 if the time of the held lines is unknown, then the cache cannot be told apart and is left out
+                self._cache_until = self.store.get_timestamp(self._seq_range[0])
+
+    def _cache_range(self, since: Optional[int], until: Optional[int]) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        if self.cache is None or self._cache_until == 0:
+            return None
+        if self._cache_until is not None:
+            until = self._cache_until if until is None else min(until, self._cache_until)
+        return since, until
+
+    def _store_chunks(self) -> Iterator[Tuple[List[int], List[str]]]:
+        first_seq, end_seq = self._seq_range
+        for start in range(first_seq, end_seq, EXPORT_CHUNK_LINES):
+            _, timestamps, lines = self.store.read_timestamped(start, min(start + EXPORT_CHUNK_LINES, end_seq))
+            if lines:
+                yield timestamps, lines
+
+    def count(self, since: Optional[int], until: Optional[int]) -> int:
+        """Number of lines logged in [since, until)"""
+        total = 0
+        cache_range = self._cache_range(since, until)
+        if cache_range is not None:
+            total += self.cache.count(*cache_range)
+        if self.store is not None:
+            for timestamps, _ in self._store_chunks():
+                total += sum(1 for timestamp in timestamps if _in_range(timestamp, since, until))
+        return total
+
+    def chunks(self, since: Optional[int], until: Optional[int]) -> Iterator[Tuple[List[int], List[str]]]:
+        """Yield the timestamps and lines logged in [since, until), oldest first, a chunk at a time
+
+        Lines evicted from the store while the export runs are skipped.
+        """
+        cache_range = self._cache_range(since, until)
+        if cache_range is not None:
+            yield from self.cache.read_between(*cache_range)
+        if self.store is None:
+            return
+        for timestamps, lines in self._store_chunks():
+            if since is not None or until is not None:
+                selected = [i for i, timestamp in enumerate(timestamps) if _in_range(timestamp, since, until)]
+                if len(selected) < len(lines):
+                    timestamps = [timestamps[i] for i in selected]
+                    lines = [lines[i] for i in selected]
+            if lines:
+                yield timestamps, lines
+
+
+def _in_range(timestamp: int, since: Optional[int], until: Optional[int]) -> bool:
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
+
+
+class _Progress:
+    """Count the lines done, check for cancellation and report progress at most every PROGRESS_INTERVAL"""
+
+    def __init__(self, total: int, report: Optional[Callable[[int, int], object]], cancelled: Callable[[], bool]):
+        self.total = total
+        self.done = 0
+        self.report = report
+        self.cancelled = cancelled
+        self.last_report = 0.0
+
+    def advance(self, n_lines: int):
+        if self.cancelled():
+            raise ExportCancelled()
+        self.done += n_lines
+        now = time.monotonic()
+        if self.report is not None and now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.report(self.done, self.total)
+
+    def finish(self):
+        if self.report is not None:
+            self.report(self.total, self.total)
+
+
+class _Uncompressed:
+    """Pass writes through to an output without closing it"""
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+
+    def write(self, data: bytes) -> int:
+        return self.output.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def compressed_writer(output: BinaryIO, compression: str) -> BinaryIO:
+    """File object compressing the data written to it into output.
+    Closing it completes the compressed stream but leaves output open.
+    """
+    if compression == 'none':
+        return _Uncompressed(output)
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=output, mode='wb', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ExportError("zstd compression needs the zstandard module (pip install CaptainsLog[zstd])")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(output, closefd=False)
+    raise ExportError(f"Unknown compression {compression}")
+
+
+def _write_source(source: ExportSource, writer: BinaryIO, options: ExportOptions,
+                  line_range: Tuple[int, int], matches: Optional[Callable[[str], object]],
+                  progress: _Progress) -> Tuple[int, int]:
+    """Write the lines of source in line_range (positions within its time range) that match
+
+    Returns:
+        Tuple[int, int]: number of lines and bytes written
+    """
+    n_lines = n_bytes = 0
+    position = 0
+    start, stop = line_range
+    for timestamps, lines in source.chunks(options.since, options.until):
+        chunk_start, chunk_end = position, position + len(lines)
+        position = chunk_end
+        if chunk_end <= start:
+            continue
+        if chunk_start >= stop:
+            break
+        with profiler.span('export chunk', 'export'):
+            first, last = max(start - chunk_start, 0), min(stop, chunk_end) - chunk_start
+            if first or last < len(lines):
+                timestamps, lines = timestamps[first:last], lines[first:last]
+            progress.advance(len(lines))
+            if matches is not None:
+                selected = [i for i, line in enumerate(lines) if matches(line)]
+                timestamps = [timestamps[i] for i in selected]
+                lines = [lines[i] for i in selected]
+            if not lines:
+                continue
+            if options.timestamps:
+                text = ''.join([f'{format_timestamp(timestamp)} {line}\n'
+                                for timestamp, line in zip(timestamps, lines)])
+            else:
+                text = '\n'.join(lines) + '\n'
+            data = text.encode('utf-8')
+            writer.write(data)
+        n_lines += len(lines)
+        n_bytes += len(data)
+    return n_lines, n_bytes
+
+
+def archive_member_name(name: str) -> str:
+    """File name of the log of a container in an export archive"""
+    return re.sub(r'[^A-Za-z0-9_.@-]', '_', name) + '.log'
+
+
+def export_logs(sources: List[ExportSource], output: BinaryIO, options: ExportOptions,
+                progress: Optional[Callable[[int, int], object]] = None,
+                cancelled: Callable[[], bool] = lambda: False) -> Tuple[int, int]:
+    """Stream the logs of one or more containers to output, a chunk at a time
+
+    A single container is written as plain text, several containers as a tar
+    archive holding one <name>.log file per container (each is first spooled to
+    a temporary file, as tar needs the size of a member before its content).
+    With compression the whole output is compressed (e.g. a .tar.gz archive).
+
+    Args:
+        sources (List[ExportSource]): containers to export
+        output (BinaryIO): binary file object to write to, left open
+        options (ExportOptions): range, filter, format and compression of the export
+        progress (Optional[Callable[[int, int], object]]): called with the number of lines done and to do
+        cancelled (Callable[[], bool]): checked between chunks, the export stops when it returns True
+
+    Raises:
+        ExportCancelled: cancelled returned True
+        ExportError: the compression is unavailable
+        re.error: the query is an invalid regular expression
+
+    Returns:
+        Tuple[int, int]: number of lines and (uncompressed) bytes written
+    """
+    matches = line_matcher(options.query, options.regex)
+    line_ranges = []
+    for source in sources:
+        source.snapshot()
+        count = source.count(options.since, options.until)
+        start, stop, _ = slice(*(options.lines or (None, None))).indices(count)
+        line_ranges.append((start, max(start, stop)))
+    tracker = _Progress(sum(stop - start for start, stop in line_ranges), progress, cancelled)
+
+    n_lines = n_bytes = 0
+    writer = compressed_writer(output, options.compression)
+    if len(sources) == 1:
+        n_lines, n_bytes = _write_source(sources[0], writer, options, line_ranges[0], matches, tracker)
+    else:
+        with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+            for source, line_range in zip(sources, line_ranges):
+                with tempfile.TemporaryFile(prefix='captainslog-export-') as spool:
+                    source_lines, source_bytes = _write_source(source, spool, options, line_range, matches, tracker)
+                    n_lines += source_lines
+                    n_bytes += source_bytes
+                    member = tarfile.TarInfo(archive_member_name(source.name))
+                    member.size = spool.tell()
+                    member.mtime = int(time.time())
+                    member.mode = 0o644
+                    spool.seek(0)
+                    archive.addfile(member, spool)
+    writer.close()
+    tracker.finish()
+    return n_lines, n_bytes
+
+
+class FileOutput:
+    """Output file that only replaces path once the export is complete"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.partial_path = path.with_name(path.name + '.part')
+        self.file = open(self.partial_path, 'wb')
+
+    def write(self, data: bytes) -> int:
+        return self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        """Discard what was written, keeping any previous file at path"""
+        self.file.close()
+        self.partial_path.unlink(missing_ok=True)
+
+
+class ExportJob:
+    """Export running on a thread of its own, so that exporting a huge log never blocks the main loop
+
+    Args:
+        sources (List[ExportSource]): containers to export
+        open_output (Callable[[], BinaryIO]): opens the file to write (called on the export thread). Once the
+            export is complete its close method is called, after a failure its abort method (if any)
+        options (ExportOptions): range, filter, format and compression of the export
+        dispatch (Callable[..., object]): function called with (callback, *args), e.g. GLib.idle_add
+        progress (Callable[[int, int], object]): dispatched with the number of lines done and to do
+        done (Callable[[ExportResult], object]): dispatched once the export completed, failed or was cancelled
+    """
+
+    def __init__(self, sources: List[ExportSource], open_output: Callable[[], BinaryIO], options: ExportOptions,
+                 dispatch: Callable[..., object], progress: Callable[[int, int], object],
+                 done: Callable[[ExportResult], object]):
+        self.sources = sources
+        self.open_output = open_output
+        self.options = options
+        self.dispatch = dispatch
+        self.progress = progress
+        self.done = done
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log-export', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        """Stop the export, leaving any previous file in place"""
+        self._cancelled.set()
+
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def _run(self):
+        output = None
+        try:
+            output = self.open_output()
+            with profiler.span('export', 'export', containers=len(self.sources)):
+                n_lines, n_bytes = export_logs(self.sources, output, self.options,
+                                               progress=lambda done, total: self.dispatch(self.progress, done, total),
+                                               cancelled=self.cancelled)
+            output.close()
+            result = ExportResult(lines=n_lines, bytes=n_bytes)
+        except ExportCancelled:
+            result = ExportResult(lines=0, bytes=0, cancelled=True)
+        except (OSError, ExportError, re.error) as e:
+            logger.warning(f"Export failed: {e}")
+            result = ExportResult(lines=0, bytes=0, error=str(e))
+        except Exception as e:
+            logger.exception("Export failed")
+            result = ExportResult(lines=0, bytes=0, error=str(e))
+        if result.error is not None or result.cancelled:
+            if output is not None:
+                try:
+                    getattr(output, 'abort', output.close)()
+                except OSError:
+                    logger.warning("Could not discard the incomplete export", exc_info=True)
+        self.dispatch(self.done, result)
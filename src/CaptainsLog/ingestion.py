@@ -0,0 +1,400 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .docker_api import (DEFAULT_MAX_REQUESTS, DockerEndpoint, HostStatus, ResponseHead, docker_hosts, iter_body,
+                         iter_json_stream)
+from .docker_utils import EVENTS_RECONNECT_DELAY_MAX, EVENTS_RECONNECT_DELAY_MIN, ContainerFilter, ContainerInventory
+from .log_store import LogStore
+from .profiling import profiler
+from .log_stream import FrameDecoder, LineDecoder, format_since, split_timestamp
+from .supervisor import TAILER_LIVE, Tailer, TailerStatus, TailerSupervisor
+
+logger = logging.getLogger(__file__)
+
+# maximum number of log streams (one socket each) open at the same time
+DEFAULT_MAX_STREAMS = 100
+# seconds between batches of new lines appended to the log stores
+LOG_BATCH_INTERVAL = 0.1
+# container event actions after which its log stream is reopened without waiting for the backoff
+WAKE_ACTIONS = ('start', 'restart', 'unpause')
+
+
+class LogIngestionEngine:
+    """Follow the logs of many containers, on one or more docker hosts, from one asyncio event loop
+
+    The loop runs in a single background thread and talks to the docker daemons
+    directly over their sockets, through one DockerEndpoint per host (pooled
+    connections, per-host backoff), so a slow or unreachable host never holds
+    up the others. Each followed container holds one streaming request while it
+    is running, and at most max_streams streams are open at once (further
+    containers wait for a free slot). A TailerSupervisor owns the stream of
+    every followed container: it reopens it from the last line received when it
+    ends or fails, with a jittered backoff, and reports its state. New lines are collected per container and
+    appended to its LogStore in batches, after which dispatch(notify) is called,
+    e.g. with dispatch=GLib.idle_add to refresh the view from the GTK main loop.
+    The container list and events of each host can be kept in a
+    ContainerInventory as well (see watch).
+    """
+
+    def __init__(self,
+                 dispatch: Callable[..., object],
+                 docker_host: Optional[str] = None,
+                 max_streams: int = DEFAULT_MAX_STREAMS,
+                 max_requests: int = DEFAULT_MAX_REQUESTS,
+                 batch_interval: float = LOG_BATCH_INTERVAL):
+        self.dispatch = dispatch
+        # host of the containers followed without naming one
+        self.docker_host = docker_host if docker_host is not None else docker_hosts()[0]
+        self.max_requests = max_requests
+        self.batch_interval = batch_interval
+        self.loop = asyncio.new_event_loop()
+        self._endpoints: Dict[str, DockerEndpoint] = {}
+        self._stream_slots = asyncio.Semaphore(max_streams)
+        self._supervisor = TailerSupervisor(self.loop, self._stream_logs)
+        self._pending: Dict[str, Tuple[List[int], List[str]]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._watchers: Dict[str, Tuple[asyncio.Task, ContainerInventory]] = {}
+        self._thread = threading.Thread(target=self._run, name='log-ingestion', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Cancel all log streams and stop the event loop"""
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+
+    def endpoint(self, docker_host: Optional[str] = None) -> DockerEndpoint:
+        """The endpoint of a host (default: the engine's), created on first use. Call from the event loop"""
+        docker_host = docker_host if docker_host is not None else self.docker_host
+        endpoint = self._endpoints.get(docker_host)
+        if endpoint is None:
+            endpoint = self._endpoints[docker_host] = DockerEndpoint(docker_host, self.max_requests)
+        return endpoint
+
+    def host_statuses(self) -> List[HostStatus]:
+        """Health of every host used so far (safe to call from any thread)"""
+        return [endpoint.status() for endpoint in list(self._endpoints.values())]
+
+    def tailer_statuses(self) -> Dict[str, TailerStatus]:
+        """State of the log stream of every followed container, by container id (safe to call from any thread)"""
+        return {status.container_id: status for status in self._supervisor.statuses()}
+
+    def follow(self, container_id: str, store: LogStore, notify: Callable[[], object],
+               tail: Optional[int] = None, since: Optional[int] = None, docker_host: Optional[str] = None):
+        """Start following the logs of a container (safe to call from any thread)
+
+        Args:
+            container_id (str): id of the container
+            store (LogStore): store new lines are appended to, or any sink with a LogStore
+                compatible extend method (e.g. to write them out as they arrive)
+            notify (Callable[[], object]): passed to dispatch after each batch appended to store
+            tail (Optional[int]): number of existing lines to start with, None for the whole history
+            since (Optional[int]): timestamp (ns) of the last line already held, only newer lines
+                are fetched (takes precedence over tail)
+            docker_host (Optional[str]): host running the container, None for the engine's
+        """
+        self.loop.call_soon_threadsafe(self._start_follow, container_id, store, notify, tail, since, docker_host)
+
+    def unfollow(self, *container_ids: str):
+        """Stop following the logs of containers (safe to call from any thread)
+
+        Returns right away, the streams are closed on the event loop afterwards, so
+        pass every container removed at once instead of calling this for each one.
+        """
+        self.loop.call_soon_threadsafe(self._stop_follow, container_ids)
+
+    def watch(self, inventory: ContainerInventory, docker_host: Optional[str] = None):
+        """Keep inventory up to date with the containers of a host, from its events
+        and a full container list each time the events stream is (re)opened
+        (safe to call from any thread)
+
+        Args:
+            inventory (ContainerInventory): model to update, may be shared by several hosts
+            docker_host (Optional[str]): host to watch, None for the engine's
+        """
+        self.loop.call_soon_threadsafe(self._start_watch, inventory, docker_host)
+
+    def set_container_filter(self, container_filter: ContainerFilter):
+        """Change the containers kept by the watched inventories, listing them again from every host
+        with the new filters (safe to call from any thread)
+        """
+        self.loop.call_soon_threadsafe(self._set_filter, container_filter)
+
+    def resync(self):
+        """Refresh the inventories with full container lists of every watched host (safe to call from any thread)"""
+        self.loop.call_soon_threadsafe(self._resync_all)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _shutdown(self):
+        tasks = [tailer.task for tailer in self._supervisor.tailers.values() if tailer.task is not None]
+        tasks += [task for task, _ in self._watchers.values()]
+        self._stop_follow(list(self._supervisor.tailers))
+        for task, _ in self._watchers.values():
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for endpoint in self._endpoints.values():
+            endpoint.close()
+        self.loop.stop()
+
+    def _start_follow(self, container_id: str, store: LogStore, notify: Callable[[], object],
+                      tail: Optional[int], since: Optional[int], docker_host: Optional[str]):
+        self._supervisor.start(Tailer(container_id, store, notify, tail, since, docker_host))
+
+    def _stop_follow(self, container_ids: List[str]):
+        with profiler.span('stop tailers', 'ingestion', containers=len(container_ids)):
+            for container_id in container_ids:
+                if self._supervisor.stop(container_id) is not None:
+                    self._pending.pop(container_id, None)
+
+    def _pending_lines(self, container_id: str) -> Tuple[List[int], List[str]]:
+        """Return the timestamps and lines queued for the next batch of a container, to append new lines to"""
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.batch_interval, self._flush)
+        return self._pending.setdefault(container_id, ([], []))
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        with profiler.span('append batches', 'ingestion', containers=len(pending)):
+            for container_id, (timestamps, lines) in pending.items():
+                tailer = self._supervisor.tailers.get(container_id)
+                if tailer is None or not lines:
+                    continue
+                tailer.store.extend(timestamps, lines)
+                self.dispatch(tailer.notify)
+
+    def _start_watch(self, inventory: ContainerInventory, docker_host: Optional[str]):
+        endpoint = self.endpoint(docker_host)
+        if endpoint.docker_host in self._watchers:
+            return
+        task = self.loop.create_task(self._watch(endpoint, inventory))
+        self._watchers[endpoint.docker_host] = (task, inventory)
+
+    def _set_filter(self, container_filter: ContainerFilter):
+        for inventory in {id(inventory): inventory for _, inventory in self._watchers.values()}.values():
+            inventory.set_filter(container_filter)
+        # the events streams are filtered too, so they are reopened (which lists the containers again)
+        for docker_host, (task, inventory) in list(self._watchers.items()):
+            task.cancel()
+            self._watchers[docker_host] = (self.loop.create_task(self._watch(self.endpoint(docker_host), inventory)),
+                                           inventory)
+
+    def _resync_all(self):
+        for docker_host, (_, inventory) in self._watchers.items():
+            self.loop.create_task(self._resync(self.endpoint(docker_host), inventory))
+
+    async def _resync(self, endpoint: DockerEndpoint, inventory: ContainerInventory) -> bool:
+        """Replace the containers of a host in the inventory with a full list (a single API call)
+
+        Returns:
+            bool: whether the container list could be retrieved
+        """
+        try:
+            with profiler.span('docker containers list', 'docker', host=endpoint.label):
+                status, summaries = await endpoint.get_json('/containers/json',
+                                                            inventory.container_filter.list_params())
+            if status != 200:
+                raise ConnectionError(f"Listing containers failed with status {status}")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning(f"Failed to retrieve the container list of {endpoint.label}", exc_info=True)
+            return False
+        inventory.replace_host(endpoint.docker_host, summaries)
+        return True
+
+    async def _watch(self, endpoint: DockerEndpoint, inventory: ContainerInventory):
+        """Apply the container events of a host to inventory until cancelled
+
+        A full resync is done each time the events stream is (re)opened, so nothing
+        that happened while disconnected is missed. Followed containers that start
+        again get their log stream reopened right away.
+        """
+        reconnect_delay = EVENTS_RECONNECT_DELAY_MIN
+        while True:
+            try:
+                status, headers, reader, writer = await endpoint.request(
+                    '/events', {'filters': json.dumps(inventory.container_filter.event_filters())})
+                try:
+                    if status != 200:
+                        raise ConnectionError(f"Events request failed with status {status}")
+                    if await self._resync(endpoint, inventory):
+                        reconnect_delay = EVENTS_RECONNECT_DELAY_MIN
+                    async for event in iter_json_stream(reader, headers):
+                        inventory.apply_event(event, endpoint.docker_host)
+                        if event.get('Action') in WAKE_ACTIONS:
+                            self._supervisor.wake(event.get('Actor', {}).get('ID', event.get('id')))
+                finally:
+                    writer.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning(f"Events stream of {endpoint.label} interrupted, reconnecting", exc_info=True)
+            await asyncio.sleep(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, EVENTS_RECONNECT_DELAY_MAX)
+
+    async def _open_logs(self, endpoint: DockerEndpoint, container_id: str,
+                         params: dict) -> Optional[Tuple[bool, ResponseHead]]:
+        """Request the logs of a container
+
+        Returns:
+            Optional[Tuple[bool, ResponseHead]]: whether the container uses a TTY and the
+            response, None if the container does not exist (anymore)
+        """
+        with profiler.span('docker inspect', 'docker', container=container_id[:12]):
+            status, info = await endpoint.get_json(f'/containers/{container_id}/json')
+        if status == 404:
+            return None
+        if status != 200:
+            raise ConnectionError(f"Inspecting container failed with status {status}")
+
+        params = dict(params, stdout=1, stderr=1, timestamps=1)
+        with profiler.span('docker logs request', 'docker', container=container_id[:12]):
+            response = await endpoint.request(f'/containers/{container_id}/logs', params)
+        status = response[0]
+        if status == 200:
+            return info['Config']['Tty'], response
+        response[3].close()
+        if status == 404:
+            return None
+        raise ConnectionError(f"Log request failed with status {status}")
+
+    async def _stream_logs(self, tailer: Tailer) -> bool:
+        """Stream the logs of a container from the cursor of its tailer until the stream ends
+        (container stopped) or fails, see TailerSupervisor
+
+        Returns:
+            bool: False if the container does not exist (anymore)
+        """
+        container_id = tailer.container_id
+        async with self._stream_slots:
+            params = {'follow': 1}
+            if tailer.cursor is not None:
+                params['since'] = format_since(tailer.cursor)
+            elif tailer.tail is not None:
+                params['tail'] = tailer.tail
+            opened = await self._open_logs(self.endpoint(tailer.docker_host), container_id, params)
+            if opened is None:
+                return False
+            tty, (_, headers, reader, writer) = opened
+            tailer.state = TAILER_LIVE
+            # a reopened stream repeats the lines logged at the cursor, which were already delivered. Only
+            # those are skipped: stdout and stderr are timestamped separately, so a line of a live stream
+            # may be logged at or before the one received before it
+            resume = tailer.cursor
+            # stores and caches rely on sorted timestamps, every line gets at least the timestamp of the one before
+            previous = tailer.cursor or 0
+            try:
+                async for batch in _read_log_lines(reader, headers, tty, container_id):
+                    timestamps, lines = self._pending_lines(container_id)
+                    for timestamp, text in batch:
+                        if timestamp is None:
+                            timestamp = previous or time.time_ns()
+                        elif resume is not None and timestamp <= resume:
+                            continue
+                        else:
+                            tailer.cursor = max(tailer.cursor or 0, timestamp)
+                        previous = max(previous, timestamp)
+                        timestamps.append(previous)
+                        lines.append(text)
+                        tailer.received = True
+            finally:
+                writer.close()
+        return True
+
+    async def _fetch(self, endpoint: DockerEndpoint, container_id: str,
+                     params: dict) -> Tuple[List[int], List[str]]:
+        """Read the (finite) logs of a container selected by params, e.g. tail and until"""
+        timestamps: List[int] = []
+        lines: List[str] = []
+        async with self._stream_slots:
+            opened = await self._open_logs(endpoint, container_id, params)
+            if opened is None:
+                return timestamps, lines
+            tty, (_, headers, reader, writer) = opened
+            try:
+                async for batch in _read_log_lines(reader, headers, tty, container_id):
+                    for timestamp, text in batch:
+                        if timestamp is None:
+                            timestamp = timestamps[-1] if timestamps else time.time_ns()
+                        timestamps.append(max(timestamp, timestamps[-1]) if timestamps else timestamp)
+                        lines.append(text)
+            finally:
+                writer.close()
+        return timestamps, lines
+
+    def backfill(self, container_id: str, store: LogStore, n_lines: int, notify: Callable[[], object],
+                 since: Optional[int] = None, docker_host: Optional[str] = None):
+        """Fetch up to n_lines lines older than those held by store and insert them before them
+        (safe to call from any thread)
+
+        Args:
+            container_id (str): id of the container
+            store (LogStore): store to backfill
+            n_lines (int): maximum number of older lines to fetch
+            notify (Callable[[], object]): passed to dispatch once done, whether or not lines were found
+            since (Optional[int]): timestamp (ns) of the oldest line to fetch, None for no limit
+            docker_host (Optional[str]): host running the container, None for the engine's
+        """
+        asyncio.run_coroutine_threadsafe(self._backfill(container_id, store, n_lines, notify, since, docker_host),
+                                         self.loop)
+
+    async def _backfill(self, container_id: str, store: LogStore, n_lines: int, notify: Callable[[], object],
+                        since: Optional[int], docker_host: Optional[str]):
+        try:
+            with store.lock:
+                first_timestamp = store.get_timestamp(store.first_seq)
+                n_held = len(store)
+            if not first_timestamp or n_lines <= 0:
+                return
+            # the daemon applies tail before until, so also ask for the lines already held
+            params = {'tail': n_lines + n_held, 'until': format_since(first_timestamp)}
+            if since is not None:
+                params['since'] = format_since(since)
+            try:
+                timestamps, lines = await self._fetch(self.endpoint(docker_host), container_id, params)
+            except Exception:
+                logger.warning(f"Failed to backfill logs of {container_id}", exc_info=True)
+                return
+            older = [i for i, timestamp in enumerate(timestamps) if timestamp < first_timestamp]
+            if older:
+                older = older[-n_lines:]
+                store.backfill([timestamps[i] for i in older], [lines[i] for i in older])
+        finally:
+            self.dispatch(notify)
+
+
+async def _read_log_lines(reader: asyncio.StreamReader,
+                          headers: Dict[str, str],
+                          tty: bool,
+                          container_id: str = '') -> AsyncIterator[List[Tuple[Optional[int], str]]]:
+    """Yield the timestamp (None if missing) and sanitized text of the lines of a logs response,
+    in batches of the lines completed by each chunk received
+    """
+    # TTY containers send the raw stream, others multiplex stdout/stderr in frames
+    frames = None if tty else FrameDecoder()
+    decoders: Dict[int, LineDecoder] = {}
+    async for chunk in iter_body(reader, headers):
+        profiler.add('tailer bytes', container_id, len(chunk))
+        with profiler.span('decode chunk', 'ingestion'):
+            payloads = frames.feed(chunk) if frames is not None else [(1, chunk)]
+            batch = []
+            for stream_type, payload in payloads:
+                decoder = decoders.get(stream_type)
+                if decoder is None:
+                    decoder = decoders[stream_type] = LineDecoder()
+                batch.extend(map(split_timestamp, decoder.feed(payload)))
+        if batch:
+            yield batch
+
+    # response ended, keep trailing output without a newline
+    batch = [split_timestamp(line) for decoder in decoders.values() for line in decoder.flush()]
+    if batch:
+        yield batch
@@ -0,0 +1,483 @@
+import bisect
+import logging
+import mmap
+import os
+import queue
+import re
+import shutil
+import struct
+import threading
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__file__)
+
+# lines per compressed block (a block is also written once it holds BLOCK_BYTES of text)
+BLOCK_LINES = 4096
+BLOCK_BYTES = 256 * 2 ** 10
+# size after which a new segment file is started
+SEGMENT_MAX_BYTES = 32 * 2 ** 20
+# on-disk budget per container, the oldest segments are deleted first
+CACHE_MAX_BYTES = 256 * 2 ** 20
+# caches of containers that logged nothing for this long are deleted
+CACHE_MAX_AGE_S = 30 * 24 * 3600
+# seconds after which buffered lines are written even if the block is not full
+FLUSH_INTERVAL = 5.0
+# file of a cache directory locked by the LogCache writing to it, so two processes never append to the same files
+LOCK_FILE = 'lock'
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+# index record: first and last timestamp of the block, offset in the segment, number of lines
+INDEX_RECORD = struct.Struct('<qqQI4x')
+# block header: codec, compressed size
+BLOCK_HEADER = struct.Struct('<BI')
+
+
+class LogCacheError(Exception):
+    pass
+
+
+class LogCacheLocked(LogCacheError):
+    pass
+
+
+def default_cache_root() -> Path:
+    return Path(os.environ.get('XDG_CACHE_HOME', '~/.cache')).expanduser().joinpath('CaptainsLog', 'logs')
+
+
+def cache_directory(container_name: str, root: Optional[Path] = None) -> Path:
+    """Directory holding the cached log of a container
+
+    Caches are keyed by container name, so a container recreated under the same
+    name (e.g. by docker compose) continues the history of the previous one.
+    """
+    return (root or default_cache_root()).joinpath(re.sub(r'[^A-Za-z0-9_.-]', '_', container_name))
+
+
+def _lock_directory(directory: Path) -> Optional[BinaryIO]:
+    """Take the exclusive lock of a cache directory, held until the returned file is closed
+    (None where file locks are not supported)
+
+    Raises:
+        LogCacheLocked: the lock is held, e.g. by captainslog record running next to the viewer
+    """
+    if fcntl is None:
+        return None
+    lock_file = open(directory.joinpath(LOCK_FILE), 'ab')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise LogCacheLocked(f"Log cache {directory} is in use by another process")
+    return lock_file
+
+
+def _compress(data: bytes) -> Tuple[int, bytes]:
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=3).compress(data)
+    return CODEC_ZLIB, zlib.compress(data, 6)
+
+
+def _decompress(codec: int, data: bytes) -> bytes:
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise LogCacheError("Log cache block is zstd compressed but the zstandard module is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise LogCacheError(f"Unknown log cache codec {codec}")
+
+
+def _encode_block(timestamps: List[int], lines: List[str]) -> bytes:
+    header = struct.pack('<I', len(lines))
+    return header + array('q', timestamps).tobytes() + '\n'.join(lines).encode('utf-8')
+
+
+def _decode_block(data: bytes) -> Tuple[List[int], List[str]]:
+    n_lines, = struct.unpack_from('<I', data)
+    end = 4 + 8 * n_lines
+    timestamps = array('q')
+    timestamps.frombytes(data[4:end])
+    lines = data[end:].decode('utf-8', errors='replace').split('\n') if n_lines else []
+    return timestamps.tolist(), lines
+
+
+class BlockRecord(NamedTuple):
+    first_timestamp: int
+    last_timestamp: int
+    offset: int
+    n_lines: int
+
+
+class Segment:
+    """Segment file of compressed blocks (<name>.seg) with its sparse time index (<name>.idx)
+
+    The index holds one fixed-size record per block, so a segment can be
+    searched by timestamp without decompressing anything.
+    """
+
+    def __init__(self, seg_path: Path, repair: bool = True):
+        self.seg_path = seg_path
+        self.idx_path = seg_path.with_suffix('.idx')
+        self.records: List[BlockRecord] = []
+        if self.idx_path.exists() and self.idx_path.stat().st_size:
+            with open(self.idx_path, 'rb') as idx_file, \
+                    mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ) as index:
+                usable = len(index) - len(index) % INDEX_RECORD.size
+                self.records = [BlockRecord(*record) for record in INDEX_RECORD.iter_unpack(index[:usable])]
+        self.size = seg_path.stat().st_size if seg_path.exists() else 0
+        if repair:
+            self._repair()
+        else:
+            # a block being written is only indexed once complete
+            while self.records and self.records[-1].offset >= self.size:
+                self.records.pop()
+
+    def _repair(self):
+        """Drop blocks written without index record (or vice versa) by an interrupted write"""
+        while self.records and self.records[-1].offset >= self.size:
+            self.records.pop()
+        end = self._block_end(len(self.records) - 1) if self.records else 0
+        if end != self.size or self.idx_path.exists() and \
+                self.idx_path.stat().st_size != len(self.records) * INDEX_RECORD.size:
+            if self.seg_path.exists():
+                os.truncate(self.seg_path, end)
+            with open(self.idx_path, 'wb') as idx_file:
+                for record in self.records:
+                    idx_file.write(INDEX_RECORD.pack(*record))
+            self.size = end
+
+    def _block_end(self, number: int) -> int:
+        offset = self.records[number].offset
+        with open(self.seg_path, 'rb') as seg_file:
+            seg_file.seek(offset)
+            header = seg_file.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return offset
+        _, compressed_size = BLOCK_HEADER.unpack(header)
+        return min(offset + BLOCK_HEADER.size + compressed_size, self.size)
+
+    def append_block(self, timestamps: List[int], lines: List[str]):
+        codec, data = _compress(_encode_block(timestamps, lines))
+        record = BlockRecord(timestamps[0], timestamps[-1], self.size, len(lines))
+        with open(self.seg_path, 'ab') as seg_file:
+            seg_file.write(BLOCK_HEADER.pack(codec, len(data)) + data)
+        with open(self.idx_path, 'ab') as idx_file:
+            idx_file.write(INDEX_RECORD.pack(*record))
+        self.records.append(record)
+        self.size += BLOCK_HEADER.size + len(data)
+
+    def read_block(self, number: int) -> Tuple[List[int], List[str]]:
+        offset = self.records[number].offset
+        with open(self.seg_path, 'rb') as seg_file, \
+                mmap.mmap(seg_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            codec, compressed_size = BLOCK_HEADER.unpack_from(data, offset)
+            start = offset + BLOCK_HEADER.size
+            return _decode_block(_decompress(codec, data[start:start + compressed_size]))
+
+    def delete(self):
+        for path in (self.seg_path, self.idx_path):
+            if path.exists():
+                path.unlink()
+
+
+class LogCache:
+    """Append-only, compressed on-disk log history of a single container
+
+    Lines are buffered and written in compressed blocks to segment files named
+    after their first timestamp. Reading the most recent lines, or the lines
+    before a timestamp, only decompresses the blocks needed. Thread-safe.
+
+    A cache is only written by one LogCache at a time, which locks its directory
+    until closed. Read only caches take no lock and leave the files untouched,
+    so they can read a cache while another process writes it.
+
+    Args:
+        directory (Path): directory of the cache, created if needed
+        max_bytes (int): on-disk budget, the oldest segments are deleted first
+        read_only (bool): only read the cache
+
+    Raises:
+        LogCacheLocked: the cache is written by another LogCache (not read_only)
+    """
+
+    def __init__(self, directory: Path, max_bytes: int = CACHE_MAX_BYTES, read_only: bool = False):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.lock = threading.Lock()
+        self._lock_file: Optional[BinaryIO] = None
+        if not read_only:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._lock_file = _lock_directory(directory)
+        self._segments = [Segment(path, repair=not read_only) for path in sorted(directory.glob('*.seg'))]
+        self._segments = [segment for segment in self._segments if segment.records]
+        self._pending_timestamps: List[int] = []
+        self._pending_lines: List[str] = []
+        self._pending_bytes = 0
+
+    def last_timestamp(self) -> Optional[int]:
+        """Timestamp of the most recent cached line, None if nothing is cached"""
+        with self.lock:
+            if self._pending_timestamps:
+                return self._pending_timestamps[-1]
+            if self._segments:
+                return self._segments[-1].records[-1].last_timestamp
+        return None
+
+    def append(self, timestamps: List[int], lines: List[str]):
+        """Add lines to the cache, writing a block whenever enough lines are buffered"""
+        if self.read_only:
+            raise LogCacheError(f"Log cache {self.directory} is read only")
+        with self.lock:
+            self._pending_timestamps.extend(timestamps)
+            self._pending_lines.extend(lines)
+            self._pending_bytes += sum(len(line) for line in lines)
+            if len(self._pending_lines) >= BLOCK_LINES or self._pending_bytes >= BLOCK_BYTES:
+                self._write_pending()
+
+    def flush(self):
+        """Write the buffered lines to disk"""
+        with self.lock:
+            self._write_pending()
+
+    def close(self):
+        """Write the buffered lines to disk and unlock the directory"""
+        with self.lock:
+            self._write_pending()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _write_pending(self):
+        if not self._pending_lines:
+            return
+        timestamps, lines = self._pending_timestamps, self._pending_lines
+        self._pending_timestamps, self._pending_lines, self._pending_bytes = [], [], 0
+        for start in range(0, len(lines), BLOCK_LINES):
+            if not self._segments or self._segments[-1].size >= SEGMENT_MAX_BYTES:
+                self._segments.append(Segment(self.directory.joinpath(f'{timestamps[start]:020d}.seg')))
+            self._segments[-1].append_block(timestamps[start:start + BLOCK_LINES], lines[start:start + BLOCK_LINES])
+
+        # enforce the on-disk budget, always keeping the segment being written
+        while len(self._segments) > 1 and sum(segment.size for segment in self._segments) > self.max_bytes:
+            self._segments.pop(0).delete()
+
+    def read_before(self, until: Optional[int], n_lines: int,
+                    since: Optional[int] = None) -> Tuple[List[int], List[str]]:
+        """Return up to n_lines of the most recent cached lines logged before until
+
+        Args:
+            until (Optional[int]): only return lines with a timestamp (ns) lower than this, None for no limit
+            n_lines (int): maximum number of lines to return
+            since (Optional[int]): only return lines with a timestamp (ns) of at least this, None for no limit
+
+        Returns:
+            Tuple[List[int], List[str]]: timestamps and lines, oldest first
+        """
+        with self.lock:
+            chunks: List[Tuple[List[int], List[str]]] = []
+            remaining = n_lines
+
+            def take(timestamps: List[int], lines: List[str]):
+                nonlocal remaining
+                if until is not None:
+                    end = bisect.bisect_left(timestamps, until)
+                    timestamps, lines = timestamps[:end], lines[:end]
+                if not lines or remaining <= 0:
+                    return
+                start = max(len(lines) - remaining, 0)
+                if since is not None:
+                    start = max(start, bisect.bisect_left(timestamps, since))
+                chunks.append((timestamps[start:], lines[start:]))
+                remaining -= len(lines) - start
+
+            take(self._pending_timestamps, self._pending_lines)
+            for segment in reversed(self._segments):
+                if remaining <= 0:
+                    break
+                if until is not None and segment.records[0].first_timestamp >= until:
+                    continue
+                if since is not None and segment.records[-1].last_timestamp < since:
+                    break
+                for number in range(len(segment.records) - 1, -1, -1):
+                    if remaining <= 0 or since is not None and segment.records[number].last_timestamp < since:
+                        remaining = 0
+                        break
+                    if until is not None and segment.records[number].first_timestamp >= until:
+                        continue
+                    try:
+                        take(*segment.read_block(number))
+                    except (LogCacheError, zlib.error, struct.error, ValueError):
+                        logger.warning(f"Skipping unreadable block in {segment.seg_path}", exc_info=True)
+
+        timestamps: List[int] = []
+        lines: List[str] = []
+        for chunk_timestamps, chunk_lines in reversed(chunks):
+            timestamps.extend(chunk_timestamps)
+            lines.extend(chunk_lines)
+        return timestamps, lines
+
+    def _blocks_between(self, since: Optional[int], until: Optional[int]) -> List[Tuple[Segment, int]]:
+        """(segment, block number) of the blocks that may hold lines in [since, until), oldest first (lock held)"""
+        blocks = []
+        for segment in self._segments:
+            for number, record in enumerate(segment.records):
+                if since is not None and record.last_timestamp < since:
+                    continue
+                if until is not None and record.first_timestamp >= until:
+                    return blocks
+                blocks.append((segment, number))
+        return blocks
+
+    def count(self, since: Optional[int] = None, until: Optional[int] = None) -> int:
+        """Number of cached lines logged in [since, until), decompressing only the blocks on the boundaries"""
+        with self.lock:
+            total = 0
+            for segment, number in self._blocks_between(since, until):
+                record = segment.records[number]
+                if (since is None or record.first_timestamp >= since) and \
+                        (until is None or record.last_timestamp < until):
+                    total += record.n_lines
+                    continue
+                try:
+                    timestamps, _ = segment.read_block(number)
+                except (OSError, LogCacheError, zlib.error, struct.error, ValueError):
+                    continue
+                selected = _slice_between(timestamps, since, until)
+                total += selected.stop - selected.start
+            selected = _slice_between(self._pending_timestamps, since, until)
+            return total + selected.stop - selected.start
+
+    def read_between(self, since: Optional[int] = None,
+                     until: Optional[int] = None) -> Iterator[Tuple[List[int], List[str]]]:
+        """Yield the cached lines logged in [since, until), oldest first, one block at a time
+
+        Only the blocks of the range are decompressed, and the cache is only locked while
+        a block is read, so lines can be appended while a long range is read. Lines
+        written after the call (and blocks deleted by the on-disk budget) may be missed.
+
+        Args:
+            since (Optional[int]): timestamp (ns) of the oldest line to return, None for no limit
+            until (Optional[int]): only return lines with a timestamp (ns) lower than this, None for no limit
+
+        Yields:
+            Tuple[List[int], List[str]]: timestamps and lines of a block
+        """
+        with self.lock:
+            blocks = self._blocks_between(since, until)
+            pending = self._pending_timestamps[:], self._pending_lines[:]
+        for segment, number in blocks:
+            with self.lock:
+                try:
+                    timestamps, lines = segment.read_block(number)
+                except (OSError, LogCacheError, zlib.error, struct.error, ValueError):
+                    logger.warning(f"Skipping unreadable block in {segment.seg_path}", exc_info=True)
+                    continue
+            selected = _slice_between(timestamps, since, until)
+            if selected.stop > selected.start:
+                yield timestamps[selected], lines[selected]
+        selected = _slice_between(pending[0], since, until)
+        if selected.stop > selected.start:
+            yield pending[0][selected], pending[1][selected]
+
+
+def _slice_between(timestamps: List[int], since: Optional[int], until: Optional[int]) -> slice:
+    """Slice of the sorted timestamps in [since, until)"""
+    start = 0 if since is None else bisect.bisect_left(timestamps, since)
+    end = len(timestamps) if until is None else bisect.bisect_left(timestamps, until)
+    return slice(start, max(start, end))
+
+
+def prune_cache(root: Optional[Path] = None, max_age: float = CACHE_MAX_AGE_S):
+    """Delete the caches of containers that have not logged anything for max_age seconds (unless in use)"""
+    root = root or default_cache_root()
+    if not root.exists():
+        return
+    cutoff = time.time() - max_age
+    for directory in root.iterdir():
+        if not directory.is_dir():
+            continue
+        mtimes = [path.stat().st_mtime for path in directory.iterdir() if path.name != LOCK_FILE]
+        if mtimes and max(mtimes) >= cutoff:
+            continue
+        try:
+            lock_file = _lock_directory(directory)
+        except LogCacheLocked:
+            continue
+        shutil.rmtree(directory, ignore_errors=True)
+        if lock_file is not None:
+            lock_file.close()
+
+
+class LogCacheWorker:
+    """Background thread doing the disk I/O of all log caches
+
+    Buffered lines of the registered caches are flushed every FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._queue: 'queue.Queue[Optional[Tuple[Callable, tuple]]]' = queue.Queue()
+        self._caches: Set[LogCache] = set()
+        self._thread = threading.Thread(target=self._run, name='log-cache', daemon=True)
+        self._thread.start()
+
+    def register(self, cache: LogCache):
+        self._caches.add(cache)
+
+    def unregister(self, cache: LogCache):
+        """Stop flushing a cache, then close it"""
+        self.submit(cache.close)
+        self._caches.discard(cache)
+
+    def submit(self, function: Callable, *args):
+        """Call function(*args) on the worker thread (safe to call from any thread)"""
+        self._queue.put((function, args))
+
+    def stop(self, timeout: float = 2.0):
+        """Flush every cache and stop the worker, waiting up to timeout seconds"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _flush_all(self):
+        for cache in list(self._caches):
+            try:
+                cache.flush()
+            except OSError:
+                logger.exception(f"Failed to write log cache {cache.directory}")
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(next_flush - time.monotonic(), 0))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self._flush_all()
+                return
+            if item:
+                function, args = item
+                try:
+                    function(*args)
+                except Exception:
+                    logger.exception(f"Log cache task {function} failed")
+            if time.monotonic() >= next_flush:
+                self._flush_all()
+                next_flush = time.monotonic() + self.flush_interval
@@ -0,0 +1,195 @@
+import threading
+from array import array
+from typing import Callable, List, Optional, Tuple
+
+# default limits of a single container's log store, the oldest lines are evicted first
+DEFAULT_MAX_LINES = 200_000
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+
+
+class LogStore:
+    """Bounded, thread-safe ring buffer of log lines for a single container
+
+    Every line gets a sequence number (0 for the first line ever stored) that
+    keeps referring to the same line after older lines are evicted or older
+    lines are inserted. The lines currently held are those with
+    first_seq <= seq < end_seq. Lines inserted by backfill are numbered down
+    from first_seq (below 0 for a store that never evicted a line); when lines
+    were evicted before, their numbers may be given to the inserted lines, and
+    backfills is increased so that holders of older numbers can tell.
+
+    Listeners added with add_listener are called with the timestamps and lines
+    of every batch appended, in order, while the store is locked; they should
+    only do cheap work (e.g. wake up a worker).
+    """
+
+    def __init__(self, max_lines: int = DEFAULT_MAX_LINES, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.first_seq = 0
+        self.end_seq = 0
+        # number of calls to backfill
+        self.backfills = 0
+        # approximate size of the stored text (characters plus newline per line)
+        self.n_bytes = 0
+        self.lock = threading.RLock()
+        # ring buffers indexed by (seq - _base) % max_lines, grown on demand up to max_lines
+        self._base = 0
+        self._lines: List[Optional[str]] = []
+        self._timestamps = array('q')
+        self._listeners: List[Callable[[List[int], List[str]], None]] = []
+
+    def __len__(self):
+        return self.end_seq - self.first_seq
+
+    def add_listener(self, listener: Callable[[List[int], List[str]], None]):
+        """Call listener(timestamps, lines) after each batch of lines is appended"""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[List[int], List[str]], None]):
+        """Stop calling a listener added with add_listener"""
+        with self.lock:
+            self._listeners = [other for other in self._listeners if other is not listener]
+
+    def seq_range(self) -> Tuple[int, int]:
+        """Return (first_seq, end_seq) of the lines currently held"""
+        with self.lock:
+            return self.first_seq, self.end_seq
+
+    def extend(self, timestamps: List[int], lines: List[str]):
+        """Append lines, evicting the oldest lines when over the line or byte budget
+
+        Args:
+            timestamps (List[int]): timestamp of each line in nanoseconds (0 if unknown)
+            lines (List[str]): lines to append, without trailing newline
+        """
+        with self.lock:
+            for timestamp, line in zip(timestamps, lines):
+                if self.end_seq - self.first_seq == self.max_lines:
+                    self._evict_oldest()
+                index = (self.end_seq - self._base) % self.max_lines
+                if index == len(self._lines):
+                    self._lines.append(line)
+                    self._timestamps.append(timestamp)
+                else:
+                    self._lines[index] = line
+                    self._timestamps[index] = timestamp
+                self.end_seq += 1
+                self.n_bytes += len(line) + 1
+            while self.n_bytes > self.max_bytes and self.end_seq - self.first_seq > 1:
+                self._evict_oldest()
+            for listener in self._listeners:
+                listener(timestamps, lines)
+
+    def _evict_oldest(self):
+        index = (self.first_seq - self._base) % self.max_lines
+        self.n_bytes -= len(self._lines[index]) + 1
+        # drop the reference so the memory is released right away
+        self._lines[index] = None
+        self.first_seq += 1
+
+    def get(self, seq: int) -> Optional[str]:
+        """Return the line with sequence number seq, or None if it was evicted or does not exist yet"""
+        with self.lock:
+            if not self.first_seq <= seq < self.end_seq:
+                return None
+            return self._lines[(seq - self._base) % self.max_lines]
+
+    def get_timestamp(self, seq: int) -> Optional[int]:
+        """Return the timestamp (ns) of the line with sequence number seq, or None if it is not held"""
+        with self.lock:
+            if not self.first_seq <= seq < self.end_seq:
+                return None
+            return self._timestamps[(seq - self._base) % self.max_lines]
+
+    def lines(self, start_seq: Optional[int] = None, end_seq: Optional[int] = None) -> List[str]:
+        """Return a copy of the held lines between start_seq (inclusive) and end_seq (exclusive)"""
+        with self.lock:
+            start_seq = self.first_seq if start_seq is None else max(start_seq, self.first_seq)
+            end_seq = self.end_seq if end_seq is None else min(end_seq, self.end_seq)
+            return [self._lines[(seq - self._base) % self.max_lines] for seq in range(start_seq, end_seq)]
+
+    def _timestamps_between(self, start_seq: int, end_seq: int) -> List[int]:
+        return [self._timestamps[(seq - self._base) % self.max_lines] for seq in range(start_seq, end_seq)]
+
+    def _reset(self, first_seq: int, timestamps: List[int], lines: List[str]):
+        """Replace the content with lines numbered from first_seq (call with the lock held)"""
+        self._base = self.first_seq = self.end_seq = first_seq
+        self.n_bytes = 0
+        self._lines = []
+        self._timestamps = array('q')
+        listeners, self._listeners = self._listeners, []
+        try:
+            self.extend(timestamps, lines)
+        finally:
+            self._listeners = listeners
+
+    def resize(self, max_lines: int, max_bytes: int):
+        """Change the limits of the store, evicting the oldest lines if they are lowered"""
+        with self.lock:
+            timestamps = self._timestamps_between(self.first_seq, self.end_seq)
+            lines = self.lines()
+            self.max_lines = max_lines
+            self.max_bytes = max_bytes
+            self._reset(self.first_seq, timestamps, lines)
+
+    def backfill(self, timestamps: List[int], lines: List[str]):
+        """Insert lines older than the held ones
+
+        The held lines keep their sequence numbers, the inserted lines are numbered
+        just before them. Listeners are not called.
+
+        Args:
+            timestamps (List[int]): timestamp of each line in nanoseconds
+            lines (List[str]): older lines to insert, oldest first
+        """
+        with self.lock:
+            timestamps = timestamps + self._timestamps_between(self.first_seq, self.end_seq)
+            first_seq = self.first_seq - len(lines)
+            lines = lines + self.lines()
+            self._reset(first_seq, timestamps, lines)
+            self.backfills += 1
+
+    def read(self, start_seq: int, end_seq: int) -> Tuple[int, List[str]]:
+        """Like lines(), but also return the sequence number of the first line returned,
+        which is later than start_seq if lines were evicted in the meantime
+
+        Returns:
+            Tuple[int, List[str]]: sequence number of the first line and the lines
+        """
+        with self.lock:
+            start_seq = max(start_seq, self.first_seq)
+            return start_seq, self.lines(start_seq, end_seq)
+
+    def read_timestamped(self, start_seq: int, end_seq: int) -> Tuple[int, List[int], List[str]]:
+        """Like read(), but also return the timestamp (ns) of each line
+
+        Returns:
+            Tuple[int, List[int], List[str]]: sequence number of the first line, timestamps and lines
+        """
+        with self.lock:
+            start_seq = max(start_seq, self.first_seq)
+            end_seq = max(min(end_seq, self.end_seq), start_seq)
+            return start_seq, self._timestamps_between(start_seq, end_seq), self.lines(start_seq, end_seq)
+
+    def find(self, text: str, start_seq: int, backwards: bool = False) -> Optional[int]:
+        """Find the next line containing text (case insensitive)
+
+        Args:
+            text (str): text to search for
+            start_seq (int): first line to look at
+            backwards (bool): search towards older lines instead of newer lines
+
+        Returns:
+            Optional[int]: sequence number of the matching line, None if there is no match
+        """
+        text = text.lower()
+        with self.lock:
+            if backwards:
+                seqs = range(min(start_seq, self.end_seq - 1), self.first_seq - 1, -1)
+            else:
+                seqs = range(max(start_seq, self.first_seq), self.end_seq)
+            for seq in seqs:
+                if text in self._lines[(seq - self._base) % self.max_lines].lower():
+                    return seq
+        return None
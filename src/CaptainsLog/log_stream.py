@@ -0,0 +1,147 @@
+import calendar
+import codecs
+import datetime
+from typing import List, Optional, Tuple
+
+# C0 and C1 control characters, except tab, newline, carriage return and escape
+# (ANSI colour sequences are rendered by the view, see ansi.py).
+# str.translate with a deletion table has a fast path for ASCII text, unlike re.sub
+CONTROL_CHARACTERS = dict.fromkeys([*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x1B), *range(0x1C, 0x20),
+                                    *range(0x7F, 0xA0)])
+
+
+def remove_control_characters(s):
+    return s.translate(CONTROL_CHARACTERS)
+
+
+def parse_docker_timestamp(timestamp: str) -> int:
+    """Convert an RFC3339Nano timestamp written by the docker daemon
+    (e.g. 2023-08-26T12:34:56.123456789Z) to nanoseconds since the epoch
+
+    Args:
+        timestamp (str): timestamp prefix of a log line requested with timestamps=True
+
+    Returns:
+        int: nanoseconds since the epoch (UTC)
+    """
+    seconds = calendar.timegm((int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                               int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])))
+    nanos = 0
+    if timestamp[19] == '.':
+        # daemon trims trailing zeros from the fractional part
+        fraction = timestamp[20:].rstrip('Z')
+        nanos = int(fraction[:9].ljust(9, '0'))
+    return seconds * 1_000_000_000 + nanos
+
+
+def split_timestamp(line: str) -> Tuple[Optional[int], str]:
+    """Separate the timestamp prefix added by the daemon from the log line
+
+    Args:
+        line (str): log line, optionally prefixed by "<RFC3339Nano timestamp> "
+
+    Returns:
+        Tuple[Optional[int], str]: timestamp in nanoseconds (None if the line has no timestamp)
+        and the remaining text of the line
+    """
+    timestamp, sep, text = line.partition(' ')
+    if not sep or len(timestamp) < 20 or timestamp[-1] != 'Z' or timestamp[10] != 'T':
+        return None, line
+    try:
+        return parse_docker_timestamp(timestamp), text
+    except ValueError:
+        return None, line
+
+
+def format_since(timestamp: int) -> str:
+    """Format a nanosecond timestamp for the `since` query parameter of the logs endpoint
+
+    The daemon includes lines logged exactly at `since`, so callers are expected to
+    drop lines at or before the last timestamp they saw.
+    """
+    return f'{timestamp // 1_000_000_000}.{timestamp % 1_000_000_000:09d}'
+
+
+def format_timestamp(timestamp: int) -> str:
+    """Format a nanosecond timestamp as local time with millisecond precision (empty if unknown)"""
+    if not timestamp:
+        return ''
+    return datetime.datetime.fromtimestamp(timestamp / 1e9).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+class LineDecoder:
+    """Decode a stream of arbitrary byte chunks into complete, sanitized lines
+
+    Decoding is incremental, so a multibyte UTF-8 character split across two
+    chunks is kept until the rest of it arrives. Control characters are removed
+    from each chunk at once, and the fragments of a line spanning many chunks
+    are only joined once the line is complete.
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._fragments: List[str] = []
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Add a chunk read from the stream
+
+        Args:
+            chunk (bytes): raw bytes received from the daemon
+
+        Returns:
+            List[str]: complete lines (without trailing newline) contained in the stream so far
+        """
+        text = remove_control_characters(self._decoder.decode(chunk))
+        if '\n' not in text:
+            if text:
+                self._fragments.append(text)
+            return []
+        lines = text.split('\n')
+        if self._fragments:
+            self._fragments.append(lines[0])
+            lines[0] = ''.join(self._fragments)
+            self._fragments = []
+        remainder = lines.pop()
+        if remainder:
+            self._fragments.append(remainder)
+        return lines
+
+    def flush(self) -> List[str]:
+        """Return any trailing partial line (e.g. when the stream ends without a newline)"""
+        remainder = ''.join(self._fragments) + remove_control_characters(self._decoder.decode(b'', final=True))
+        self._fragments = []
+        return [remainder] if remainder else []
+
+
+class FrameDecoder:
+    """Split the multiplexed stdout/stderr stream of a non-TTY container into frames
+
+    Each frame has an 8 byte header: the stream type (1 = stdout, 2 = stderr),
+    three padding bytes and the big-endian payload size.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[Tuple[int, bytes]]:
+        """Add bytes read from the stream
+
+        Args:
+            chunk (bytes): raw bytes received from the daemon
+
+        Returns:
+            List[Tuple[int, bytes]]: stream type and payload of each complete frame
+        """
+        buffer = self._buffer
+        buffer += chunk
+        frames = []
+        offset = 0
+        while len(buffer) - offset >= 8:
+            size = int.from_bytes(buffer[offset + 4:offset + 8], 'big')
+            end = offset + 8 + size
+            if end > len(buffer):
+                break
+            frames.append((buffer[offset], bytes(buffer[offset + 8:end])))
+            offset = end
+        del buffer[:offset]
+        return frames
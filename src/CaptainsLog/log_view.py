@@ -0,0 +1,313 @@
+import bisect
+import gi
+from typing import List, Optional, Tuple
+
+from gi.repository import GLib, GObject, Gio, Gtk, Pango
+
+from .ansi import AnsiStyle, StyleSpan, parse_ansi, plain_offset
+from .log_store import LogStore
+from .timeline import source_color, source_span
+
+# distance (pixels) from the bottom within which the view keeps following new lines
+FOLLOW_TAIL_THRESHOLD = 20
+# background colour (16 bit RGB) of the current search match
+MATCH_HIGHLIGHT_COLOR = (0xf9f9, 0xf0f0, 0x6b6b)
+# colours (16 bit RGB) of the container names in a merged timeline (N_SOURCE_COLORS of them),
+# readable on light and dark backgrounds
+SOURCE_COLORS = [(0x1c1c, 0x7171, 0xd8d8), (0x2626, 0xa2a2, 0x6969), (0xe5e5, 0xa5a5, 0x0a0a),
+                 (0xc0c0, 0x1c1c, 0x2828), (0x8181, 0x3d3d, 0x9c9c), (0x0000, 0x9999, 0x9999),
+                 (0xe6e6, 0x6161, 0x0000), (0x8686, 0x5e5e, 0x3c3c)]
+
+
+def _byte_range(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Convert a character range of text to the byte range pango works with"""
+    if text.isascii():
+        return start, end
+    byte_start = len(text[:start].encode('utf-8'))
+    return byte_start, byte_start + len(text[start:end].encode('utf-8'))
+
+
+def match_attributes(text: str, start: int, end: int,
+                     attributes: Optional[Pango.AttrList] = None) -> Pango.AttrList:
+    """Pango attributes highlighting text[start:end], added to attributes if given"""
+    attribute = Pango.attr_background_new(*MATCH_HIGHLIGHT_COLOR)
+    attribute.start_index, attribute.end_index = _byte_range(text, start, end)
+    if attributes is None:
+        attributes = Pango.AttrList()
+    attributes.insert(attribute)
+    return attributes
+
+
+def source_attributes(text: str, attributes: Optional[Pango.AttrList] = None) -> Optional[Pango.AttrList]:
+    """Pango attributes colouring the container name of a line of a merged timeline, added to attributes if given"""
+    span = source_span(text)
+    if span is None:
+        return attributes
+    byte_start, byte_end = _byte_range(text, *span)
+    if attributes is None:
+        attributes = Pango.AttrList()
+    for attribute in (Pango.attr_foreground_new(*SOURCE_COLORS[source_color(text[span[0]:span[1]])]),
+                      Pango.attr_weight_new(Pango.Weight.BOLD)):
+        attribute.start_index, attribute.end_index = byte_start, byte_end
+        attributes.insert(attribute)
+    return attributes
+
+
+def _style_attributes(style: AnsiStyle) -> List[Pango.Attribute]:
+    foreground, background = style.foreground, style.background
+    if style.inverse:
+        foreground, background = background, foreground
+    attributes = []
+    if foreground is not None:
+        attributes.append(Pango.attr_foreground_new(*(value * 257 for value in foreground)))
+    if background is not None:
+        attributes.append(Pango.attr_background_new(*(value * 257 for value in background)))
+    if style.bold:
+        attributes.append(Pango.attr_weight_new(Pango.Weight.BOLD))
+    if style.dim:
+        attributes.append(Pango.attr_foreground_alpha_new(0x8000))
+    if style.italic:
+        attributes.append(Pango.attr_style_new(Pango.Style.ITALIC))
+    if style.underline:
+        attributes.append(Pango.attr_underline_new(Pango.Underline.SINGLE))
+    if style.strikethrough:
+        attributes.append(Pango.attr_strikethrough_new(True))
+    return attributes
+
+
+def ansi_attributes(text: str, spans: List[StyleSpan]) -> Pango.AttrList:
+    """Pango attributes rendering the ANSI styled runs of a line (see parse_ansi)"""
+    attributes = Pango.AttrList()
+    for start, end, style in spans:
+        byte_start, byte_end = _byte_range(text, start, end)
+        for attribute in _style_attributes(style):
+            attribute.start_index = byte_start
+            attribute.end_index = byte_end
+            attributes.insert(attribute)
+    return attributes
+
+
+class LogLine(GObject.Object):
+    """Item of a LogStoreModel, created on demand for visible rows only"""
+
+    def __init__(self, seq: int, text: str):
+        super().__init__()
+        self.seq = seq
+        self.text = text
+
+
+class LogStoreModel(GObject.Object, Gio.ListModel):
+    """Gio.ListModel exposing the lines of a LogStore
+
+    The model reports changes of the store to the view when sync() is called,
+    so between syncs it answers with the range of lines it last reported.
+    """
+
+    def __init__(self, store: LogStore):
+        super().__init__()
+        self.store = store
+        self.first_seq = 0
+        self.end_seq = 0
+
+    def do_get_item_type(self):
+        return LogLine.__gtype__
+
+    def do_get_n_items(self):
+        return self.end_seq - self.first_seq
+
+    def do_get_item(self, position: int) -> Optional[LogLine]:
+        seq = self.first_seq + position
+        if position < 0 or seq >= self.end_seq:
+            return None
+        # lines evicted since the last sync are shown empty until then
+        return LogLine(seq, self.store.get(seq) or '')
+
+    def sync(self):
+        """Report lines evicted from, inserted into (backfilled) and appended to the store since the last sync"""
+        first_seq, end_seq = self.store.seq_range()
+        removed = min(first_seq, self.end_seq) - self.first_seq
+        if removed > 0:
+            self.first_seq += removed
+            self.items_changed(0, removed, 0)
+        if self.end_seq < first_seq:
+            self.first_seq = self.end_seq = first_seq
+        elif first_seq < self.first_seq:
+            inserted = self.first_seq - first_seq
+            self.first_seq = first_seq
+            self.items_changed(0, 0, inserted)
+        if end_seq > self.end_seq:
+            position = self.end_seq - self.first_seq
+            added = end_seq - self.end_seq
+            self.end_seq = end_seq
+            self.items_changed(position, 0, added)
+
+    def refresh(self, seq: int):
+        """Have the view rebind the row of the line with sequence number seq"""
+        position = self.position_of(seq)
+        if position is not None:
+            self.items_changed(position, 1, 1)
+
+    def position_of(self, seq: int) -> Optional[int]:
+        """Return the position of the line with sequence number seq, or None if not in the model"""
+        if not self.first_seq <= seq < self.end_seq:
+            return None
+        return seq - self.first_seq
+
+
+class FilteredLogModel(GObject.Object, Gio.ListModel):
+    """Gio.ListModel exposing the lines of a LogStore matching a filter, given by sequence number"""
+
+    def __init__(self, store: LogStore, seqs: List[int]):
+        super().__init__()
+        self.store = store
+        self.seqs = seqs
+
+    def do_get_item_type(self):
+        return LogLine.__gtype__
+
+    def do_get_n_items(self):
+        return len(self.seqs)
+
+    def do_get_item(self, position: int) -> Optional[LogLine]:
+        if not 0 <= position < len(self.seqs):
+            return None
+        seq = self.seqs[position]
+        return LogLine(seq, self.store.get(seq) or '')
+
+    def extend(self, seqs: List[int]):
+        """Append the matching lines among newly appended ones"""
+        if self.seqs and seqs:
+            seqs = seqs[bisect.bisect_right(seqs, self.seqs[-1]):]
+        if seqs:
+            position = len(self.seqs)
+            self.seqs.extend(seqs)
+            self.items_changed(position, 0, len(seqs))
+
+    def sync(self):
+        """Drop lines evicted from the store"""
+        removed = bisect.bisect_left(self.seqs, self.store.first_seq)
+        if removed:
+            del self.seqs[:removed]
+            self.items_changed(0, removed, 0)
+
+    def refresh(self, seq: int):
+        position = self.position_of(seq)
+        if position is not None:
+            self.items_changed(position, 1, 1)
+
+    def position_of(self, seq: int) -> Optional[int]:
+        position = bisect.bisect_left(self.seqs, seq)
+        if position < len(self.seqs) and self.seqs[position] == seq:
+            return position
+        return None
+
+
+class ContainerLogView:
+    """Virtualized view of a container's LogStore, only visible rows are laid out
+
+    Args:
+        store (LogStore): lines to show
+        sources (bool): the lines are those of a MergedTimeline, colour the container name of each line
+    """
+
+    def __init__(self, store: LogStore, sources: bool = False):
+        self.store = store
+        self.sources = sources
+        self.full_model = LogStoreModel(store)
+        # model shown, the full_model or a FilteredLogModel
+        self.model = self.full_model
+        self.selection = Gtk.SingleSelection(model=self.model, autoselect=False, can_unselect=True)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect('setup', self._on_setup_row)
+        factory.connect('bind', self._on_bind_row)
+
+        self.list_view = Gtk.ListView(model=self.selection,
+                                      factory=factory,
+                                      css_classes=['container-text'])
+        self.scroll_window = Gtk.ScrolledWindow(vexpand=True, hexpand=True)
+        self.scroll_window.set_child(self.list_view)
+        # (seq, start, end) of the highlighted search match
+        self.highlight: Optional[Tuple[int, int, int]] = None
+
+    def _on_setup_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        list_item.set_child(Gtk.Label(xalign=0,
+                                      wrap=True,
+                                      wrap_mode=Pango.WrapMode.WORD_CHAR,
+                                      css_classes=['log-line']))
+
+    def _on_bind_row(self, factory: Gtk.SignalListItemFactory, list_item: Gtk.ListItem):
+        label: Gtk.Label = list_item.get_child()
+        line: LogLine = list_item.get_item()
+        # colours are parsed for the visible rows only
+        text, spans = parse_ansi(line.text)
+        label.set_text(text)
+        attributes = ansi_attributes(text, spans) if spans else None
+        if self.sources:
+            attributes = source_attributes(text, attributes)
+        if self.highlight is not None and self.highlight[0] == line.seq:
+            _, start, end = self.highlight
+            attributes = match_attributes(text, plain_offset(line.text, start), plain_offset(line.text, end),
+                                          attributes)
+        label.set_attributes(attributes)
+
+    def sync(self):
+        """Show new lines from the store, following the end of the log while scrolled to the bottom"""
+        vadjustment = self.scroll_window.get_vadjustment()
+        at_bottom = vadjustment.get_value() >= (vadjustment.get_upper()
+                                                - vadjustment.get_page_size()
+                                                - FOLLOW_TAIL_THRESHOLD)
+        self.model.sync()
+        n_items = self.model.get_n_items()
+        if at_bottom and n_items:
+            self.scroll_to(n_items - 1)
+
+    def set_filter(self, seqs: Optional[List[int]]):
+        """Only show the lines with the given sequence numbers (oldest first), None to show every line"""
+        if seqs is None:
+            self.model = self.full_model
+            self.full_model.sync()
+        else:
+            self.model = FilteredLogModel(self.store, seqs)
+        self.selection.set_model(self.model)
+        n_items = self.model.get_n_items()
+        if n_items:
+            self.scroll_to(n_items - 1)
+
+    def extend_filter(self, seqs: List[int]):
+        """Show newly appended lines matching the current filter"""
+        if isinstance(self.model, FilteredLogModel):
+            self.model.extend(seqs)
+
+    def scroll_to(self, position: int):
+        self.list_view.activate_action('list.scroll-to-item', GLib.Variant.new_uint32(position))
+
+    def highlight_match(self, match: Optional[Tuple[int, int, int]]) -> bool:
+        """Highlight a search match and scroll to its line
+
+        Args:
+            match (Optional[Tuple[int, int, int]]): (seq, start, end) of the match, None to clear
+
+        Returns:
+            bool: whether the line of the match is shown in the view
+        """
+        previous, self.highlight = self.highlight, match
+        if previous is not None:
+            self.model.refresh(previous[0])
+        if match is None:
+            return False
+        self.model.refresh(match[0])
+        return self.select_line(match[0])
+
+    def select_line(self, seq: int) -> bool:
+        """Select and scroll to the line with sequence number seq
+
+        Returns:
+            bool: whether the line is shown in the view
+        """
+        position = self.model.position_of(seq)
+        if position is None:
+            return False
+        self.selection.set_selected(position)
+        self.scroll_to(position)
+        return True
@@ -1,39 +1,96 @@
 import gi
 import json
+import logging
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
 
-import docker
 import sys
 import os
-from typing import Dict, List
+import re
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+# first, so the startup time includes importing GTK and the other modules
+from .startup import STARTUP_CONTAINERS, STARTUP_FIRST_FRAME, STARTUP_IMPORTS, STARTUP_SIDEBAR, STARTUP_WINDOW, startup
 
-from docker.models.containers import Container
 from gi.repository import Adw, Gdk, GLib, Gtk, Gio
 
-from .threads import StoppableThread, join_threads
-from .container_updates import (prepare_container_log_elements,
-                                update_container_status_css,
-                                container_log_tailer)
-from .docker_utils import list_containers
+from .container_updates import (FILTER_HINT, ContainerMetricsRow, ContainerPage, ContainerSidebar, ExportProgress,
+                                GlobalSearchPage, MetricsOverview, ProfilingPage, TimelinePage, add_export_choices,
+                                export_choices)
+from .docker_api import docker_hosts, host_label
+from .docker_utils import FILTER_ENV, RESYNC_INTERVAL_S, ContainerFilter, ContainerInventory, ContainerState
+from .export import ExportJob, ExportOptions, ExportResult, ExportSource
+from .ingestion import LogIngestionEngine
+from .ui_scheduler import UiUpdateScheduler
+from .container_log import BACKFILL_LINES, HIDDEN_MAX_LINES, ContainerLog
+from .log_cache import LogCache, LogCacheLocked, LogCacheWorker, cache_directory, prune_cache
+from .metrics import METRICS_REFRESH_S, describe_rates, format_rate
+from .profiling import PROFILE_REFRESH_S, profiler, traced_dispatch
+from .search import GlobalSearch, GlobalSearchHit, SearchResult, SearchWorker
+from .structured import FilterResult, parse_filter
+from .supervisor import TAILER_RETRYING, describe_tailer
+from .timeline import TIMELINE_FLUSH_INTERVAL, MergedTimeline
 from pathlib import Path
 
 cl_path = os.path.dirname(sys.modules['CaptainsLog'].__file__)
 css_path = Path(cl_path).joinpath('style.css')
 icon_path = Path(cl_path).joinpath('./icons')
 
-css_provider = Gtk.CssProvider()
-css_provider.load_from_path(str(css_path))
-Gtk.StyleContext.add_provider_for_display(Gdk.Display.get_default(
-), css_provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+logger = logging.getLogger(__file__)
+
+# containers added to (or removed from) the sidebar per main loop iteration, so that
+# listing many containers never holds up drawing the window
+INVENTORY_CHUNK = 50
+
+
+class GioOutput:
+    """Binary file object writing to a Gio.File (blocking, for use off the main thread).
+    The file is only replaced once the output is closed, abort() keeps the previous file.
+    """
+
+    def __init__(self, file: Gio.File):
+        self.cancellable = Gio.Cancellable()
+        try:
+            self.stream = file.replace(None, False, Gio.FileCreateFlags.REPLACE_DESTINATION, self.cancellable)
+        except GLib.Error as e:
+            raise OSError(e.message)
 
-thread_dict: Dict[str, StoppableThread] = {}
+    def write(self, data: bytes) -> int:
+        try:
+            self.stream.write_all(data, None)
+        except GLib.Error as e:
+            raise OSError(e.message)
+        return len(data)
+
+    def close(self):
+        try:
+            self.stream.close(None)
+        except GLib.Error as e:
+            raise OSError(e.message)
+
+    def abort(self):
+        # closing with a cancelled cancellable discards the temporary file
+        self.cancellable.cancel()
+        try:
+            self.stream.close(self.cancellable)
+        except GLib.Error:
+            pass
+
+
+def load_css():
+    """Apply style.css to the default display (needs a display, so called on application startup)"""
+    css_provider = Gtk.CssProvider()
+    css_provider.load_from_path(str(css_path))
+    Gtk.StyleContext.add_provider_for_display(Gdk.Display.get_default(
+    ), css_provider, Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
 
 
 class MainWindow(Gtk.ApplicationWindow):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        app = self.get_application()
 
         theme = Gtk.IconTheme.get_for_display(Gdk.Display.get_default())
         theme.add_search_path(str(icon_path))
@@ -57,6 +114,7 @@ class MainWindow(Gtk.ApplicationWindow):
 
         # setup Menu
         self.menu = Gio.Menu()
+        self.menu.append_item(Gio.MenuItem().new("Export all logs", "app.export-all"))
         self.menu.append_item(Gio.MenuItem().new("About", "app.about"))
 
         quit_action = Gio.SimpleAction(name="quit")
@@ -84,9 +142,19 @@ class MainWindow(Gtk.ApplicationWindow):
         about_action.connect("activate", self.about_activated)
         app.add_action(about_action)
 
+        # export of the logs of every container into one archive
+        self.export_all_action = Gio.SimpleAction(name="export-all")
+        self.export_all_action.connect("activate", self.on_export_all_activated)
+        app.add_action(self.export_all_action)
+        # export running in the background (one at a time) and its progress
+        self.export_job: Optional[ExportJob] = None
+        self.export_progress = ExportProgress()
+        self.export_progress.cancel_button.connect("clicked", lambda _: self.export_job and self.export_job.cancel())
+
         # add buttons to top bar
         self.header.pack_start(self.refresh_button)
         self.header.pack_end(self.menu_button)
+        self.header.pack_end(self.export_progress.box)
 
         # Main Content area boxes
         self.window_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
@@ -94,16 +162,21 @@ class MainWindow(Gtk.ApplicationWindow):
         self.set_child(self.window_box)
 
         self.sidebar_box = Gtk.Box(
-            orientation=Gtk.Orientation.VERTICAL, vexpand=True)
+            orientation=Gtk.Orientation.VERTICAL, vexpand=True, css_classes=['border-right'])
         self.sidebar_box.set_size_request(200, 100)
 
-        self.sidebar_button_list = Gtk.ListBox(
-            vexpand=True, css_classes=['border-right'])
+        # fixed pages (Overview, Search all, ...) above the container list
+        self.sidebar_button_list = Gtk.ListBox()
+        # containers, only the rows in view are built
+        self.container_sidebar = ContainerSidebar(on_select=self.show_page,
+                                                  on_container_filter=self.on_container_filter_changed)
 
         self.content_box = Gtk.Box(
             orientation=Gtk.Orientation.VERTICAL, hexpand=True, vexpand=True)
 
         self.sidebar_box.append(self.sidebar_button_list)
+        self.sidebar_box.append(Gtk.Separator(orientation=Gtk.Orientation.HORIZONTAL))
+        self.sidebar_box.append(self.container_sidebar.box)
         self.window_box.append(self.sidebar_box)
         self.window_box.append(self.content_box)
 
@@ -120,111 +193,392 @@ class MainWindow(Gtk.ApplicationWindow):
                                   label="Welcome to CaptainsLog",
                                   css_classes=["title", "overview-title"])
 
-        dc = docker.from_env()
-        dc.configs.client
-        # docker overview metrics
-        welcome_content = """Docker socket location: {}
-        \n\nYou currently have {} docker containers tracked by the docker daemon.
-        \n\nSelect a container from the left to view its logs""".format(dc.api.base_url, len(docker.from_env().containers.list()))
-        welcome_text = Gtk.Label(name="welcome-text",
-                                 label=welcome_content,
-                                 wrap=True,
-                                 wrap_mode=Gtk.WrapMode.WORD,
-                                 justify=Gtk.Justification.CENTER,
-                                 css_classes=["welcome-text"],
-                                 )
+        # docker overview metrics, filled in from the inventory (never by blocking on a daemon)
+        self.welcome_text = Gtk.Label(name="welcome-text",
+                                      label="Connecting to docker...",
+                                      wrap=True,
+                                      wrap_mode=Gtk.WrapMode.WORD,
+                                      justify=Gtk.Justification.CENTER,
+                                      css_classes=["welcome-text"],
+                                      )
 
         overview_box.append(welcome_label)
-        overview_box.append(welcome_text)
+        overview_box.append(self.welcome_text)
+        # log rates of every container, refreshed every METRICS_REFRESH_S
+        self.metrics_overview = MetricsOverview()
+        overview_box.append(self.metrics_overview.scroll_window)
 
         self.add_sidebar_item(item_name="overview-page", item_label="Overview")
         self.stack.add_titled(
             overview_box, name="overview-page", title="Overview")
 
+        # search across the logs of every container
+        self.global_search_page = GlobalSearchPage()
+        self.global_search_page.box.set_name("global-search")
+        self.global_search_page.search_entry.connect("search-changed", self.search_all_logs)
+        self.global_search_page.search_regex_toggle.connect(
+            "toggled", lambda _: self.search_all_logs(self.global_search_page.search_entry))
+        self.global_search_page.list_view.connect("activate", self.on_global_search_activate)
+        self.add_sidebar_item(item_name="global-search", item_label="Search all")
+        self.stack.add_titled(self.global_search_page.box, name="global-search", title="Search all")
+
+        # logs of several containers interleaved in time order, merged once the page is first opened
+        self.timeline_page = TimelinePage()
+        self.timeline_page.box.set_name("timeline")
+        self.timeline_page.group_dropdown.connect("notify::selected", lambda *_: self.on_timeline_group_changed())
+        self.add_sidebar_item(item_name="timeline", item_label="Timeline")
+        self.stack.add_titled(self.timeline_page.box, name="timeline", title="Timeline")
+
+        # timings of the hot paths, only when profiling was requested (CAPTAINSLOG_PROFILE or --profile)
+        self.profiling_page = None
+        if profiler.enabled:
+            self.profiling_page = ProfilingPage()
+            self.profiling_page.box.set_name("profiling")
+            self.profiling_page.export_button.connect("clicked", self.on_export_trace_click)
+            self.add_sidebar_item(item_name="profiling", item_label="Profiling")
+            self.stack.add_titled(self.profiling_page.box, name="profiling", title="Profiling")
+            GLib.timeout_add_seconds(PROFILE_REFRESH_S, self.profiling_page.refresh)
+
         self.stack.set_visible_child_name("overview-page")
+        # log data of every container, and the pages built so far (on first selection)
+        self.container_logs: Dict[str, ContainerLog] = {}
+        self.container_pages: Dict[str, ContainerPage] = {}
+        # inventory changes not applied yet, see on_inventory_changed
+        self.inventory_changes: Dict[str, Optional[ContainerState]] = {}
 
-        # initial stack updating
-        self.update_container_stack()
         self.content_box.append(self.stack)
 
-        # update stack every .25 seconds
-        # TODO: Make this on event from docker daemon
-        GLib.timeout_add(250, self.update_container_stack)
-        self.match_iter = None
+        # merges view updates of all containers and applies them once per frame
+        self.ui_scheduler = UiUpdateScheduler(self)
+        # single event loop following the logs of all containers,
+        # handing batches of new lines to the UI update scheduler
+        # of all docker hosts (CAPTAINSLOG_HOSTS, else DOCKER_HOST), each with its own pooled connections and backoff
+        self.docker_hosts = docker_hosts()
+        self.ingestion = LogIngestionEngine(dispatch=self.ui_scheduler.schedule, docker_host=self.docker_hosts[0])
+        self.ingestion.start()
+        # keeps the search indexes of all containers up to date, and runs queries
+        # main loop callbacks are timed while profiling
+        idle_add = traced_dispatch(GLib.idle_add)
+        self.search_worker = SearchWorker(dispatch=idle_add)
+        self.global_search = GlobalSearch(dispatch=idle_add)
+        # reads and writes the on-disk log history of all containers
+        self.cache_worker = LogCacheWorker()
+        self.cache_worker.submit(prune_cache)
+
+        # keep the container stack in sync with docker events,
+        # with a slow full resync in case an event is missed
+        self.inventory = ContainerInventory(
+            on_change=lambda: idle_add(self.on_inventory_changed),
+            label_hosts=len(self.docker_hosts) > 1)
+        # only the containers matching the filters given at startup are listed by the daemons
+        try:
+            self.container_sidebar.set_filter_text(os.environ.get(FILTER_ENV, ''))
+        except ValueError as e:
+            logger.warning(f"Ignoring {FILTER_ENV}: {e}")
+        self.inventory.set_filter(self.container_sidebar.container_filter)
+        for docker_host in self.docker_hosts:
+            self.ingestion.watch(self.inventory, docker_host)
+        GLib.timeout_add_seconds(RESYNC_INTERVAL_S, self.request_resync)
+        GLib.timeout_add_seconds(METRICS_REFRESH_S, self.refresh_metrics)
+        GLib.timeout_add(int(TIMELINE_FLUSH_INTERVAL * 1000), self.flush_timeline)
+        self.connect('close-request', self.on_close_request)
         # set default size, title
         self.set_default_size(600, 600)
         self.set_title("CaptainsLog")
+        self.add_tick_callback(self.on_first_frame)
+        startup.mark(STARTUP_WINDOW)
+
+    def on_first_frame(self, widget: Gtk.Widget, frame_clock: Gdk.FrameClock) -> bool:
+        startup.mark(STARTUP_FIRST_FRAME)
+        return GLib.SOURCE_REMOVE
 
     def refresh_toggled(self, button):
-        """When refresh button pressed, update container stack"""
-        self.update_container_stack()
+        """When refresh button pressed, resync the container inventory"""
+        self.request_resync()
 
-    def update_container_stack(self):
-        """Maintain proper stack of containers, and threads to tail their logs correspondingly
+    def request_resync(self):
+        """Fetch the full container lists from the daemons without blocking the main loop"""
+        self.ingestion.resync()
+        return True
+
+    def update_welcome_text(self):
+        """Show the container count and the health of every docker host and log stream on the Overview"""
+        statuses = {status.docker_host: status for status in self.ingestion.host_statuses()}
+        counts: Dict[str, int] = {}
+        for state in list(self.inventory.containers.values()):
+            counts[state.host] = counts.get(state.host, 0) + 1
+        lines = []
+        for docker_host in self.docker_hosts:
+            status = statuses.get(docker_host)
+            if status is not None and not status.connected:
+                health = f"unreachable, retrying in {status.retry_in:.0f}s ({status.last_error})"
+            else:
+                health = f"{counts.get(docker_host, 0)} containers"
+            lines.append(f"{host_label(docker_host)} ({docker_host}): {health}")
+        failing = sum(status.state == TAILER_RETRYING and status.last_error is not None
+                      for status in self.ingestion.tailer_statuses().values())
+        if failing:
+            lines.append(f"{failing} log streams failed, reconnecting")
+        self.welcome_text.set_text("\n".join(lines) + "\n\nSelect a container from the left to view its logs")
+
+    def on_inventory_changed(self) -> bool:
+        """Apply container changes recorded by the inventory, touching only
+        the sidebar rows and stack pages of containers that changed.
+        At most INVENTORY_CHUNK changes are applied per call, the call is repeated
+        (as an idle callback) while changes are left.
+
+        Returns:
+            bool: whether changes are left
+        """
+        self.inventory_changes.update(self.inventory.pop_changes())
+        containers_listed = self.inventory.listed_hosts.issuperset(self.docker_hosts)
+        if containers_listed:
+            startup.mark(STARTUP_CONTAINERS)
+        changes = {}
+        for container_id in list(self.inventory_changes)[:INVENTORY_CHUNK]:
+            changes[container_id] = self.inventory_changes.pop(container_id)
+        removed = [container_id for container_id, state in changes.items() if state is None]
+        if removed:
+            # a single call for every removed container, the streams are closed on the ingestion thread
+            self.ingestion.unfollow(*removed)
+        for container_id, state in changes.items():
+            if state is None:
+                self.remove_container_page(container_id)
+            elif container_id in self.container_sidebar.items:
+                self.container_sidebar.update(state)
+            else:
+                self.add_container_page(state)
+                self.add_timeline_source(state)
+        if self.inventory_changes:
+            return True
+        self.timeline_page.set_projects(sorted({state.project for state in list(self.inventory.containers.values())
+                                                if state.project}))
+        if containers_listed and startup.mark(STARTUP_SIDEBAR) is not None and startup.measure:
+            startup.report()
+            self.quit_activated(None, None)
+        return False
+
+    def on_container_filter_changed(self, container_filter: ContainerFilter):
+        """List and follow only the containers matching the filters typed in the sidebar"""
+        self.ingestion.set_container_filter(container_filter)
+
+    def add_container_page(self, state: ContainerState):
+        """Add sidebar item for a new container, and start buffering its logs in the background.
+        The stack page itself is built when the container is first selected.
 
         Args:
-            containers (List[Container]): current list of containers
-            stack (Gtk.Stack): _description_
+            state (ContainerState): container to add
         """
+        container_log = ContainerLog(state.id, docker_host=state.host or None)
+        self.container_logs[state.id] = container_log
+        container_log.store.add_listener(lambda timestamps, lines: self.schedule_index_updates(container_log))
+        self.cache_worker.submit(self.start_following, container_log, state.name)
 
-        # update list of docker containers
-        self.containers: List[Container] = list_containers()
-
-        # get current stack pages
-        # TODO: Support having pages that are not associated
-        # with a docker container (e.g. welcome page)
-        page: Gtk.StackPage
-        current_pages: List[Gtk.StackPage] = [
-            page for page in self.stack.get_pages()]
-        current_page_names = [page.get_name() for page in current_pages]
-        # filter pages depending on if it belongs to a container or not
-        current_page_names = [
-            name for name in current_page_names if name != 'overview-page']
-
-        current_container_names = [
-            container.name for container in self.containers]
-
-        # if the container is gone and thread is still alive, we should join the thread
-        join_threads(thread_dict=thread_dict,
-                     current_page_names=current_page_names,
-                     current_container_names=current_container_names)
-
-        # update sidebar button colors, add new stack elements
-        # for new docker containers
-        for container in self.containers:
-            try:
-                container.reload()
-            except:
-                continue
-            if container.name in self.sidebar_button_dict:
-                update_container_status_css(
-                    button=self.sidebar_button_dict[container.name], status=container.status)
-            # restart thread if container has been seen previously
-            if container.name in current_page_names:
-                if not thread_dict[container.name].is_alive():
-                    thread_dict[container.name].start()
-                continue
-
-            container_box, container_info, container_log_save_button, container_log_search = prepare_container_log_elements()
-            container_box.set_name(container.name)
-            # setup signal functionality
-            container_log_save_button.connect("clicked", self.on_container_save_click, container_info)
-            container_log_search.connect("activate", self.next_match, container_info)
-            container_log_search.connect("next-match", self.next_match, container_info)
-            container_log_search.connect("previous-match", self.prev_match, container_info)
-            
-            # tail docker logs in separate threads, calling back to main Gtk thread to update TextView
-            thread_dict[container.name] = StoppableThread(
-                target=container_log_tailer, args=[container_info, container.name])
-            thread_dict[container.name].daemon = True
-            thread_dict[container.name].start()
-
-            self.add_sidebar_item(item_name=container.name)
-
-            self.stack.add_titled(child=container_box,
-                                  name=container.name,
-                                  title=container.name)
+        self.container_sidebar.add(state)
 
+    def start_following(self, container_log: ContainerLog, name: str):
+        """Open and load the cached log of a container, then follow its logs from the last cached line on
+        (runs on the cache worker thread, opening a cache reads the index of its segments)
+        """
+        if self.container_logs.get(container_log.container_id) is not container_log:
+            # removed in the meantime
+            return
+        try:
+            container_log.cache = LogCache(cache_directory(name))
+        except LogCacheLocked as e:
+            # e.g. captainslog record archives the container, its history is followed without a cache
+            logger.warning(f"Log cache of {name} not used: {e}")
+        except OSError:
+            logger.warning(f"Log cache of {name} unavailable", exc_info=True)
+        last_timestamp = container_log.load_cache(self.cache_worker)
+        if container_log.store.end_seq:
+            self.ui_scheduler.schedule(self.on_container_backfilled, container_log.container_id)
+
+        # tail docker logs on the ingestion engine into the store, updating the view (once built) on the next frame.
+        # with a cache only the lines logged since the last cached one are fetched
+        self.ingestion.follow(container_log.container_id, container_log.store,
+                              partial(self.sync_container_page, container_log.container_id),
+                              tail=HIDDEN_MAX_LINES, since=last_timestamp, docker_host=container_log.docker_host)
+
+    def schedule_index_updates(self, container_log: ContainerLog):
+        """Index new lines of a container for search and field filters in the background"""
+        self.search_worker.schedule_update(container_log.index)
+        self.search_worker.schedule_update(container_log.fields)
+
+    def build_container_page(self, container_id: str):
+        """Build the stack page of a container, and backfill older lines from the cache and the daemon
+
+        Args:
+            container_id (str): id of the container
+        """
+        container_log = self.container_logs[container_id]
+        store = container_log.store
+        first_open = container_log.open()
+
+        page = ContainerPage(store, container_log.index, container_log.fields)
+        page.box.set_name(container_id)
+        self.container_pages[container_id] = page
+        # setup signal functionality
+        page.save_button.set_sensitive(self.export_job is None)
+        page.save_button.connect("clicked", self.on_container_save_click, container_log)
+        page.load_older_button.connect("clicked", self.on_load_older_click, container_log)
+        page.filter_entry.connect("activate", self.filter_log, page)
+        page.filter_entry.connect("changed", lambda entry: entry.get_text() or self.filter_log(entry, page))
+        page.search_entry.connect("search-changed", self.search_text, page)
+        page.search_entry.connect("activate", self.next_match, page)
+        page.search_entry.connect("next-match", self.next_match, page)
+        page.search_entry.connect("previous-match", self.prev_match, page)
+        page.search_regex_toggle.connect("toggled", lambda _: self.search_text(page.search_entry, page))
+
+        state = self.inventory.containers.get(container_id)
+        self.stack.add_titled(child=page.box,
+                              name=container_id,
+                              title=state.name if state else container_id[:12])
+        page.log_view.sync()
+
+        if first_open:
+            page.load_older_button.set_sensitive(False)
+            self.cache_worker.submit(self.backfill_container_log, container_log, BACKFILL_LINES)
+
+    def on_load_older_click(self, button: Gtk.Button, container_log: ContainerLog):
+        """Page backwards: load the chunk of older lines selected in the drop down"""
+        page = self.container_pages[container_log.container_id]
+        n_lines, span = page.load_older_choice()
+        since = None
+        if span is not None:
+            first_timestamp = container_log.store.get_timestamp(container_log.store.first_seq)
+            if not first_timestamp:
+                return
+            since = first_timestamp - span * 10 ** 9
+        button.set_sensitive(False)
+        self.cache_worker.submit(self.backfill_container_log, container_log,
+                                 n_lines if n_lines is not None else container_log.store.max_lines, since)
+
+    def backfill_container_log(self, container_log: ContainerLog, n_lines: int, since: Optional[int] = None):
+        """Insert up to n_lines older lines from the cache, then from the daemon if the cache runs out
+        (runs on the cache worker thread)
+
+        Args:
+            container_log (ContainerLog): container to backfill
+            n_lines (int): maximum number of lines to insert, lowered to what the store can hold
+            since (Optional[int]): timestamp (ns) of the oldest line to insert, None for no limit
+        """
+        container_id = container_log.container_id
+        n_lines = container_log.backfill_capacity(n_lines)
+        n_cached = container_log.backfill_from_cache(n_lines, since)
+        if n_cached < n_lines:
+            self.ingestion.backfill(container_id, container_log.store, n_lines - n_cached,
+                                    partial(self.on_container_backfilled, container_id), since,
+                                    docker_host=container_log.docker_host)
+        else:
+            self.ui_scheduler.schedule(self.on_container_backfilled, container_id)
+
+    def sync_container_page(self, container_id: str):
+        """Show lines appended to the store of a container, if its page was built"""
+        page = self.container_pages.get(container_id)
+        if page is not None:
+            page.log_view.sync()
+            if page.filters is not None:
+                self.update_filter(page)
+
+    def on_container_backfilled(self, container_id: str):
+        container_log = self.container_logs.get(container_id)
+        if container_log is None:
+            return
+        self.schedule_index_updates(container_log)
+        self.sync_container_page(container_id)
+        page = self.container_pages.get(container_id)
+        if page is not None:
+            page.load_older_button.set_sensitive(True)
+            # the older lines inserted have not been filtered yet
+            if page.filters is not None:
+                self.filter_log(page.filter_entry, page)
+
+    def remove_container_page(self, container_id: str):
+        """Remove the sidebar item and stack page of a removed container (no longer followed)
+
+        Args:
+            container_id (str): id of the removed container
+        """
+        page = self.timeline_page
+        if container_id in page.sources:
+            page.timeline.remove_source(page.sources.pop(container_id))
+        # the cached log is kept on disk, and continued if a container with the same name shows up again
+        container_log = self.container_logs.pop(container_id, None)
+        if container_log is not None and container_log.cache is not None:
+            self.cache_worker.unregister(container_log.cache)
+        page = self.container_pages.pop(container_id, None)
+
+        if self.stack.get_visible_child_name() == container_id:
+            self.show_page('overview-page')
+        self.container_sidebar.remove(container_id)
+        if page is not None:
+            self.stack.remove(page.box)
+
+    def on_timeline_group_changed(self):
+        page = self.timeline_page
+        if page.timeline is not None and page.selected_project() != page.project:
+            self.start_timeline()
+
+    def start_timeline(self):
+        """Merge the logs of the containers of the selected compose project (or every container) into a new timeline"""
+        page = self.timeline_page
+        page.set_timeline(MergedTimeline(), page.selected_project())
+        for container_id in self.container_logs:
+            state = self.inventory.containers.get(container_id)
+            if state is not None:
+                self.add_timeline_source(state)
+        page.update_status()
+
+    def add_timeline_source(self, state: ContainerState):
+        """Merge the logs of a container into the timeline, if it is shown and the container is part of it"""
+        page = self.timeline_page
+        container_log = self.container_logs.get(state.id)
+        if page.timeline is None or container_log is None or state.id in page.sources:
+            return
+        if page.project is not None and state.project != page.project:
+            return
+        page.sources[state.id] = page.timeline.add_source(state.name, container_log.store)
+
+    def flush_timeline(self):
+        """Merge the lines received since the last flush into the timeline, in the background"""
+        page = self.timeline_page
+        if page.timeline is not None and not page.flush_pending:
+            page.flush_pending = True
+            self.search_worker.run(page.timeline.flush, partial(self.on_timeline_flushed, page.timeline))
+        return True
+
+    def on_timeline_flushed(self, timeline: MergedTimeline, n_lines: int):
+        page = self.timeline_page
+        if timeline is not page.timeline:
+            return False
+        page.flush_pending = False
+        if n_lines:
+            page.log_view.sync()
+        page.update_status()
+        return False
+
+    def refresh_metrics(self):
+        """Show the current log rates and log stream states in the sidebar badges and the Overview summary"""
+        self.update_welcome_text()
+        tailers = self.ingestion.tailer_statuses()
+        rows = []
+        for container_id, container_log in self.container_logs.items():
+            rates = container_log.metrics.rates()
+            state = self.inventory.containers.get(container_id)
+            rows.append(ContainerMetricsRow(container_id, state.name if state else container_id[:12], rates))
+
+            text = format_rate(rates.lines_per_s) if rates.lines_per_s else ''
+            css_classes = ['sidebar-badge-error'] if rates.errors_per_s else []
+            tooltip = describe_rates(rates)
+            tailer = tailers.get(container_id)
+            if tailer is not None and tailer.state == TAILER_RETRYING and tailer.last_error:
+                text = '\u21bb'
+                css_classes.append('sidebar-badge-retrying')
+            if tailer is not None:
+                tooltip += "\n" + describe_tailer(tailer)
+            self.container_sidebar.set_badge(container_id, text, css_classes, tooltip)
+        self.metrics_overview.update(rows)
         return True
 
     def add_sidebar_item(self, item_name: str, item_label: str = None):
@@ -238,125 +592,314 @@ class MainWindow(Gtk.ApplicationWindow):
         self.sidebar_button_list.append(sidebar_row)
 
     def on_sidebar_button_clicked(self, button: Gtk.Button):
+        self.show_page(button.get_name())
+
+    def show_page(self, name: str):
+        """Show the stack page of a fixed sidebar item or of a container, and highlight it in the sidebar
+
+        Args:
+            name (str): name of the page, the id of a container for its page
+        """
+        # container pages are built the first time they are selected
+        if name in self.container_logs and name not in self.container_pages:
+            self.build_container_page(name)
+        if name == "timeline" and self.timeline_page.timeline is None:
+            self.start_timeline()
 
-        # update main view content based on clicked button
-        # and set selected row on sidebar
-        # print(f"old selected button = {self.sidebar_button_list.get_selected_row().get_name()}")
-        # print(f"new selected button = {button.get_name()}")
-        self.stack.get_child_by_name(self.sidebar_button_list.get_selected_row().get_name()).set_visible(False)
-        self.sidebar_button_list.select_row(button.get_parent())
-        self.stack.get_child_by_name(self.sidebar_button_list.get_selected_row().get_name()).set_visible(True)
         # disable visibility of current stack child, turn on visibility of new child
-        self.stack.set_visible_child_name(button.get_name())
-        # print(f"new visible child name = {self.stack.get_visible_child().get_name()}")
+        current = self.stack.get_visible_child()
+        if current is not None:
+            current.set_visible(False)
+        self.stack.get_child_by_name(name).set_visible(True)
+        self.stack.set_visible_child_name(name)
+        if name in self.sidebar_button_dict:
+            self.sidebar_button_list.select_row(self.sidebar_button_dict[name].get_parent())
+            self.container_sidebar.select(None)
+        else:
+            self.sidebar_button_list.unselect_all()
+            self.container_sidebar.select(name)
+
+    def on_close_request(self, window):
+        self.shutdown()
+        return False
+
+    def shutdown(self):
+        """Stop following the containers, write the lines still buffered to the log caches,
+        and discard an unfinished export
+        """
+        if self.export_job is not None:
+            self.export_job.cancel()
+        self.ingestion.stop()
+        self.cache_worker.stop()
 
     def quit_activated(self, action, parameter):
         # print("quit")<Ctrl>
-        app.quit()
+        self.shutdown()
+        self.get_application().quit()
         pass
 
     def about_activated(self, action, parameter):
         self.about_dialog.show()
     
 
-    def on_container_save_click(self, button: Gtk.Button, container_info: Gtk.TextView):
-        # container_info: Gtk.TextView = button.get_child()
-        
+    def on_container_save_click(self, button: Gtk.Button, container_log: ContainerLog):
+        page = self.container_pages[container_log.container_id]
+        state = self.inventory.containers.get(container_log.container_id)
+        name = state.name if state else container_log.container_id[:12]
+        query = page.search_entry.get_text()
         save_file_dialog = Gtk.FileChooserDialog(title="Save File As",
                                                  transient_for=self,
                                                  action=Gtk.FileChooserAction.SAVE)
+        save_file_dialog.set_current_name(f"{name}.log")
+        add_export_choices(save_file_dialog, query)
         save_button = save_file_dialog.add_button("Save", response_id=Gtk.ResponseType.ACCEPT)
         save_button.add_css_class("success")
-        save_file_dialog.connect("response", self.on_save_response, container_info.get_buffer())
+        save_file_dialog.connect("response", self.on_save_response, name,
+                                 [ExportSource(name, container_log.store, container_log.cache)],
+                                 query, page.search_regex_toggle.get_active())
         save_file_dialog.show()
 
-    def on_save_response(self, dialog: Gtk.FileChooserDialog, response: Gtk.ResponseType, buffer: Gtk.TextBuffer):
-        
+    def on_export_all_activated(self, action, parameter):
+        sources = []
+        for container_id, container_log in self.container_logs.items():
+            state = self.inventory.containers.get(container_id)
+            sources.append(ExportSource(state.name if state else container_id[:12],
+                                        container_log.store, container_log.cache))
+        if not sources:
+            return
+        query = self.global_search_page.search_entry.get_text()
+        export_dialog = Gtk.FileChooserDialog(title="Export All Logs As",
+                                              transient_for=self,
+                                              action=Gtk.FileChooserAction.SAVE)
+        export_dialog.set_current_name("captainslog-logs.tar")
+        add_export_choices(export_dialog, query)
+        save_button = export_dialog.add_button("Save", response_id=Gtk.ResponseType.ACCEPT)
+        save_button.add_css_class("success")
+        export_dialog.connect("response", self.on_save_response, f"{len(sources)} containers", sources,
+                              query, self.global_search_page.search_regex_toggle.get_active())
+        export_dialog.show()
+
+    def on_save_response(self, dialog: Gtk.FileChooserDialog, response: Gtk.ResponseType, name: str,
+                         sources: List[ExportSource], query: str, regex: bool):
         if response == Gtk.ResponseType.ACCEPT:
-            self.save_text_buffer(file=dialog.get_file(), buffer=buffer)
+            self.start_export(name, sources, dialog.get_file(), export_choices(dialog, query, regex))
         dialog.close()
 
-    def save_text_buffer(self, file: Gio.File, buffer: Gtk.TextBuffer):
+    def start_export(self, name: str, sources: List[ExportSource], file: Gio.File, options: ExportOptions):
+        """Stream the logs of one container (as text) or several (as a tar archive) to file in the background,
+        showing the progress in the header bar
 
-        # Retrieve the iterator at the start of the buffer
-        start = buffer.get_start_iter()
-        end = buffer.get_end_iter()
-
-        # Retrieve all the visible text between the two bounds
-        text = buffer.get_text(start, end, False)
+        Args:
+            name (str): what is exported, shown with the progress
+            sources (List[ExportSource]): containers to export
+            file (Gio.File): file to write, only replaced once the export is complete
+            options (ExportOptions): range, filter, format and compression selected in the save dialog
+        """
+        if self.export_job is not None:
+            return
+        self.export_job = ExportJob(sources, partial(GioOutput, file), options,
+                                    dispatch=traced_dispatch(GLib.idle_add),
+                                    progress=self.on_export_progress,
+                                    done=partial(self.on_export_done, file))
+        self.set_export_sensitive(False)
+        self.export_progress.start(name)
+        self.export_job.start()
+
+    def set_export_sensitive(self, sensitive: bool):
+        """Allow starting an export, or not while one is running"""
+        self.export_all_action.set_enabled(sensitive)
+        for page in self.container_pages.values():
+            page.save_button.set_sensitive(sensitive)
+
+    def on_export_progress(self, done: int, total: int):
+        if self.export_job is not None:
+            self.export_progress.update(done, total)
+        return False
+
+    def on_export_done(self, file: Gio.File, result: ExportResult):
+        self.export_job = None
+        self.set_export_sensitive(True)
+        if result.cancelled:
+            self.export_progress.finish("Export cancelled")
+        elif result.error is not None:
+            self.export_progress.finish(f"Unable to save {file.get_basename()}", result.error)
+        else:
+            self.export_progress.finish(f"Saved {result.lines} lines to {file.get_basename()}")
+        return False
 
-        # If there is nothing to save, return early
-        if not text:
+    def save_file_complete(self, file: Gio.File, result):
+        try:
+            file.replace_contents_finish(result)
+        except GLib.Error as e:
+            logger.warning(f"Unable to save {file.get_basename()}", exc_info=True)
+            if self.export_job is None:
+                self.export_progress.finish(f"Unable to save {file.get_basename()}", e.message)
             return
+        if self.export_job is None:
+            self.export_progress.finish(f"Saved {file.get_basename()}")
+
+    def on_export_trace_click(self, button: Gtk.Button):
+        export_dialog = Gtk.FileChooserDialog(title="Export Trace As",
+                                              transient_for=self,
+                                              action=Gtk.FileChooserAction.SAVE)
+        export_dialog.set_current_name("captainslog-trace.json")
+        save_button = export_dialog.add_button("Save", response_id=Gtk.ResponseType.ACCEPT)
+        save_button.add_css_class("success")
+        export_dialog.connect("response", self.on_export_trace_response)
+        export_dialog.show()
 
-        bytes = GLib.Bytes.new(text.encode('utf-8'))
+    def on_export_trace_response(self, dialog: Gtk.FileChooserDialog, response: Gtk.ResponseType):
+        if response == Gtk.ResponseType.ACCEPT:
+            file = dialog.get_file()
+            # the trace can be large, serialize it in the background
+            self.search_worker.run(lambda: json.dumps(profiler.chrome_trace()).encode('utf-8'),
+                                   partial(self.write_trace, file))
+        dialog.close()
 
-        # Start the asynchronous operation to save the data into the file
-        file.replace_contents_bytes_async(bytes,
-                                        None,
-                                        False,
-                                        Gio.FileCreateFlags.NONE,
-                                        None,
-                                        self.save_file_complete)
+    def write_trace(self, file: Gio.File, data: bytes):
+        file.replace_contents_bytes_async(GLib.Bytes.new(data),
+                                          None,
+                                          False,
+                                          Gio.FileCreateFlags.NONE,
+                                          None,
+                                          self.save_file_complete)
+        return False
+
+    def search_text(self, widget: Gtk.SearchEntry, page: ContainerPage):
+        """Search the container log in the background, replacing any query still running"""
+        if page.search_job is not None:
+            page.search_job.cancel()
+        page.search_job = self.search_worker.submit(page.index,
+                                                    widget.get_text(),
+                                                    page.search_regex_toggle.get_active(),
+                                                    partial(self.on_search_result, page))
+
+    def on_search_result(self, page: ContainerPage, result: SearchResult):
+        page.search_job = None
+        page.search_result = result
+        page.match_number = 0
+        page.show_match()
+        return False
+
+    def next_match(self, widget: Gtk.SearchEntry, page: ContainerPage):
+        if not page.search_is_current():
+            self.search_text(widget=widget, page=page)
+            return
+        if page.search_result.matches:
+            page.match_number = (page.match_number + 1) % len(page.search_result.matches)
+        page.show_match()
 
-    def save_file_complete(self, file: Gio.File, result):
-        res = file.replace_contents_finish(result)
-        info = file.query_info("standard::display-name",
-                            Gio.FileQueryInfoFlags.NONE)
-        if info:
-            display_name = info.get_attribute_string("standard::display-name")
-        else:
-            display_name = file.get_basename()
-        if not res:
-            print(f"Unable to save {display_name}")
-
-    def search_text(self, widget: Gtk.SearchEntry, text_view: Gtk.TextView):
-        search_text = widget.get_text()
-        start_iter = text_view.get_buffer().get_start_iter()
-        self.match_iter = start_iter.forward_search(
-            search_text, Gtk.TextSearchFlags.CASE_INSENSITIVE, None
-        )
-
-        if self.match_iter:
-            self.select_match(text_view)
-
-    def select_match(self, text_view: Gtk.TextView):
-        match_start, match_end = self.match_iter
-        text_view.scroll_to_iter(match_start, 0.0, True, 0.5, 0.5)
-        textbuffer = text_view.get_buffer()
-        textbuffer.select_range(match_start, match_end)
-
-    def next_match(self, widget: Gtk.SearchEntry, text_view: Gtk.TextView):
-        if self.match_iter:
-            next_iter = self.match_iter[1].forward_search(
-                widget.get_text(),
-                Gtk.TextSearchFlags.CASE_INSENSITIVE,
-                None,
-            )
-            if next_iter:
-                self.match_iter = next_iter
-                self.select_match(text_view)
-            else:
-                self.search_text(widget=widget, text_view=text_view)
+    def prev_match(self, widget: Gtk.SearchEntry, page: ContainerPage):
+        if not page.search_is_current():
+            self.search_text(widget=widget, page=page)
+            return
+        if page.search_result.matches:
+            page.match_number = (page.match_number - 1) % len(page.search_result.matches)
+        page.show_match()
+
+    def filter_log(self, entry: Gtk.Entry, page: ContainerPage):
+        """Show only the structured lines matching the filter typed in entry, or every line when it is empty"""
+        text = entry.get_text().strip()
+        entry.remove_css_class('error')
+        entry.set_tooltip_text(FILTER_HINT)
+        if not text:
+            page.filter_text = page.filters = None
+            page.log_view.set_filter(None)
+            return
+        try:
+            filters = parse_filter(text)
+        except ValueError as e:
+            entry.add_css_class('error')
+            entry.set_tooltip_text(str(e))
+            return
+        page.filter_text = text
+        page.filters = filters
+        page.filter_pending = True
+        self.search_worker.run(partial(page.fields.filter, filters),
+                               partial(self.on_filter_result, page, text, False))
+
+    def update_filter(self, page: ContainerPage):
+        """Filter the lines appended since the last filter result"""
+        if page.filter_pending:
+            return
+        page.filter_pending = True
+        self.search_worker.run(partial(page.fields.filter, page.filters, page.filter_end),
+                               partial(self.on_filter_result, page, page.filter_text, True))
+
+    def on_filter_result(self, page: ContainerPage, text: str, incremental: bool, result: FilterResult):
+        if page.filter_text != text:
+            # filter changed meanwhile, its own result is on the way
+            return False
+        page.filter_pending = False
+        page.filter_end = result.end_seq
+        if incremental:
+            page.log_view.extend_filter(result.seqs)
         else:
-            self.search_text(widget=widget, text_view=text_view)
-
-    def prev_match(self, widget: Gtk.SearchEntry, text_view: Gtk.TextView):
-        if self.match_iter:
-            prev_iter = self.match_iter[0].backward_search(
-                widget.get_text(),
-                Gtk.TextSearchFlags.CASE_INSENSITIVE,
-                None,
-            )
-            if prev_iter:
-                self.match_iter = prev_iter
-                self.select_match(text_view=text_view)
-            else:
-                self.search_text(widget=widget, text_view=text_view)
+            page.log_view.set_filter(result.seqs)
+        if page.store.end_seq > page.filter_end:
+            self.update_filter(page)
+        return False
+
+    def search_all_logs(self, widget: Gtk.SearchEntry):
+        """Search the logs of every container in parallel, replacing any search still running"""
+        page = self.global_search_page
+        if page.search_job is not None:
+            page.search_job.cancel()
+            page.search_job = None
+        page.clear()
+
+        query = widget.get_text()
+        regex = page.search_regex_toggle.get_active()
+        if not query:
+            page.search_status.set_text("")
+            return
+        if regex:
+            try:
+                re.compile(query)
+            except re.error:
+                page.search_status.set_text("Invalid pattern")
+                return
+
+        page.search_status.set_text("Searching...")
+        indexes = {container_id: container_log.index
+                   for container_id, container_log in self.container_logs.items()}
+        page.search_job = self.global_search.submit(indexes, query, regex,
+                                                    callback=self.on_global_search_hits,
+                                                    done=self.on_global_search_done)
+
+    def on_global_search_hits(self, container_id: str, hits: List[GlobalSearchHit], result: SearchResult):
+        state = self.inventory.containers.get(container_id)
+        self.global_search_page.add_hits(hits, result.count, state.name if state else container_id[:12])
+        self.global_search_page.search_status.set_text(f"Searching... {self.global_search_page.count} matches")
+        return False
+
+    def on_global_search_done(self):
+        page = self.global_search_page
+        page.search_job = None
+        page.search_status.set_text(f"{page.count} matches in {page.n_containers} containers")
+        return False
+
+    def on_global_search_activate(self, list_view: Gtk.ListView, position: int):
+        hit: GlobalSearchHit = self.global_search_page.results.get_item(position).hit
+        self.show_container_match(hit.container_id, (hit.seq, hit.start, hit.end))
+
+    def show_container_match(self, container_id: str, match: Tuple[int, int, int]):
+        """Open the page of a container and highlight a match in its log
+
+        Args:
+            container_id (str): id of the container
+            match (Tuple[int, int, int]): (seq, start, end) of the match
+        """
+        if container_id not in self.container_logs:
+            return
+        self.show_page(container_id)
+        self.container_pages[container_id].log_view.highlight_match(match)
+
 
 class MyApp(Adw.Application):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.connect('startup', lambda app: load_css())
         self.connect('activate', self.on_activate)
 
     def on_activate(self, app):
@@ -364,4 +907,8 @@ class MyApp(Adw.Application):
         self.win.present()
 
 
-app = MyApp(application_id="com.alexdlukens.CaptainsLog")
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the GUI"""
+    startup.mark(STARTUP_IMPORTS)
+    app = MyApp(application_id="com.alexdlukens.CaptainsLog")
+    return app.run(sys.argv if argv is None else argv)
@@ -0,0 +1,107 @@
+import functools
+import os
+import re
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional, Pattern
+
+# seconds covered by the rolling rates
+METRICS_WINDOW_S = 10
+# seconds between refreshes of the displayed rates
+METRICS_REFRESH_S = 2
+# lines matching this pattern (case insensitive) count as errors, override with CAPTAINSLOG_ERROR_PATTERN
+DEFAULT_ERROR_PATTERN = r'\b(?:error|exception|fatal|panic|traceback)\b'
+ERROR_PATTERN_ENV = 'CAPTAINSLOG_ERROR_PATTERN'
+
+
+@functools.lru_cache(maxsize=None)
+def error_pattern() -> Optional[Pattern]:
+    """The configured error pattern, None if it is set to an empty string"""
+    pattern = os.environ.get(ERROR_PATTERN_ENV, DEFAULT_ERROR_PATTERN)
+    return re.compile(pattern, re.IGNORECASE) if pattern else None
+
+
+class LogRates(NamedTuple):
+    lines_per_s: float
+    # bytes of UTF-8 text per second, without line endings
+    bytes_per_s: float
+    errors_per_s: float
+    total_lines: int
+    total_errors: int
+
+
+class LogMetrics:
+    """Rolling log rates of one container
+
+    Counts are kept in one bucket per second over the last METRICS_WINDOW_S
+    seconds, so recording a batch of lines only updates the current bucket.
+    record matches the LogStore listener signature and may be called from any
+    thread.
+    """
+
+    def __init__(self,
+                 pattern: Optional[Pattern] = None,
+                 window: int = METRICS_WINDOW_S,
+                 clock: Callable[[], float] = time.monotonic):
+        self.pattern = pattern if pattern is not None else error_pattern()
+        self.window = window
+        self.clock = clock
+        self._lines = [0] * window
+        self._bytes = [0] * window
+        self._errors = [0] * window
+        self._second = int(clock())
+        self.total_lines = 0
+        self.total_errors = 0
+        self.lock = threading.Lock()
+
+    def _advance(self, second: int):
+        """Clear the buckets of the seconds passed since the last call (lock held)"""
+        elapsed = second - self._second
+        if elapsed <= 0:
+            return
+        for offset in range(1, min(elapsed, self.window) + 1):
+            slot = (self._second + offset) % self.window
+            self._lines[slot] = self._bytes[slot] = self._errors[slot] = 0
+        self._second = second
+
+    def record(self, timestamps: List[int], lines: List[str]):
+        """Count a batch of new lines"""
+        # isascii is O(1), only lines with other characters are encoded to be measured
+        n_bytes = sum(len(line) if line.isascii() else len(line.encode('utf-8')) for line in lines)
+        n_errors = len(self.pattern.findall('\n'.join(lines))) if self.pattern is not None else 0
+        with self.lock:
+            self._advance(int(self.clock()))
+            slot = self._second % self.window
+            self._lines[slot] += len(lines)
+            self._bytes[slot] += n_bytes
+            self._errors[slot] += n_errors
+            self.total_lines += len(lines)
+            self.total_errors += n_errors
+
+    def rates(self) -> LogRates:
+        """Average rates over the window"""
+        with self.lock:
+            self._advance(int(self.clock()))
+            return LogRates(lines_per_s=sum(self._lines) / self.window,
+                            bytes_per_s=sum(self._bytes) / self.window,
+                            errors_per_s=sum(self._errors) / self.window,
+                            total_lines=self.total_lines,
+                            total_errors=self.total_errors)
+
+
+def format_rate(value: float, unit: str = '') -> str:
+    """Short human readable rate, e.g. 950/s, 1.2k/s or 3.4MB/s"""
+    for suffix in ('', 'k', 'M', 'G'):
+        if value < 1000:
+            break
+        value /= 1000
+    if value == 0:
+        return f'0{unit}/s'
+    text = f'{value:.1f}' if value < 10 else f'{value:.0f}'
+    return f'{text}{suffix}{unit}/s'
+
+
+def describe_rates(rates: LogRates) -> str:
+    """One line summary of rates, e.g. for a tooltip"""
+    return (f"{format_rate(rates.lines_per_s, ' lines')}, {format_rate(rates.bytes_per_s, 'B')}, "
+            f"{format_rate(rates.errors_per_s, ' errors')} ({rates.total_errors} errors in total)")
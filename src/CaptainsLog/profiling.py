@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, ContextManager, Deque, Dict, Optional, Tuple
+
+# set (e.g. CAPTAINSLOG_PROFILE=1) to record from startup and show the profiling page
+PROFILE_ENV = 'CAPTAINSLOG_PROFILE'
+# trace events kept for export, the oldest are dropped first
+MAX_TRACE_EVENTS = 200_000
+# most recent durations kept per span name, for percentiles
+MAX_SAMPLES = 1000
+# seconds between refreshes of the profiling page
+PROFILE_REFRESH_S = 1
+
+
+def callable_name(function: Callable) -> str:
+    """Readable name of a callback, looking through functools.partial"""
+    function = getattr(function, 'func', function)
+    return getattr(function, '__qualname__', None) or repr(function)
+
+
+class SpanStats:
+    """Durations (seconds) recorded for one span name"""
+
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=MAX_SAMPLES)
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.samples.append(duration)
+
+    def summary(self) -> Dict[str, float]:
+        recent = sorted(self.samples)
+        return {'count': self.count,
+                'total_ms': round(self.total * 1000, 3),
+                'mean_ms': round(self.total / self.count * 1000, 3),
+                'p95_ms': round(recent[min(int(0.95 * len(recent)), len(recent) - 1)] * 1000, 3),
+                'max_ms': round(self.max * 1000, 3)}
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'category', 'args', 'start')
+
+    def __init__(self, profiler: 'Profiler', name: str, category: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.category, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class _NoSpan:
+    """Span used while profiling is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Profiler:
+    """Opt-in recorder of the time spent in the hot paths, and of counters and queue depths
+
+    Spans (timed sections), counters (running totals by key, e.g. bytes received
+    per container) and gauges (current values, e.g. queue depths) are kept as
+    aggregated statistics for the profiling page, and as trace events that can
+    be exported in the Chrome trace format (chrome://tracing, Perfetto). While
+    disabled each instrumented call costs a single attribute check. May be used
+    from any thread.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self.lock:
+            self.start_time = time.perf_counter()
+            self.events: Deque[dict] = deque(maxlen=MAX_TRACE_EVENTS)
+            self.spans: Dict[str, SpanStats] = {}
+            self.counters: Dict[str, Dict[str, int]] = {}
+            # current and maximum value of each gauge
+            self.gauges: Dict[str, Tuple[int, int]] = {}
+            self.thread_names: Dict[int, str] = {}
+
+    def span(self, name: str, category: str = '', **args) -> ContextManager:
+        """Context manager timing the code it wraps, e.g. with profiler.span('search', 'search', query=query):"""
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, name, category, args)
+
+    def _event(self, event: dict):
+        """Add a trace event (lock held)"""
+        thread = threading.current_thread()
+        self.thread_names.setdefault(thread.ident, thread.name)
+        event['tid'] = thread.ident
+        self.events.append(event)
+
+    def _timestamp(self, perf_time: float) -> float:
+        """Trace timestamp (microseconds since the start of the recording)"""
+        return round((perf_time - self.start_time) * 1e6, 1)
+
+    def record(self, name: str, category: str, start: float, duration: float, args: Optional[dict] = None):
+        """Record a span that started at start (time.perf_counter()) and lasted duration seconds"""
+        if not self.enabled:
+            return
+        with self.lock:
+            stats = self.spans.get(name)
+            if stats is None:
+                stats = self.spans[name] = SpanStats()
+            stats.add(duration)
+            event = {'name': name, 'cat': category, 'ph': 'X', 'ts': self._timestamp(start),
+                     'dur': round(duration * 1e6, 1)}
+            if args:
+                event['args'] = args
+            self._event(event)
+
+    def add(self, counter: str, key: str, value: int):
+        """Add value to the running total of key, e.g. add('tailer bytes', container_id, len(chunk))"""
+        if not self.enabled:
+            return
+        with self.lock:
+            totals = self.counters.setdefault(counter, {})
+            totals[key] = total = totals.get(key, 0) + value
+            self._event({'name': f'{counter} {key[:12]}', 'cat': 'counter', 'ph': 'C',
+                         'ts': self._timestamp(time.perf_counter()), 'args': {counter: total}})
+
+    def gauge(self, name: str, value: int):
+        """Record the current value of a gauge, e.g. the length of a queue"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self._set_gauge(name, value)
+
+    def adjust(self, name: str, delta: int):
+        """Add delta to the current value of a gauge (never below 0)"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self._set_gauge(name, max(self.gauges.get(name, (0, 0))[0] + delta, 0))
+
+    def _set_gauge(self, name: str, value: int):
+        maximum = self.gauges.get(name, (0, 0))[1]
+        self.gauges[name] = (value, max(value, maximum))
+        self._event({'name': name, 'cat': 'gauge', 'ph': 'C', 'ts': self._timestamp(time.perf_counter()),
+                     'args': {name: value}})
+
+    def summary(self) -> dict:
+        """Aggregated statistics recorded so far"""
+        with self.lock:
+            return {
+                'elapsed_s': round(time.perf_counter() - self.start_time, 3),
+                'spans': {name: stats.summary() for name, stats in self.spans.items()},
+                'counters': {name: dict(totals) for name, totals in self.counters.items()},
+                'gauges': {name: {'current': current, 'max': maximum}
+                           for name, (current, maximum) in self.gauges.items()},
+            }
+
+    def chrome_trace(self) -> dict:
+        """Everything recorded in the Chrome trace event format, with the summary as metadata"""
+        summary = self.summary()
+        pid = os.getpid()
+        with self.lock:
+            events = [dict(event, pid=pid) for event in self.events]
+            events.extend({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                          for tid, name in self.thread_names.items())
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'captainslog': summary}}
+
+    def write_trace(self, path: str):
+        """Export the recording to a Chrome trace (JSON) file"""
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def format_summary(self) -> str:
+        """Plain text tables of the summary, for the profiling page"""
+        summary = self.summary()
+        lines = [f"Recording for {summary['elapsed_s']:.0f}s" + ('' if self.enabled else ' (paused)'), '']
+        lines.append(f"{'span':<40} {'count':>8} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9} {'total ms':>10}")
+        for name, stats in sorted(summary['spans'].items(), key=lambda item: -item[1]['total_ms']):
+            lines.append(f"{name[:40]:<40} {stats['count']:>8} {stats['mean_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+                         f"{stats['max_ms']:>9.3f} {stats['total_ms']:>10.1f}")
+        for name, gauge in sorted(summary['gauges'].items()):
+            lines.append('')
+            lines.append(f"{name}: {gauge['current']} (max {gauge['max']})")
+        for name, totals in sorted(summary['counters'].items()):
+            lines.append('')
+            lines.append(f"{name}: {sum(totals.values())} in total")
+            for key, total in sorted(totals.items(), key=lambda item: -item[1]):
+                lines.append(f"  {key[:12]:<14} {total:>14}")
+        return '\n'.join(lines)
+
+
+# shared by every module, enabled from startup with CAPTAINSLOG_PROFILE
+profiler = Profiler(enabled=bool(os.environ.get(PROFILE_ENV)))
+
+
+def traced_dispatch(dispatch: Callable[..., object], queue: str = 'idle queue depth') -> Callable[..., object]:
+    """Wrap a dispatch function such as GLib.idle_add so that, while profiling, the time each
+    callback takes on the main loop and the number of callbacks waiting to run are recorded
+
+    Args:
+        dispatch (Callable[..., object]): function called with (callback, *args)
+        queue (str): name of the gauge counting the callbacks waiting to run
+
+    Returns:
+        Callable[..., object]: function to use in place of dispatch
+    """
+    def traced(callback: Callable, *args):
+        if not profiler.enabled:
+            return dispatch(callback, *args)
+        profiler.adjust(queue, 1)
+
+        def run(*run_args):
+            profiler.adjust(queue, -1)
+            with profiler.span(callable_name(callback), 'main loop'):
+                return callback(*run_args)
+        return dispatch(run, *args)
+    return traced
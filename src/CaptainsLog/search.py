@@ -0,0 +1,404 @@
+import bisect
+import logging
+import queue
+import re
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from .log_store import LogStore
+from .profiling import profiler
+
+logger = logging.getLogger(__file__)
+
+# number of consecutive lines sharing one entry of a posting list
+BLOCK_LINES = 64
+# drop evicted blocks from the posting lists once this many blocks were evicted
+COMPACT_BLOCKS = 1024
+# lines read from the store at once when indexing or scanning
+SCAN_CHUNK_LINES = 4096
+# maximum number of match positions kept per query (all matches are still counted)
+MAX_MATCHES = 100_000
+# maximum number of matching lines per container returned by a search across all containers
+MAX_GLOBAL_HITS = 1000
+# threads used to search many containers in parallel
+GLOBAL_SEARCH_WORKERS = 4
+
+# (seq, start, end) of a match, start/end are character offsets in the line
+Match = Tuple[int, int, int]
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchResult(NamedTuple):
+    query: str
+    regex: bool
+    # positions of (up to MAX_MATCHES) matches, oldest first
+    matches: List[Match]
+    # total number of matches
+    count: int
+    # error message for an invalid regular expression
+    error: Optional[str] = None
+
+
+class GlobalSearchHit(NamedTuple):
+    container_id: str
+    # timestamp of the line in nanoseconds
+    timestamp: int
+    seq: int
+    start: int
+    end: int
+    text: str
+
+
+class SearchJob:
+    """Handle to a query submitted to the SearchWorker"""
+
+    def __init__(self, index: 'SearchIndex', query: str, regex: bool,
+                 callback: Callable[[SearchResult], object]):
+        self.index = index
+        self.query = query
+        self.regex = regex
+        self.callback = callback
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """Stop the query, its callback will not be called"""
+        self._cancelled.set()
+
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+class SearchIndex:
+    """Case insensitive trigram index over the lines of a LogStore
+
+    Posting lists hold the ids of blocks of BLOCK_LINES lines containing a
+    trigram rather than single lines, which keeps the index small. A substring
+    query intersects the posting lists of its trigrams and only scans the
+    lines of the candidate blocks. Lines inserted before the indexed ones
+    (see LogStore.backfill) have the whole index rebuilt. update and search
+    may be called from several threads, the index is locked while one of them runs.
+    """
+
+    def __init__(self, store: LogStore):
+        self.store = store
+        # lines before indexed_end have been indexed
+        self.indexed_end = 0
+        self._postings: Dict[str, array] = {}
+        # block ids count blocks from the line with sequence number _origin on, which may be negative
+        self._origin = 0
+        self._current_block = -1
+        self._current_block_trigrams: Set[str] = set()
+        self._compacted_block = 0
+        # LogStore.backfills when the index was (re)built
+        self._backfills = store.backfills
+        self.lock = threading.Lock()
+
+    def update(self):
+        """Index the lines appended to the store since the last update"""
+        with self.lock, profiler.span('index update', 'search'):
+            self._update()
+
+    def _update(self):
+        with self.store.lock:
+            first_seq, end_seq = self.store.seq_range()
+            backfills = self.store.backfills
+        if backfills != self._backfills:
+            self._reset(first_seq, backfills)
+        for chunk_start in range(max(self.indexed_end, first_seq), end_seq, SCAN_CHUNK_LINES):
+            start_seq, lines = self.store.read(chunk_start, min(chunk_start + SCAN_CHUNK_LINES, end_seq))
+            for seq, line in enumerate(lines, start_seq):
+                block = (seq - self._origin) // BLOCK_LINES
+                if block != self._current_block:
+                    self._current_block = block
+                    self._current_block_trigrams = set()
+                new_trigrams = trigrams(line.lower()) - self._current_block_trigrams
+                for trigram in new_trigrams:
+                    postings = self._postings.get(trigram)
+                    if postings is None:
+                        postings = self._postings[trigram] = array('I')
+                    postings.append(block)
+                self._current_block_trigrams |= new_trigrams
+            self.indexed_end = start_seq + len(lines)
+        self._compact()
+
+    def _reset(self, first_seq: int, backfills: int):
+        with profiler.span('index rebuild', 'search'):
+            self._postings = {}
+            self._origin = self.indexed_end = first_seq
+            self._current_block = -1
+            self._current_block_trigrams = set()
+            self._compacted_block = 0
+            self._backfills = backfills
+
+    def _compact(self):
+        first_block = (self.store.first_seq - self._origin) // BLOCK_LINES
+        if first_block - self._compacted_block < COMPACT_BLOCKS:
+            return
+        for trigram in list(self._postings):
+            postings = self._postings[trigram]
+            cut = bisect.bisect_left(postings, first_block)
+            if cut == len(postings):
+                del self._postings[trigram]
+            elif cut:
+                del postings[:cut]
+        self._compacted_block = first_block
+
+    def candidate_blocks(self, needle: str) -> List[int]:
+        """Return the blocks that contain every trigram of needle (lowercase, at least 3 characters)"""
+        posting_lists = []
+        for trigram in trigrams(needle):
+            postings = self._postings.get(trigram)
+            if postings is None:
+                return []
+            posting_lists.append(postings)
+        posting_lists.sort(key=len)
+        shortest, others = posting_lists[0], posting_lists[1:]
+        return [block for block in shortest if all(_contains(postings, block) for postings in others)]
+
+    def _ranges(self, needle: Optional[str]) -> Iterator[Tuple[int, int]]:
+        """Yield the (start_seq, end_seq) ranges of lines that may contain needle"""
+        first_seq, end_seq = self.store.seq_range()
+        if needle is None or len(needle) < 3:
+            for start in range(first_seq, end_seq, SCAN_CHUNK_LINES):
+                yield start, min(start + SCAN_CHUNK_LINES, end_seq)
+            return
+        for block in self.candidate_blocks(needle):
+            start = self._origin + block * BLOCK_LINES
+            if start + BLOCK_LINES > first_seq:
+                yield start, start + BLOCK_LINES
+
+    def search(self, query: str, regex: bool = False, job: Optional[SearchJob] = None) -> SearchResult:
+        """Find all matches of query (case insensitive) in the lines held by the store
+
+        Args:
+            query (str): text, or regular expression when regex is set
+            regex (bool): treat query as a regular expression, which scans every line
+            job (Optional[SearchJob]): job to check for cancellation between chunks
+
+        Raises:
+            SearchCancelled: the job was cancelled
+            re.error: query is an invalid regular expression
+        """
+        with self.lock, profiler.span('search', 'search', query=query, regex=regex):
+            return self._search(query, regex, job)
+
+    def _search(self, query: str, regex: bool, job: Optional[SearchJob]) -> SearchResult:
+        self._update()
+        matches: List[Match] = []
+        count = 0
+        if not query:
+            return SearchResult(query=query, regex=regex, matches=matches, count=count)
+        if regex:
+            pattern = re.compile(query, re.IGNORECASE)
+            needle = None
+        else:
+            needle = query.lower()
+        for range_start, range_end in self._ranges(needle):
+            if job is not None and job.cancelled():
+                raise SearchCancelled()
+            start_seq, lines = self.store.read(range_start, range_end)
+            for seq, line in enumerate(lines, start_seq):
+                if regex:
+                    line_matches = [(seq, m.start(), m.end()) for m in pattern.finditer(line) if m.end() > m.start()]
+                else:
+                    line_matches = _find_all(seq, line.lower(), needle)
+                count += len(line_matches)
+                if len(matches) < MAX_MATCHES:
+                    matches.extend(line_matches[:MAX_MATCHES - len(matches)])
+        return SearchResult(query=query, regex=regex, matches=matches, count=count)
+
+
+def _contains(postings: array, block: int) -> bool:
+    position = bisect.bisect_left(postings, block)
+    return position < len(postings) and postings[position] == block
+
+
+def _find_all(seq: int, line: str, needle: str) -> List[Match]:
+    matches = []
+    start = line.find(needle)
+    while start != -1:
+        matches.append((seq, start, start + len(needle)))
+        start = line.find(needle, start + len(needle))
+    return matches
+
+
+class SearchWorker:
+    """Background thread keeping SearchIndexes (and other per-container indexes
+    with an update method, e.g. StructuredFields) up to date and running queries
+
+    Results are handed to dispatch(callback, result), e.g. with
+    dispatch=GLib.idle_add to use them from the GTK main loop.
+    """
+
+    def __init__(self, dispatch: Callable[..., object]):
+        self.dispatch = dispatch
+        self._queue: 'queue.Queue[object]' = queue.Queue()
+        self._pending_updates: Set[object] = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='log-search', daemon=True)
+        self._thread.start()
+
+    def schedule_update(self, index: object):
+        """Call index.update() soon, to index new lines of its store (safe to call from any thread)"""
+        with self._lock:
+            if index in self._pending_updates:
+                return
+            self._pending_updates.add(index)
+        self._queue.put(index)
+
+    def submit(self, index: SearchIndex, query: str, regex: bool,
+               callback: Callable[[SearchResult], object]) -> SearchJob:
+        """Run a query in the background
+
+        Args:
+            index (SearchIndex): index of the container log to search
+            query (str): text or regular expression to search for
+            regex (bool): whether query is a regular expression
+            callback (Callable[[SearchResult], object]): dispatched with the result unless cancelled
+
+        Returns:
+            SearchJob: handle to cancel the query
+        """
+        job = SearchJob(index, query, regex, callback)
+        self._queue.put(job)
+        return job
+
+    def run(self, function: Callable[[], object], callback: Callable[[object], object]):
+        """Call function() on the worker, then dispatch callback with its return value"""
+        self._queue.put((function, callback))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, tuple):
+                function, callback = item
+                try:
+                    self.dispatch(callback, function())
+                except Exception:
+                    logger.exception(f"Background task {function} failed")
+                continue
+            if not isinstance(item, SearchJob):
+                with self._lock:
+                    self._pending_updates.discard(item)
+                try:
+                    item.update()
+                except Exception:
+                    logger.exception(f"Updating {item} failed")
+                continue
+
+            job: SearchJob = item
+            if job.cancelled():
+                continue
+            try:
+                result = job.index.search(job.query, job.regex, job)
+            except SearchCancelled:
+                continue
+            except re.error as e:
+                result = SearchResult(query=job.query, regex=job.regex, matches=[], count=0, error=str(e))
+            except Exception:
+                logger.exception(f"Search for {job.query} failed")
+                continue
+            if not job.cancelled():
+                self.dispatch(job.callback, result)
+
+
+class GlobalSearchJob:
+    """Handle to a search across many containers submitted to GlobalSearch"""
+
+    def __init__(self, jobs: List[SearchJob], done: Callable[[], object]):
+        self.jobs = jobs
+        self.done = done
+        self.remaining = len(jobs)
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        """Stop the search, no further callbacks will be called"""
+        for job in self.jobs:
+            job.cancel()
+
+    def cancelled(self) -> bool:
+        return bool(self.jobs) and self.jobs[0].cancelled()
+
+
+class GlobalSearch:
+    """Search the logs of many containers in parallel on a thread pool
+
+    Each container's matching lines are dispatched, in timestamp order, as
+    soon as that container has been searched, so results stream in while
+    slower containers are still being searched.
+    """
+
+    def __init__(self, dispatch: Callable[..., object], max_workers: int = GLOBAL_SEARCH_WORKERS):
+        self.dispatch = dispatch
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='global-search')
+
+    def submit(self, indexes: Dict[str, SearchIndex], query: str, regex: bool,
+               callback: Callable[[str, List[GlobalSearchHit], SearchResult], object],
+               done: Callable[[], object]) -> GlobalSearchJob:
+        """Search every container in the background
+
+        Args:
+            indexes (Dict[str, SearchIndex]): search index by container id
+            query (str): text or regular expression to search for
+            regex (bool): whether query is a regular expression
+            callback (Callable[[str, List[GlobalSearchHit], SearchResult], object]): dispatched for each
+                container with up to MAX_GLOBAL_HITS matching lines and the full result
+            done (Callable[[], object]): dispatched once every container has been searched
+
+        Returns:
+            GlobalSearchJob: handle to cancel the search
+        """
+        jobs = [SearchJob(index, query, regex, partial(callback, container_id))
+                for container_id, index in indexes.items()]
+        global_job = GlobalSearchJob(jobs, done)
+        if not jobs:
+            self.dispatch(done)
+        for container_id, job in zip(indexes, jobs):
+            self._executor.submit(self._search_container, global_job, container_id, job)
+        return global_job
+
+    def _search_container(self, global_job: GlobalSearchJob, container_id: str, job: SearchJob):
+        try:
+            if job.cancelled():
+                return
+            result = job.index.search(job.query, job.regex, job)
+            store = job.index.store
+            hits = []
+            last_seq = None
+            for seq, start, end in result.matches:
+                # one hit per line, on its first match
+                if seq == last_seq:
+                    continue
+                last_seq = seq
+                text = store.get(seq)
+                if text is not None:
+                    hits.append(GlobalSearchHit(container_id=container_id,
+                                                timestamp=store.get_timestamp(seq),
+                                                seq=seq,
+                                                start=start,
+                                                end=end,
+                                                text=text))
+                if len(hits) == MAX_GLOBAL_HITS:
+                    break
+            if not job.cancelled():
+                self.dispatch(job.callback, hits, result)
+        except (SearchCancelled, re.error):
+            pass
+        except Exception:
+            logger.exception(f"Search of {container_id} failed")
+        finally:
+            with global_job.lock:
+                global_job.remaining -= 1
+                finished = global_job.remaining == 0
+            if finished and not job.cancelled():
+                self.dispatch(global_job.done)
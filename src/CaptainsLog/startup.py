@@ -0,0 +1,61 @@
+import logging
+import sys
+import time
+from typing import Callable, List, Optional, TextIO, Tuple
+
+from .profiling import profiler
+
+logger = logging.getLogger(__file__)
+
+# milestones of the start of the viewer, in the order they are reached
+STARTUP_IMPORTS = 'imports'
+STARTUP_WINDOW = 'window built'
+STARTUP_FIRST_FRAME = 'first frame'
+STARTUP_CONTAINERS = 'containers listed'
+STARTUP_SIDEBAR = 'sidebar filled'
+
+
+class StartupTimer:
+    """Time from the first import of the package to each milestone of the start of the viewer
+
+    The start of the interpreter itself is not included. Milestones are logged,
+    recorded as spans while profiling, and can be printed with report (captainslog
+    gui --measure-startup) to track regressions.
+
+    Args:
+        clock (Callable[[], float]): monotonic clock (seconds)
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self.clock = clock
+        self.start = clock()
+        # (milestone, seconds since start), in the order they were reached
+        self.marks: List[Tuple[str, float]] = []
+        # quit the viewer and print the report once the sidebar is filled
+        self.measure = False
+
+    def mark(self, milestone: str) -> Optional[float]:
+        """Record that a milestone was reached (only the first time)
+
+        Returns:
+            Optional[float]: seconds since start, None if the milestone was reached before
+        """
+        if self.reached(milestone):
+            return None
+        now = self.clock()
+        elapsed = now - self.start
+        self.marks.append((milestone, elapsed))
+        profiler.record(f'startup: {milestone}', 'startup', self.start, elapsed)
+        logger.info(f"Startup: {milestone} after {elapsed * 1000:.0f} ms")
+        return elapsed
+
+    def reached(self, milestone: str) -> bool:
+        return any(name == milestone for name, _ in self.marks)
+
+    def report(self, output: TextIO = sys.stderr):
+        """Print the time of every milestone reached, one per line"""
+        for milestone, elapsed in self.marks:
+            print(f"{milestone:<20} {elapsed * 1000:8.1f} ms", file=output)
+
+
+startup = StartupTimer()
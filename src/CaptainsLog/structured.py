@@ -0,0 +1,294 @@
+import bisect
+import json
+import logging
+import math
+import re
+import shlex
+import threading
+from array import array
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+from .log_store import LogStore
+from .profiling import profiler
+
+logger = logging.getLogger(__file__)
+
+# lines read from the store at once when parsing
+PARSE_CHUNK_LINES = 4096
+# drop the fields of evicted lines once this many lines were evicted
+COMPACT_LINES = 65536
+# fields holding the severity of a line, by priority
+LEVEL_FIELDS = ('level', 'lvl', 'severity', 'loglevel', 'log.level')
+# rank of the level names used by common logging libraries
+LEVELS = {
+    'trace': 0,
+    'debug': 1,
+    'info': 2, 'information': 2, 'notice': 2,
+    'warn': 3, 'warning': 3,
+    'error': 4, 'err': 4,
+    'fatal': 5, 'critical': 5, 'crit': 5, 'panic': 5, 'alert': 5, 'emerg': 5,
+}
+NO_LEVEL = -1
+# nested JSON objects deeper than this are kept as text
+MAX_FIELD_DEPTH = 3
+
+LOGFMT_PAIR = re.compile(r'([\w.\-/@]+)=("(?:[^"\\]|\\.)*"|[^\s"]*)')
+FILTER_TERM = re.compile(r'^([\w.\-/@]+)(>=|<=|!=|=|>|<)(.*)$')
+
+Fields = Dict[str, str]
+Parser = Callable[[str], Optional[Fields]]
+
+
+def _flatten(value: dict, prefix: str, fields: Fields, depth: int):
+    for key, item in value.items():
+        name = f'{prefix}{key}'
+        if isinstance(item, dict) and depth < MAX_FIELD_DEPTH:
+            _flatten(item, f'{name}.', fields, depth + 1)
+        elif isinstance(item, str):
+            fields[name] = item
+        elif isinstance(item, bool) or item is None:
+            fields[name] = json.dumps(item)
+        elif isinstance(item, (int, float)):
+            fields[name] = repr(item)
+        else:
+            fields[name] = json.dumps(item, separators=(',', ':'))
+
+
+def parse_json(line: str) -> Optional[Fields]:
+    """Fields of a line holding a JSON object (possibly after a prefix), nested keys joined with dots"""
+    start = line.find('{')
+    if start < 0 or not line.endswith('}'):
+        return None
+    try:
+        value = json.loads(line[start:])
+    except ValueError:
+        return None
+    if not isinstance(value, dict):
+        return None
+    fields: Fields = {}
+    _flatten(value, '', fields, 1)
+    return fields
+
+
+def parse_logfmt(line: str) -> Optional[Fields]:
+    """Fields of a logfmt line (key=value key2="quoted value"), None unless it has at least two pairs"""
+    if line.count('=') < 2:
+        return None
+    pairs = LOGFMT_PAIR.findall(line)
+    if len(pairs) < 2:
+        return None
+    fields: Fields = {}
+    for key, value in pairs:
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        fields[key] = value
+    return fields
+
+
+# parsers tried in order on every line, the first one returning fields wins
+DEFAULT_PARSERS: List[Parser] = [parse_json, parse_logfmt]
+
+
+def level_rank(value: str) -> int:
+    return LEVELS.get(value.strip().lower(), NO_LEVEL)
+
+
+def _to_number(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return math.nan
+
+
+class FieldFilter(NamedTuple):
+    field: str
+    # one of = != > >= < <=
+    operator: str
+    value: str
+
+
+def parse_filter(text: str) -> List[FieldFilter]:
+    """Parse a filter such as 'level>=warn service=api latency_ms>500' (all terms must match)
+
+    Values containing spaces can be quoted, e.g. msg="connection reset".
+
+    Raises:
+        ValueError: text is not a valid filter
+    """
+    filters = []
+    for term in shlex.split(text):
+        match = FILTER_TERM.match(term)
+        if match is None:
+            raise ValueError(f"Invalid filter term {term}, expected <field><operator><value>")
+        field, operator, value = match.groups()
+        if field in LEVEL_FIELDS:
+            if level_rank(value) == NO_LEVEL:
+                raise ValueError(f"Unknown level {value}")
+        elif operator in ('>', '>=', '<', '<=') and math.isnan(_to_number(value)):
+            raise ValueError(f"{operator} needs a number, got {value}")
+        filters.append(FieldFilter(field, operator, value))
+    return filters
+
+
+COMPARISONS = {
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+class FilterResult(NamedTuple):
+    # sequence numbers of the matching lines, oldest first
+    seqs: List[int]
+    # lines before end_seq were considered
+    end_seq: int
+
+
+class Column:
+    """Values of one field, for the lines that have it, oldest first"""
+
+    __slots__ = ('seqs', 'values', 'numbers')
+
+    def __init__(self):
+        self.seqs = array('q')
+        self.values: List[str] = []
+        # numeric value of each entry, nan if not a number
+        self.numbers = array('d')
+
+    def append(self, seq: int, value: str):
+        self.seqs.append(seq)
+        self.values.append(value)
+        self.numbers.append(_to_number(value))
+
+    def trim(self, first_seq: int):
+        """Drop the entries of lines before first_seq"""
+        cut = bisect.bisect_left(self.seqs, first_seq)
+        del self.seqs[:cut]
+        del self.values[:cut]
+        del self.numbers[:cut]
+
+
+class StructuredFields:
+    """Fields of the structured (JSON or logfmt) lines of a LogStore, kept column by column
+
+    Each line is parsed once, in update (meant to run on a background worker).
+    The level of every line is kept in a dense column (NO_LEVEL for unparsed
+    lines), other fields in sparse columns listing only the lines that have
+    them, so filters never look at the text again. update and filter may be
+    called from several threads.
+    """
+
+    def __init__(self, store: LogStore, parsers: Optional[List[Parser]] = None):
+        self.store = store
+        self.parsers = parsers if parsers is not None else DEFAULT_PARSERS
+        # lines before parsed_end have been parsed, levels[0] belongs to line first_seq
+        self.first_seq = 0
+        self.parsed_end = 0
+        self.levels = array('b')
+        self.columns: Dict[str, Column] = {}
+        # LogStore.backfills when the lines were last parsed from first_seq
+        self._backfills = store.backfills
+        self.lock = threading.Lock()
+
+    def update(self):
+        """Parse the lines appended to the store since the last update"""
+        with self.lock, profiler.span('parse fields', 'search'):
+            self._update()
+
+    def _update(self):
+        with self.store.lock:
+            first_seq, end_seq = self.store.seq_range()
+            backfills = self.store.backfills
+        if first_seq > self.parsed_end or backfills != self._backfills:
+            # every parsed line was evicted, or older lines were inserted before them: parse every line again
+            self._backfills = backfills
+            self.first_seq = self.parsed_end = first_seq
+            self.levels = array('b')
+            self.columns = {}
+        for chunk_start in range(self.parsed_end, end_seq, PARSE_CHUNK_LINES):
+            start_seq, lines = self.store.read(chunk_start, min(chunk_start + PARSE_CHUNK_LINES, end_seq))
+            if start_seq > self.parsed_end:
+                self.levels.extend([NO_LEVEL] * (start_seq - self.parsed_end))
+            for seq, line in enumerate(lines, start_seq):
+                fields = self._parse(line)
+                if fields is None:
+                    self.levels.append(NO_LEVEL)
+                    continue
+                level = NO_LEVEL
+                for name in LEVEL_FIELDS:
+                    if name in fields:
+                        level = level_rank(fields[name])
+                        break
+                self.levels.append(level)
+                for name, value in fields.items():
+                    column = self.columns.get(name)
+                    if column is None:
+                        column = self.columns[name] = Column()
+                    column.append(seq, value)
+            self.parsed_end = start_seq + len(lines)
+        self._compact(first_seq)
+
+    def _parse(self, line: str) -> Optional[Fields]:
+        for parser in self.parsers:
+            fields = parser(line)
+            if fields:
+                return fields
+        return None
+
+    def _compact(self, first_seq: int):
+        if first_seq - self.first_seq < COMPACT_LINES:
+            return
+        del self.levels[:first_seq - self.first_seq]
+        self.first_seq = first_seq
+        for name in list(self.columns):
+            column = self.columns[name]
+            column.trim(first_seq)
+            if not column.seqs:
+                del self.columns[name]
+
+    def filter(self, filters: List[FieldFilter], start_seq: Optional[int] = None) -> FilterResult:
+        """Find the lines from start_seq on matching every filter
+
+        Args:
+            filters (List[FieldFilter]): conditions, see parse_filter
+            start_seq (Optional[int]): first line to consider, e.g. the end_seq of a previous result,
+                None for every line held
+        """
+        with self.lock, profiler.span('field filter', 'search'):
+            self._update()
+            end_seq = self.parsed_end
+            start_seq = self.store.first_seq if start_seq is None else max(start_seq, self.store.first_seq)
+            matching: Optional[Set[int]] = None
+            first: List[int] = []
+            for field_filter in filters:
+                seqs = self._filter_one(field_filter, start_seq)
+                if matching is None:
+                    matching, first = set(seqs), seqs
+                else:
+                    matching.intersection_update(seqs)
+                if not matching:
+                    return FilterResult(seqs=[], end_seq=end_seq)
+        return FilterResult(seqs=[seq for seq in first if seq in matching], end_seq=end_seq)
+
+    def _filter_one(self, field_filter: FieldFilter, start_seq: int) -> List[int]:
+        field, operator, value = field_filter
+        compare = COMPARISONS[operator]
+        if field in LEVEL_FIELDS:
+            rank = level_rank(value)
+            offset = max(start_seq - self.first_seq, 0)
+            return [seq for seq, level in enumerate(self.levels[offset:], self.first_seq + offset)
+                    if level != NO_LEVEL and compare(level, rank)]
+
+        column = self.columns.get(field)
+        if column is None:
+            return []
+        start = bisect.bisect_left(column.seqs, start_seq)
+        seqs = column.seqs[start:]
+        if operator in ('=', '!='):
+            values = column.values[start:]
+            return [seq for seq, item in zip(seqs, values) if compare(item, value)]
+        number = float(value)
+        return [seq for seq, item in zip(seqs, column.numbers[start:]) if compare(item, number)]
@@ -0,0 +1,213 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from .log_store import LogStore
+
+logger = logging.getLogger(__file__)
+
+# states of the log stream of a followed container
+TAILER_LIVE = 'live'
+TAILER_RETRYING = 'retrying'
+TAILER_STOPPED = 'stopped'
+# delay (seconds) before restarting a log stream that ended or failed, doubled after each attempt without new lines
+RESTART_DELAY_MIN = 1.0
+RESTART_DELAY_MAX = 30.0
+# fraction of each restart delay that is random, so streams that failed together do not all come back at once
+RESTART_JITTER = 0.5
+
+
+def backoff_delay(attempt: int, minimum: float = RESTART_DELAY_MIN, maximum: float = RESTART_DELAY_MAX,
+                  jitter: float = RESTART_JITTER, rng: Callable[[], float] = random.random) -> float:
+    """Jittered exponential backoff: a delay between (1 - jitter) and 1 times min(minimum * 2 ** attempt, maximum)
+
+    Args:
+        attempt (int): number of attempts that failed in a row before this one (0 for the first)
+        minimum (float): delay before the first attempt, in seconds
+        maximum (float): cap of the delay, in seconds
+        jitter (float): fraction of the delay that is random, from 0 (none) to 1
+        rng (Callable[[], float]): source of random numbers in [0, 1)
+
+    Returns:
+        float: delay in seconds
+    """
+    delay = min(minimum * 2 ** min(attempt, 32), maximum)
+    return delay * (1 - jitter * rng())
+
+
+class TailerStatus(NamedTuple):
+    container_id: str
+    # TAILER_LIVE, TAILER_RETRYING or TAILER_STOPPED
+    state: str
+    # number of times the stream was reopened
+    restarts: int
+    # seconds until the stream is reopened while retrying
+    retry_in: float
+    # error that ended the last stream, None if it ended normally (e.g. the container stopped)
+    last_error: Optional[str]
+    # timestamp (ns) of the last line received, the stream resumes after it
+    cursor: Optional[int]
+
+
+def describe_tailer(status: TailerStatus) -> str:
+    """One line summary of the state of a log stream, e.g. for a tooltip"""
+    if status.state == TAILER_LIVE:
+        return "Log stream live"
+    if status.state == TAILER_STOPPED:
+        return "Log stream stopped"
+    reason = f" after error: {status.last_error}" if status.last_error else ""
+    return f"Log stream reconnecting in {status.retry_in:.0f}s{reason}"
+
+
+class Tailer:
+    """A followed container: where its log stream resumes from, and how it is doing
+
+    Args:
+        container_id (str): id of the container
+        store (LogStore): store new lines are appended to
+        notify (Callable[[], object]): passed to dispatch after each batch appended to store
+        tail (Optional[int]): number of existing lines to start with when there is no cursor, None for all
+        cursor (Optional[int]): timestamp (ns) of the last line already held, None if none
+        docker_host (Optional[str]): host running the container, None for the engine's
+    """
+
+    def __init__(self, container_id: str, store: LogStore, notify: Callable[[], object],
+                 tail: Optional[int], cursor: Optional[int], docker_host: Optional[str]):
+        self.container_id = container_id
+        self.store = store
+        self.notify = notify
+        self.tail = tail
+        self.cursor = cursor
+        self.docker_host = docker_host
+        self.state = TAILER_RETRYING
+        self.restarts = 0
+        # attempts in a row that received no new line
+        self.failures = 0
+        self.retry_at = 0.0
+        self.last_error: Optional[str] = None
+        # whether the current attempt received new lines
+        self.received = False
+        self.task: Optional[asyncio.Task] = None
+        # set by TailerSupervisor.wake to cut the current restart delay short
+        self.wakeup: Optional[asyncio.Event] = None
+
+    def status(self) -> TailerStatus:
+        retry_in = max(self.retry_at - time.monotonic(), 0.0) if self.state == TAILER_RETRYING else 0.0
+        return TailerStatus(container_id=self.container_id, state=self.state, restarts=self.restarts,
+                            retry_in=retry_in, last_error=self.last_error, cursor=self.cursor)
+
+
+class TailerSupervisor:
+    """Own the log stream task of every followed container, on the event loop of the ingestion engine
+
+    Each container gets one task running stream(tailer) again and again: when
+    the stream ends (container stopped) or fails (connection dropped, daemon
+    restarted) it is reopened from the cursor of the tailer after a jittered
+    exponential backoff, which is reset once new lines arrive. The task only
+    ends when stream returns False (the container does not exist anymore), or
+    when the tailer is stopped. Stopping a tailer cancels its task without
+    waiting for it, so stopping many at once is cheap. When its container
+    starts again, wake reopens the stream without waiting for the backoff.
+
+    Args:
+        loop (asyncio.AbstractEventLoop): loop the tasks run on, all methods must be called from it
+        stream (Callable[[Tailer], Awaitable[bool]]): open the log stream of a tailer, set its state
+            to TAILER_LIVE and read the stream to its end, moving its cursor forward and setting received
+            when new lines arrive. Returns False if the container does not exist
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, stream: Callable[[Tailer], Awaitable[bool]]):
+        self.loop = loop
+        self.stream = stream
+        # followed containers by id, including those whose task ended on its own (until stopped or restarted)
+        self.tailers: Dict[str, Tailer] = {}
+
+    def start(self, tailer: Tailer) -> bool:
+        """Start following a container, unless it is followed already
+
+        A tailer whose task ended (its container was gone) is replaced, and the new
+        one resumes after the last line the previous one received.
+
+        Returns:
+            bool: whether tailer was started
+        """
+        previous = self.tailers.get(tailer.container_id)
+        if previous is not None:
+            if previous.state != TAILER_STOPPED:
+                return False
+            if previous.cursor is not None and (tailer.cursor is None or tailer.cursor < previous.cursor):
+                tailer.cursor = previous.cursor
+        self.tailers[tailer.container_id] = tailer
+        tailer.task = self.loop.create_task(self._supervise(tailer))
+        tailer.task.add_done_callback(lambda task: self._on_done(tailer, task))
+        return True
+
+    def stop(self, container_id: str) -> Optional[Tailer]:
+        """Stop following a container, without waiting for its stream to be closed
+
+        Returns:
+            Optional[Tailer]: the tailer stopped, None if the container was not followed
+        """
+        tailer = self.tailers.pop(container_id, None)
+        if tailer is None:
+            return None
+        tailer.state = TAILER_STOPPED
+        if tailer.task is not None:
+            tailer.task.cancel()
+        return tailer
+
+    def wake(self, container_id: str) -> bool:
+        """Reopen the stream of a container right away, e.g. because it (re)started, and reset its backoff
+
+        If the stream is open, it is reopened as soon as it ends instead.
+
+        Returns:
+            bool: whether the container is followed
+        """
+        tailer = self.tailers.get(container_id)
+        if tailer is None or tailer.wakeup is None:
+            return False
+        tailer.failures = 0
+        tailer.wakeup.set()
+        return True
+
+    def statuses(self) -> List[TailerStatus]:
+        """State of every followed container (safe to call from any thread)"""
+        return [tailer.status() for tailer in list(self.tailers.values())]
+
+    async def _supervise(self, tailer: Tailer):
+        tailer.wakeup = asyncio.Event()
+        while True:
+            tailer.received = False
+            tailer.wakeup.clear()
+            try:
+                if not await self.stream(tailer):
+                    # container was removed, nothing left to follow
+                    return
+                tailer.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                tailer.last_error = str(error) or type(error).__name__
+                logger.warning(f"Log stream for {tailer.container_id} interrupted, reconnecting", exc_info=True)
+
+            # back off while nothing new arrives so stopped containers cost (almost) nothing
+            if tailer.received:
+                tailer.failures = 0
+            delay = backoff_delay(tailer.failures)
+            tailer.failures += 1
+            tailer.state = TAILER_RETRYING
+            tailer.retry_at = time.monotonic() + delay
+            try:
+                await asyncio.wait_for(tailer.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            tailer.restarts += 1
+
+    def _on_done(self, tailer: Tailer, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Tailer of {tailer.container_id} died", exc_info=task.exception())
+        # when it ended on its own its status (and cursor, for a restart) is kept until it is stopped
+        tailer.state = TAILER_STOPPED
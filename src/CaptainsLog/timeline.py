@@ -0,0 +1,238 @@
+import datetime
+import heapq
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .log_store import LogStore
+from .profiling import profiler
+
+# seconds lines are held back after they arrive, so that lines logged earlier by other
+# containers but received a little later (e.g. in the next batch) are still merged in order
+REORDER_WINDOW = 0.5
+# limits of the merged timeline, the oldest lines are evicted first
+TIMELINE_MAX_LINES = 100_000
+TIMELINE_MAX_BYTES = 32 * 2 ** 20
+# most recent lines of each container merged into the timeline when it is opened
+TIMELINE_BACKFILL_LINES = 2000
+# seconds between two merges of the lines received
+TIMELINE_FLUSH_INTERVAL = 0.1
+# separates the container name from the line in the timeline
+SOURCE_SEPARATOR = ' | '
+# number of distinct colours given to the containers of a timeline
+N_SOURCE_COLORS = 8
+
+
+def source_color(name: str) -> int:
+    """Colour (0 to N_SOURCE_COLORS - 1) of a container in the timeline, the same across runs"""
+    return zlib.crc32(name.encode('utf-8')) % N_SOURCE_COLORS
+
+
+def source_span(text: str) -> Optional[Tuple[int, int]]:
+    """(start, end) offsets of the container name in a line of the timeline, None if it has none"""
+    start = text.find(' ') + 1
+    end = text.find(SOURCE_SEPARATOR, start)
+    if not start or end == -1:
+        return None
+    return start, end
+
+
+class _ClockFormatter:
+    """Format timestamps as local time of day with milliseconds, formatting each second once"""
+
+    def __init__(self):
+        self.second = None
+        self.prefix = ''
+
+    def __call__(self, timestamp: int) -> str:
+        second, nanos = divmod(timestamp, 1_000_000_000)
+        if second != self.second:
+            self.second = second
+            self.prefix = datetime.datetime.fromtimestamp(second).strftime('%H:%M:%S')
+        return f'{self.prefix}.{nanos // 1_000_000:03d}'
+
+
+class _Batch:
+    """Lines of one source received at once, consumed from position on"""
+
+    __slots__ = ('arrival', 'timestamps', 'lines', 'position')
+
+    def __init__(self, arrival: float, timestamps: List[int], lines: List[str]):
+        self.arrival = arrival
+        self.timestamps = timestamps
+        self.lines = lines
+        self.position = 0
+
+
+class TimelineMerge:
+    """Incremental k-way merge of the timestamped, in-order line streams of k sources
+
+    A heap holds the oldest pending line of each source with pending lines, so
+    taking the next line in time order costs O(log k). The oldest pending line
+    is only taken once it has been held back for reorder_window seconds after it
+    arrived (a line received later but logged earlier goes first in the
+    meantime). A line arriving more than reorder_window late, i.e. older than a
+    line already taken, is taken as soon as possible and counted in late_lines.
+    Thread-safe.
+
+    Args:
+        reorder_window (float): seconds lines are held back after they arrive
+        clock (Callable[[], float]): monotonic clock (seconds)
+    """
+
+    def __init__(self, reorder_window: float = REORDER_WINDOW, clock: Callable[[], float] = time.monotonic):
+        self.reorder_window = reorder_window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.late_lines = 0
+        self.last_timestamp = 0
+        self._pending: Dict[int, Deque[_Batch]] = {}
+        # (timestamp, source) of the oldest pending line of each source that has pending lines
+        self._heap: List[Tuple[int, int]] = []
+
+    def push(self, source: int, timestamps: List[int], lines: List[str], held: bool = True):
+        """Add lines of a source, logged after the lines pushed for it before
+
+        Args:
+            source (int): number of the source
+            timestamps (List[int]): timestamp of each line in nanoseconds (0 if unknown: the time it arrived)
+            lines (List[str]): lines, oldest first
+            held (bool): hold the lines back for the reorder window, False for lines that are not live
+        """
+        if not lines:
+            return
+        if not all(timestamps):
+            now = time.time_ns()
+            timestamps = [timestamp or now for timestamp in timestamps]
+        batch = _Batch(self.clock() if held else 0.0, timestamps, lines)
+        with self.lock:
+            batches = self._pending.setdefault(source, deque())
+            if not batches:
+                heapq.heappush(self._heap, (timestamps[0], source))
+            batches.append(batch)
+
+    def remove(self, source: int):
+        """Drop the pending lines of a source"""
+        with self.lock:
+            if self._pending.pop(source, None):
+                self._heap = [(timestamp, other) for timestamp, other in self._heap if other != source]
+                heapq.heapify(self._heap)
+
+    def pop(self, limit: Optional[int] = None) -> Tuple[List[int], List[int], List[str]]:
+        """Take the lines due, in time order
+
+        Args:
+            limit (Optional[int]): maximum number of lines to take
+
+        Returns:
+            Tuple[List[int], List[int], List[str]]: source, timestamp and text of each line
+        """
+        sources: List[int] = []
+        timestamps: List[int] = []
+        lines: List[str] = []
+        due = self.clock() - self.reorder_window
+        with self.lock, profiler.span('timeline merge', 'timeline'):
+            heap = self._heap
+            while heap and (limit is None or len(lines) < limit):
+                timestamp, source = heap[0]
+                batches = self._pending[source]
+                batch = batches[0]
+                if batch.arrival > due:
+                    break
+                sources.append(source)
+                timestamps.append(timestamp)
+                lines.append(batch.lines[batch.position])
+                if timestamp < self.last_timestamp:
+                    self.late_lines += 1
+                else:
+                    self.last_timestamp = timestamp
+                batch.position += 1
+                if batch.position == len(batch.lines):
+                    batches.popleft()
+                    if not batches:
+                        del self._pending[source]
+                        heapq.heappop(heap)
+                        continue
+                    batch = batches[0]
+                heapq.heapreplace(heap, (batch.timestamps[batch.position], source))
+        return sources, timestamps, lines
+
+    def n_pending(self) -> int:
+        with self.lock:
+            return sum(len(batch.lines) - batch.position for batches in self._pending.values() for batch in batches)
+
+
+class MergedTimeline:
+    """The logs of several containers interleaved in time order, in a bounded LogStore
+
+    Listens to the LogStores of the containers (which are fed with timestamps by the
+    ingestion engine), so no extra log streams are opened. Lines in the timeline's
+    store are prefixed with their time of day, the name of their container and
+    SOURCE_SEPARATOR (see source_span).
+    Call flush regularly (from any one thread) to merge the lines received.
+    """
+
+    def __init__(self, reorder_window: float = REORDER_WINDOW,
+                 max_lines: int = TIMELINE_MAX_LINES, max_bytes: int = TIMELINE_MAX_BYTES):
+        self.store = LogStore(max_lines=max_lines, max_bytes=max_bytes)
+        self.merge = TimelineMerge(reorder_window)
+        # name and store of each source, by source number
+        self.sources: Dict[int, Tuple[str, LogStore]] = {}
+        self._listeners: Dict[int, Callable[[List[int], List[str]], None]] = {}
+        self._next_source = 0
+        self._clock = _ClockFormatter()
+
+    def add_source(self, name: str, store: LogStore, backfill: int = TIMELINE_BACKFILL_LINES) -> int:
+        """Merge the lines of a container from now on, starting with its most recent lines
+
+        Args:
+            name (str): name prefixed to its lines
+            store (LogStore): store of the container
+            backfill (int): number of lines already held by the store to merge in
+
+        Returns:
+            int: number of the source
+        """
+        source = self._next_source
+        self._next_source += 1
+        self.sources[source] = (name, store)
+
+        def listener(timestamps: List[int], lines: List[str]):
+            self.merge.push(source, timestamps, lines)
+
+        # the store calls its listeners with its lock held, so no line is missed or merged twice
+        with store.lock:
+            first_seq, end_seq = store.seq_range()
+            _, timestamps, lines = store.read_timestamped(max(end_seq - backfill, first_seq), end_seq)
+            self.merge.push(source, timestamps, lines, held=False)
+            store.add_listener(listener)
+        self._listeners[source] = listener
+        return source
+
+    def remove_source(self, source: int):
+        """Stop merging the lines of a container (its lines already merged are kept)"""
+        name, store = self.sources.pop(source)
+        store.remove_listener(self._listeners.pop(source))
+        self.merge.remove(source)
+
+    def close(self):
+        """Stop listening to every container"""
+        for source in list(self.sources):
+            self.remove_source(source)
+
+    def flush(self) -> int:
+        """Append the lines due to the timeline's store
+
+        Returns:
+            int: number of lines appended
+        """
+        sources, timestamps, lines = self.merge.pop()
+        if not lines:
+            return 0
+        names = {source: name + SOURCE_SEPARATOR for source, (name, _) in self.sources.items()}
+        clock = self._clock
+        self.store.extend(timestamps, [f'{clock(timestamp)} {names.get(source, "?" + SOURCE_SEPARATOR)}{line}'
+                                       for source, timestamp, line in zip(sources, timestamps, lines)])
+        return len(lines)
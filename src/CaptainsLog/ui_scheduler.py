@@ -0,0 +1,63 @@
+import gi
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+from gi.repository import GLib, Gtk
+
+from .profiling import callable_name, profiler
+
+logger = logging.getLogger(__file__)
+
+# main loop time (seconds) spent applying updates per frame, the rest carries over to the next frame
+FRAME_BUDGET = 0.004
+
+
+class UiUpdateScheduler:
+    """Apply UI updates requested from any thread on the frame clock of a widget
+
+    Identical requests made before they are applied (e.g. several batches of
+    new lines for the same container) are merged into one. On each frame the
+    pending updates are applied oldest first until the time budget is used up,
+    and whatever is left is applied on the next frames. While nothing is
+    pending the scheduler does not wake up the main loop.
+    """
+
+    def __init__(self, widget: Gtk.Widget, budget: float = FRAME_BUDGET):
+        self.widget = widget
+        self.budget = budget
+        self._pending: 'OrderedDict[Tuple[Callable, tuple], None]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._armed = False
+
+    def schedule(self, callback: Callable, *args):
+        """Call callback(*args) from the GTK main loop on one of the next frames (safe to call from any thread)"""
+        with self._lock:
+            self._pending[(callback, args)] = None
+            profiler.gauge('ui update queue depth', len(self._pending))
+            if self._armed:
+                return
+            self._armed = True
+        GLib.idle_add(self._arm)
+
+    def _arm(self):
+        self.widget.add_tick_callback(self._on_tick)
+        return False
+
+    def _on_tick(self, widget: Gtk.Widget, frame_clock):
+        deadline = time.perf_counter() + self.budget
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._armed = False
+                    return GLib.SOURCE_REMOVE
+                (callback, args), _ = self._pending.popitem(last=False)
+            try:
+                with profiler.span(callable_name(callback), 'main loop'):
+                    callback(*args)
+            except Exception:
+                logger.exception(f"UI update {callback} failed")
+            if time.perf_counter() >= deadline:
+                return GLib.SOURCE_CONTINUE
@@ -0,0 +1,30 @@
+from CaptainsLog.ansi import AnsiStyle, BASE_COLORS, palette_color, parse_ansi, plain_offset, strip_ansi
+
+
+def test_plain_text_has_no_spans():
+    assert parse_ansi('plain') == ('plain', [])
+
+
+def test_sgr_styles_runs_until_reset():
+    text, spans = parse_ansi('\x1b[1;31mERROR\x1b[0m done')
+    assert text == 'ERROR done'
+    assert spans == [(0, 5, AnsiStyle(foreground=BASE_COLORS[1], bold=True))]
+
+
+def test_extended_colours():
+    _, spans = parse_ansi('\x1b[38;5;196ma\x1b[48;2;1;2;3mb')
+    assert spans[0][2].foreground == palette_color(196)
+    assert spans[1][2] == AnsiStyle(foreground=palette_color(196), background=(1, 2, 3))
+
+
+def test_other_escape_sequences_are_dropped():
+    text, spans = parse_ansi('\x1b]0;title\x07\x1b[2Kline')
+    assert text == 'line'
+    assert spans == []
+
+
+def test_strip_ansi_and_plain_offset():
+    text = '\x1b[32mINFO\x1b[0m ok'
+    assert strip_ansi(text) == 'INFO ok'
+    assert plain_offset(text, text.index('ok')) == 5
+    assert plain_offset('no escapes', 3) == 3
@@ -0,0 +1,133 @@
+import argparse
+import datetime
+import io
+import threading
+import time
+
+import pytest
+
+from CaptainsLog.cli import (DEFAULT_TAIL_LINES, Follower, LineWriter, build_parser, main, parse_line_range,
+                             parse_time, record, tail)
+from CaptainsLog.docker_utils import ContainerState, parse_container_filter
+from CaptainsLog.log_cache import LogCache
+from CaptainsLog.log_stream import format_timestamp
+
+
+class ClosedOutput(io.StringIO):
+
+    def write(self, text: str) -> int:
+        raise BrokenPipeError()
+
+
+def test_parser_defaults_and_options():
+    args = build_parser().parse_args(['tail'])
+    assert args.handler is tail
+    assert args.containers == []
+    assert args.tail == DEFAULT_TAIL_LINES
+    assert not args.timestamps
+    args = build_parser().parse_args(['tail', '-n', '0', '-t', 'web', 'db'])
+    assert (args.containers, args.tail, args.timestamps) == (['web', 'db'], 0, True)
+    args = build_parser().parse_args(['record', '-o', '/tmp/archive', 'web'])
+    assert args.handler is record
+    assert (args.containers, args.output) == (['web'], '/tmp/archive')
+    assert build_parser().parse_args([]).command is None
+    assert build_parser().parse_args(['gui', '--measure-startup']).measure_startup
+
+
+def test_invalid_filter_is_a_usage_error(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(['tail', '--filter', 'color=red'])
+    assert exit_info.value.code == 2
+    assert 'color' in capsys.readouterr().err
+
+
+def test_follower_lists_containers_matching_the_filter():
+    follower = Follower(start=lambda state: None, selectors=[], engine=None, hosts=['unix:///var/run/docker.sock'],
+                        container_filter=parse_container_filter(['status=running']))
+    assert follower.inventory.container_filter.status == ('running',)
+
+
+def test_host_option_repeats():
+    args = build_parser().parse_args(['tail', '-H', 'tcp://build:2375', '--host', 'ssh://me@web1'])
+    assert args.host == ['tcp://build:2375', 'ssh://me@web1']
+    assert build_parser().parse_args(['record']).host is None
+
+
+def test_line_writer_prefixes_lines_with_the_container_name():
+    output = io.StringIO()
+    writer = LineWriter('web', output, threading.Lock(), on_closed=lambda: None)
+    writer.extend([1, 2], ['first', 'second'])
+    assert output.getvalue() == 'web | first\nweb | second\n'
+
+
+def test_line_writer_timestamps_and_closed_output():
+    output = io.StringIO()
+    writer = LineWriter('web', output, threading.Lock(), on_closed=lambda: None, timestamps=True)
+    writer.extend([1_700_000_000_000_000_000], ['line'])
+    assert output.getvalue() == f'web | {format_timestamp(1_700_000_000_000_000_000)} line\n'
+    closed = []
+    LineWriter('web', ClosedOutput(), threading.Lock(), on_closed=lambda: closed.append(True)).extend([1], ['x'])
+    assert closed == [True]
+
+
+def state(container_id: str, name: str) -> ContainerState:
+    return ContainerState(id=container_id, name=name, status='running')
+
+
+def make_follower(selectors, hosts=('unix:///var/run/docker.sock',)) -> Follower:
+    return Follower(start=lambda state: None, selectors=selectors, engine=None, hosts=list(hosts))
+
+
+def test_follower_selects_by_name_or_id_prefix():
+    follower = make_follower(['web', '0a1b'])
+    assert follower.selected(state('ffff', 'web'))
+    assert follower.selected(state('0a1b2c3d', 'db'))
+    assert not follower.selected(state('ffff', 'web-2'))
+    assert make_follower([]).selected(state('ffff', 'web-2'))
+
+
+def test_follower_selects_qualified_names_of_several_hosts():
+    follower = make_follower(['web', 'db@build'], hosts=['unix:///var/run/docker.sock', 'tcp://build:2375'])
+    assert follower.inventory.label_hosts
+    assert follower.selected(state('ffff', 'web@local'))
+    assert follower.selected(state('ffff', 'web@build'))
+    assert follower.selected(state('ffff', 'db@build'))
+    assert not follower.selected(state('ffff', 'db@local'))
+
+
+def test_parse_time():
+    before = time.time_ns()
+    assert before - 2 * 3600 * 10 ** 9 <= parse_time('2h') <= time.time_ns() - 2 * 3600 * 10 ** 9
+    assert parse_time('2024-05-01T12:00') == int(datetime.datetime(2024, 5, 1, 12).timestamp()) * 10 ** 9
+    for text in ['2y', 'h', 'yesterday']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_time(text)
+
+
+def test_parse_line_range():
+    assert parse_line_range('-1000:') == (-1000, None)
+    assert parse_line_range(':50') == (None, 50)
+    assert parse_line_range('10:20') == (10, 20)
+    for text in ['10', 'a:b', '1:2:3']:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_line_range(text)
+
+
+def test_export_command(tmp_path):
+    cache = LogCache(tmp_path / 'web')
+    cache.append(list(range(1, 101)), [f'line {i}' for i in range(100)])
+    cache.flush()
+    output = tmp_path / 'web.log'
+    assert main(['export', '--cache', str(tmp_path), '--lines=-3:', '-g', 'LINE 9', '-o', str(output), 'web']) == 0
+    assert output.read_text() == 'line 97\nline 98\nline 99\n'
+    assert main(['export', '--cache', str(tmp_path), '-o', str(output), 'db']) == 1
+
+
+def test_export_reads_a_cache_being_recorded(tmp_path):
+    cache = LogCache(tmp_path / 'web')
+    cache.append([1, 2], ['first', 'second'])
+    cache.flush()
+    output = tmp_path / 'web.log'
+    assert main(['export', '--cache', str(tmp_path), '-o', str(output), 'web']) == 0
+    assert output.read_text() == 'first\nsecond\n'
+    cache.close()
@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import pytest
+
+from CaptainsLog.docker_api import (HOSTS_ENV, DockerEndpoint, _read_head, docker_hosts, host_label, iter_body,
+                                    iter_json_stream, parse_docker_host)
+from CaptainsLog.log_stream import FrameDecoder
+
+
+def reader_of(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+def chunked(*chunks: bytes) -> bytes:
+    return b''.join(b'%x\r\n%s\r\n' % (len(chunk), chunk) for chunk in chunks) + b'0\r\n\r\n'
+
+
+def frame(stream: int, payload: bytes) -> bytes:
+    return bytes([stream, 0, 0, 0]) + len(payload).to_bytes(4, 'big') + payload
+
+
+def read_body(data: bytes, headers: dict) -> list:
+    async def read():
+        return [chunk async for chunk in iter_body(reader_of(data), headers)]
+
+    return asyncio.run(read())
+
+
+def test_parse_docker_host():
+    assert parse_docker_host('unix:///var/run/docker.sock') == ('unix', '/var/run/docker.sock')
+    assert parse_docker_host('tcp://build:2375/') == ('tcp', 'build:2375')
+    assert parse_docker_host('ssh://me@web1') == ('ssh', 'me@web1')
+    with pytest.raises(ValueError):
+        parse_docker_host('http://build:2375')
+
+
+def test_docker_hosts_and_labels(monkeypatch):
+    monkeypatch.setenv(HOSTS_ENV, 'tcp://build:2375, ssh://me@web1:2222,tcp://build:2375')
+    assert docker_hosts() == ['tcp://build:2375', 'ssh://me@web1:2222']
+    assert docker_hosts(['unix:///run/user/1000/docker.sock']) == ['unix:///run/user/1000/docker.sock']
+    monkeypatch.delenv(HOSTS_ENV)
+    monkeypatch.delenv('DOCKER_HOST', raising=False)
+    assert docker_hosts() == ['unix:///var/run/docker.sock']
+    assert [host_label(host) for host in ['unix:///var/run/docker.sock', 'unix:///run/user/1000/docker.sock',
+                                          'tcp://build:2375', 'ssh://me@web1:2222']] == \
+        ['local', 'docker.sock', 'build', 'web1']
+
+
+def test_read_head():
+    async def read_head(data: bytes):
+        return await _read_head(reader_of(data))
+
+    status, headers = asyncio.run(read_head(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                                            b'Content-Length: 2\r\n\r\n{}'))
+    assert status == 200
+    assert headers == {'content-type': 'application/json', 'content-length': '2'}
+    with pytest.raises(ConnectionError):
+        asyncio.run(read_head(b''))
+
+
+def test_iter_body_decodes_chunked_encoding():
+    async def read():
+        reader = reader_of(chunked(b'first', b'x' * 300) + b'HTTP/1.1 200 OK\r\n')
+        chunks = [chunk async for chunk in iter_body(reader, {'transfer-encoding': 'chunked'})]
+        # the connection is left at the start of the next response
+        return chunks, await reader.readline()
+
+    assert asyncio.run(read()) == ([b'first', b'x' * 300], b'HTTP/1.1 200 OK\r\n')
+
+
+def test_iter_body_content_length_and_until_eof():
+    assert read_body(b'abcdef', {'content-length': '3'}) == [b'abc']
+    assert read_body(b'', {'content-length': '0'}) == []
+    assert b''.join(read_body(b'x' * 100_000, {})) == b'x' * 100_000
+
+
+def test_iter_body_fails_on_truncated_chunked_body():
+    with pytest.raises(asyncio.IncompleteReadError):
+        read_body(b'a\r\nonly', {'transfer-encoding': 'chunked'})
+    with pytest.raises(ConnectionError):
+        read_body(b'3\r\nabc\r\n', {'transfer-encoding': 'chunked'})
+
+
+def test_multiplexed_frames_split_across_chunks():
+    data = frame(1, b'out\n') + frame(2, b'err line\n') + frame(1, b'last\n')
+    body = chunked(data[:5], data[5:19], data[19:])
+
+    async def frames():
+        decoder = FrameDecoder()
+        return [item async for chunk in iter_body(reader_of(body), {'transfer-encoding': 'chunked'})
+                for item in decoder.feed(chunk)]
+
+    assert asyncio.run(frames()) == [(1, b'out\n'), (2, b'err line\n'), (1, b'last\n')]
+
+
+def test_iter_json_stream():
+    events = [{'Action': 'start', 'id': 'a'}, {'Action': 'die', 'id': 'b'}]
+    data = b'\n'.join(json.dumps(event).encode() for event in events)
+    body = chunked(data[:10], data[10:40], data[40:])
+
+    async def read():
+        return [event async for event in iter_json_stream(reader_of(body), {'transfer-encoding': 'chunked'})]
+
+    assert asyncio.run(read()) == events
+
+
+def test_endpoint_reuses_keep_alive_connections(tmp_path):
+    socket_path = str(tmp_path / 'docker.sock')
+    connections = []
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections.append(writer)
+        while await reader.readline():
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            body = json.dumps({'requests': len(connections)}).encode()
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s' % (len(body), body))
+            await writer.drain()
+        writer.close()
+
+    async def run():
+        server = await asyncio.start_unix_server(handle, socket_path)
+        endpoint = DockerEndpoint(f'unix://{socket_path}')
+        results = [await endpoint.get_json('/containers/json', {'all': 1}) for _ in range(3)]
+        endpoint.close()
+        server.close()
+        return endpoint, results
+
+    endpoint, results = asyncio.run(run())
+    assert results == [(200, {'requests': 1})] * 3
+    assert len(connections) == 1
+    assert endpoint.status().connected
+
+
+def test_unreachable_host_backs_off(tmp_path):
+    async def run():
+        endpoint = DockerEndpoint(f'unix://{tmp_path / "missing.sock"}')
+        with pytest.raises(OSError):
+            await endpoint.get_json('/version')
+        return endpoint.status()
+
+    status = asyncio.run(run())
+    assert not status.connected
+    assert status.consecutive_failures == 1
+    assert 0 < status.retry_in <= 1
+    assert status.last_error
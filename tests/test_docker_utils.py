@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from CaptainsLog.docker_utils import (COMPOSE_PROJECT_LABEL, ContainerFilter, ContainerInventory, ContainerState,
+                                      parse_container_filter, split_filter_text)
+
+LOCAL = 'unix:///var/run/docker.sock'
+BUILD = 'tcp://build:2375'
+
+
+def state(name: str, status: str = 'running', project: str = '') -> ContainerState:
+    return ContainerState(id=name * 4, name=name, status=status, host='', project=project)
+
+
+def summary(name: str, status: str = 'running', project: str = '') -> dict:
+    return {'Id': name * 4, 'Names': [f'/{name}'], 'State': status, 'Labels': {COMPOSE_PROJECT_LABEL: project}}
+
+
+def test_parse_container_filter():
+    container_filter = parse_container_filter(['status=running', 'status=paused', 'name=^api',
+                                               'label=tier=web', 'project=shop'])
+    assert container_filter == ContainerFilter(status=('running', 'paused'), names=('^api',),
+                                               labels=('tier=web',), project='shop')
+    assert container_filter.daemon_filters() == {'status': ['running', 'paused'], 'name': ['^api'],
+                                                 'label': ['tier=web', f'{COMPOSE_PROJECT_LABEL}=shop']}
+    assert json.loads(container_filter.list_params()['filters'])['name'] == ['^api']
+    assert container_filter.event_filters()['type'] == ['container']
+    assert ContainerFilter().list_params() == {'all': 1}
+
+
+@pytest.mark.parametrize('terms', [['color=red'], ['status=sleeping'], ['name=('], ['status='],
+                                   ['project=a', 'project=b']])
+def test_parse_container_filter_rejects(terms):
+    with pytest.raises(ValueError):
+        parse_container_filter(terms)
+
+
+def test_split_filter_text():
+    container_filter, words = split_filter_text('API status=exited Worker')
+    assert container_filter.status == ('exited',)
+    assert words == ['api', 'worker']
+
+
+def test_matches():
+    container_filter = parse_container_filter(['status=running', 'name=^api', 'project=shop'])
+    assert container_filter.matches(state('api-1', project='shop'))
+    assert not container_filter.matches(state('api-1', status='exited', project='shop'))
+    assert not container_filter.matches(state('web', project='shop'))
+    assert not container_filter.matches(state('api-1', project='blog'))
+
+
+def test_name_filter_matches_names_qualified_with_their_host():
+    container_filter = parse_container_filter(['name=^api$'])
+    assert container_filter.matches(state('api@build'))
+    assert not container_filter.matches(state('api-2@build'))
+    inventory = ContainerInventory(on_change=lambda: None, label_hosts=True)
+    inventory.set_filter(container_filter)
+    # the daemons only return and report the containers matching the filter
+    inventory.replace_host(LOCAL, [summary('api')])
+    inventory.replace_host(BUILD, [dict(summary('api'), Id='b' * 12)])
+    assert sorted(state.name for state in inventory.containers.values()) == ['api@build', 'api@local']
+    inventory.apply_event({'Action': 'die', 'Actor': {'ID': 'b' * 12, 'Attributes': {'name': 'api'}}}, BUILD)
+    assert inventory.containers['b' * 12].status == 'exited'
+
+
+def test_inventory_applies_filter_to_lists_and_events():
+    changes = []
+    inventory = ContainerInventory(on_change=lambda: changes.append(True))
+    inventory.replace_host('', [summary('api'), summary('old', status='exited')])
+    assert set(inventory.pop_changes()) == {'apiapiapiapi', 'oldoldoldold'}
+    inventory.set_filter(parse_container_filter(['status=running']))
+    assert inventory.pop_changes() == {'oldoldoldold': None}
+    inventory.apply_event({'Action': 'die', 'Actor': {'ID': 'apiapiapiapi', 'Attributes': {'name': 'api'}}})
+    assert inventory.pop_changes() == {'apiapiapiapi': None}
+    inventory.replace_host('', [summary('api'), summary('old', status='exited')])
+    assert list(inventory.pop_changes()) == ['apiapiapiapi']
+    assert inventory.listed_hosts == {''}
+
+
+def test_inventory_tracks_containers_of_several_hosts():
+    changes = []
+    inventory = ContainerInventory(on_change=lambda: changes.append(True), label_hosts=True)
+    inventory.replace_host(LOCAL, [summary('api'), summary('db', status='exited')])
+    inventory.replace_host(BUILD, [summary('ci')])
+    # notified once per pending batch of changes, and when a host is listed for the first time
+    assert changes == [True, True]
+    assert inventory.listed_hosts == {LOCAL, BUILD}
+    assert inventory.pop_changes() == {
+        'apiapiapiapi': ContainerState('apiapiapiapi', 'api@local', 'running', LOCAL),
+        'dbdbdbdb': ContainerState('dbdbdbdb', 'db@local', 'exited', LOCAL),
+        'cicicici': ContainerState('cicicici', 'ci@build', 'running', BUILD),
+    }
+    # a full list only replaces the containers of its own host
+    inventory.replace_host(LOCAL, [summary('api')])
+    assert inventory.pop_changes() == {'dbdbdbdb': None}
+    assert set(inventory.containers) == {'apiapiapiapi', 'cicicici'}
+    inventory.replace_host(BUILD, [summary('ci')])
+    assert inventory.pop_changes() == {}
+    assert changes == [True, True, True]
+
+
+def test_inventory_applies_events():
+    inventory = ContainerInventory(on_change=lambda: None)
+    inventory.replace_host('', [summary('api')])
+    inventory.pop_changes()
+    inventory.apply_event({'Action': 'die', 'Actor': {'ID': 'apiapiapiapi', 'Attributes': {'name': 'api'}}})
+    inventory.apply_event({'Action': 'rename', 'Actor': {'ID': 'apiapiapiapi', 'Attributes': {'name': 'api-old'}}})
+    assert inventory.pop_changes() == {'apiapiapiapi': ContainerState('apiapiapiapi', 'api-old', 'exited', '')}
+    inventory.apply_event({'Action': 'create', 'Actor': {'ID': 'newnewnewnew', 'Attributes': {'name': 'new'}}})
+    inventory.apply_event({'Action': 'destroy', 'Actor': {'ID': 'apiapiapiapi', 'Attributes': {}}})
+    assert inventory.pop_changes() == {'newnewnewnew': ContainerState('newnewnewnew', 'new', 'created', ''),
+                                       'apiapiapiapi': None}
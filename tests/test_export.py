@@ -0,0 +1,69 @@
+import gzip
+import io
+import tarfile
+
+import pytest
+
+from CaptainsLog.export import ExportOptions, ExportSource, archive_member_name, compression_for, export_logs
+from CaptainsLog.log_cache import LogCache
+from CaptainsLog.log_store import LogStore
+
+
+def make_source(tmp_path, name: str = 'web') -> ExportSource:
+    """Lines 0-9 in the cache, 10-19 in the store, line i logged at i * 10"""
+    cache = LogCache(tmp_path / name)
+    cache.append([i * 10 for i in range(10)], [f'{name} {i}' for i in range(10)])
+    cache.flush()
+    store = LogStore()
+    store.extend([i * 10 for i in range(10, 20)], [f'{name} {i}' for i in range(10, 20)])
+    return ExportSource(name, store=store, cache=cache)
+
+
+def export_text(sources, **options) -> str:
+    output = io.BytesIO()
+    export_logs(sources, output, ExportOptions(**options))
+    return output.getvalue().decode('utf-8')
+
+
+def test_exports_cache_then_store(tmp_path):
+    assert export_text([make_source(tmp_path)]) == ''.join(f'web {i}\n' for i in range(20))
+
+
+@pytest.mark.parametrize('options, expected', [
+    ({'since': 50, 'until': 130}, range(5, 13)),
+    ({'lines': (-3, None)}, range(17, 20)),
+    ({'lines': (2, 4)}, range(2, 4)),
+    ({'since': 100, 'lines': (-100, 2)}, range(10, 12)),
+])
+def test_time_and_line_ranges(tmp_path, options, expected):
+    assert export_text([make_source(tmp_path)], **options) == ''.join(f'web {i}\n' for i in expected)
+
+
+def test_query_filter(tmp_path):
+    expected = ''.join(f'web {i}\n' for i in [1] + list(range(10, 20)))
+    assert export_text([make_source(tmp_path / 'plain')], query='WEB 1') == expected
+    assert export_text([make_source(tmp_path / 'regex')], query=r'web [37]$', regex=True) == 'web 3\nweb 7\n'
+
+
+def test_store_lines_backfilled_during_export_are_left_out(tmp_path):
+    source = make_source(tmp_path)
+    source.snapshot()
+    source.store.backfill([95], ['backfilled'])
+    chunks = list(source.chunks(None, None))
+    assert [line for _, lines in chunks for line in lines] == [f'web {i}' for i in range(20)]
+
+
+def test_several_sources_make_a_compressed_archive(tmp_path):
+    output = io.BytesIO()
+    n_lines, _ = export_logs([make_source(tmp_path, 'web'), make_source(tmp_path, 'db/1')], output,
+                             ExportOptions(compression='gzip'))
+    assert n_lines == 40
+    with tarfile.open(fileobj=io.BytesIO(gzip.decompress(output.getvalue()))) as archive:
+        assert archive.getnames() == ['web.log', archive_member_name('db/1')]
+        assert archive.extractfile('web.log').read().decode().splitlines()[-1] == 'web 19'
+
+
+def test_compression_for():
+    assert compression_for('logs.tar.gz') == 'gzip'
+    assert compression_for('logs.zst') == 'zstd'
+    assert compression_for('logs.txt') == 'none'
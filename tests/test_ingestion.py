@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+from typing import List, Optional, Tuple
+
+from CaptainsLog.ingestion import LogIngestionEngine
+from CaptainsLog.log_store import LogStore
+from CaptainsLog.log_stream import format_since
+from CaptainsLog.supervisor import Tailer
+
+EPOCH = datetime.datetime(2024, 5, 1, tzinfo=datetime.timezone.utc)
+# EPOCH in nanoseconds since the Unix epoch
+EPOCH_NS = int(EPOCH.timestamp()) * 10 ** 9
+
+Line = Tuple[Optional[int], str]
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def log_line(timestamp: Optional[int], text: str) -> bytes:
+    """A line of a logs response requested with timestamps=1, timestamp in ns after EPOCH"""
+    if timestamp is None:
+        return f'{text}\n'.encode()
+    moment = EPOCH + datetime.timedelta(microseconds=timestamp // 1000)
+    return f'{moment:%Y-%m-%dT%H:%M:%S}.{timestamp % 10 ** 9:09d}Z {text}\n'.encode()
+
+
+def frame(stream: int, payload: bytes) -> bytes:
+    return bytes([stream, 0, 0, 0]) + len(payload).to_bytes(4, 'big') + payload
+
+
+def logs_body(lines: List[Line], tty: bool = False) -> bytes:
+    """Chunked logs response, stdout and stderr lines (text starting with 'err') in frames unless tty"""
+    if tty:
+        data = b''.join(log_line(timestamp, text) for timestamp, text in lines)
+    else:
+        data = b''.join(frame(2 if text.startswith('err') else 1, log_line(timestamp, text))
+                        for timestamp, text in lines)
+    # small chunks split lines and frames
+    return b''.join(b'%x\r\n%s\r\n' % (len(data[i:i + 7]), data[i:i + 7]) for i in range(0, len(data), 7)) + \
+        b'0\r\n\r\n'
+
+
+class FakeDaemon:
+    """Answers the log requests of an engine with a response made of the given lines"""
+
+    def __init__(self, engine: LogIngestionEngine, tty: bool = False):
+        self.tty = tty
+        self.responses: List[List[Line]] = []
+        self.requests: List[dict] = []
+        self.writers: List[FakeWriter] = []
+        engine._open_logs = self.open_logs
+
+    async def open_logs(self, endpoint, container_id: str, params: dict):
+        self.requests.append(params)
+        if not self.responses:
+            return None
+        reader = asyncio.StreamReader()
+        reader.feed_data(logs_body(self.responses.pop(0), self.tty))
+        reader.feed_eof()
+        writer = FakeWriter()
+        self.writers.append(writer)
+        return self.tty, (200, {'transfer-encoding': 'chunked'}, reader, writer)
+
+
+def make_engine() -> LogIngestionEngine:
+    return LogIngestionEngine(dispatch=lambda callback, *args: None, docker_host='unix:///nonexistent.sock')
+
+
+def stream(engine: LogIngestionEngine, tailer: Tailer) -> Tuple[List[int], List[str]]:
+    """Run one attempt of the stream of a tailer, and return the lines it queued for its store"""
+    assert engine.loop.run_until_complete(engine._stream_logs(tailer))
+    if engine._flush_handle is not None:
+        engine._flush_handle.cancel()
+        engine._flush_handle = None
+    return engine._pending.pop(tailer.container_id, ([], []))
+
+
+def make_tailer(cursor: Optional[int] = None, tail: Optional[int] = None) -> Tailer:
+    return Tailer('c1', LogStore(), notify=lambda: None, tail=tail, cursor=cursor, docker_host=None)
+
+
+def at(timestamp: int) -> int:
+    return EPOCH_NS + timestamp
+
+
+def test_stream_keeps_out_of_order_and_equal_timestamps():
+    engine = make_engine()
+    daemon = FakeDaemon(engine)
+    daemon.responses.append([(1000, 'out 1'), (2000, 'out 2'), (1500, 'err 1'), (2000, 'same ts'), (3000, 'out 3')])
+    tailer = make_tailer(tail=100)
+    timestamps, lines = stream(engine, tailer)
+    assert lines == ['out 1', 'out 2', 'err 1', 'same ts', 'out 3']
+    # timestamps stay sorted for the store
+    assert timestamps == [at(1000), at(2000), at(2000), at(2000), at(3000)]
+    assert tailer.cursor == at(3000)
+    assert daemon.requests == [{'follow': 1, 'tail': 100}]
+    assert daemon.writers[0].closed
+
+
+def test_reopened_stream_skips_only_lines_already_delivered():
+    engine = make_engine()
+    daemon = FakeDaemon(engine)
+    daemon.responses.append([(1000, 'out 1'), (3000, 'out 3'), (2500, 'err 1')])
+    # the daemon resends the lines logged at the cursor, and stderr lines of the same moment
+    daemon.responses.append([(3000, 'out 3'), (2800, 'err 1b'), (4000, 'out 4'), (3500, 'err 2'),
+                             (4000, 'same ts'), (5000, 'out 5')])
+    tailer = make_tailer()
+    assert stream(engine, tailer)[1] == ['out 1', 'out 3', 'err 1']
+    assert tailer.cursor == at(3000)
+    timestamps, lines = stream(engine, tailer)
+    assert daemon.requests[1] == {'follow': 1, 'since': format_since(at(3000))}
+    assert lines == ['out 4', 'err 2', 'same ts', 'out 5']
+    assert timestamps == [at(4000), at(4000), at(4000), at(5000)]
+    assert tailer.cursor == at(5000)
+
+
+def test_stream_gives_lines_without_timestamp_the_previous_one():
+    engine = make_engine()
+    daemon = FakeDaemon(engine, tty=True)
+    daemon.responses.append([(None, 'first'), (1000, 'second'), (None, 'third')])
+    tailer = make_tailer()
+    timestamps, lines = stream(engine, tailer)
+    assert lines == ['first', 'second', 'third']
+    assert 0 < timestamps[0]
+    assert timestamps[2] == timestamps[1]
+    # a line without timestamp does not move the cursor
+    assert tailer.cursor == at(1000)
+
+
+def test_stream_of_missing_container():
+    engine = make_engine()
+    FakeDaemon(engine)
+    assert not engine.loop.run_until_complete(engine._stream_logs(make_tailer()))
+
+
+def test_fetch_sorts_timestamps_and_keeps_every_line():
+    engine = make_engine()
+    daemon = FakeDaemon(engine)
+    daemon.responses.append([(2000, 'out 2'), (1000, 'err 1'), (None, 'no timestamp'), (3000, 'out 3')])
+    timestamps, lines = engine.loop.run_until_complete(engine._fetch(engine.endpoint(), 'c1', {'tail': 10}))
+    assert lines == ['out 2', 'err 1', 'no timestamp', 'out 3']
+    assert timestamps == [at(2000), at(2000), at(2000), at(3000)]
+    assert daemon.requests == [{'tail': 10}]
+
+
+def test_backfill_inserts_only_lines_older_than_the_store():
+    engine = make_engine()
+    daemon = FakeDaemon(engine)
+    store = LogStore()
+    store.extend([at(3000), at(4000)], ['out 3', 'out 4'])
+    # the daemon applies tail before until, so the held lines come back too
+    daemon.responses.append([(1000, 'out 1'), (2000, 'out 2'), (3000, 'out 3')])
+    notified = []
+    engine.dispatch = lambda callback: notified.append(callback)
+    engine.loop.run_until_complete(engine._backfill('c1', store, 10, notify='done', since=None, docker_host=None))
+    assert daemon.requests == [{'tail': 12, 'until': format_since(at(3000))}]
+    assert store.lines() == ['out 1', 'out 2', 'out 3', 'out 4']
+    assert notified == ['done']
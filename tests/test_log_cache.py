@@ -0,0 +1,103 @@
+import pytest
+
+from CaptainsLog import log_cache
+from CaptainsLog.log_cache import LogCache, LogCacheError, LogCacheLocked, cache_directory, prune_cache
+
+
+def fill(cache: LogCache, n_lines: int, start: int = 0):
+    cache.append([(start + i) * 10 for i in range(n_lines)], [f'line {start + i}' for i in range(n_lines)])
+    cache.flush()
+
+
+def test_read_before_returns_most_recent_lines(tmp_path):
+    cache = LogCache(tmp_path / 'c')
+    fill(cache, 100)
+    assert cache.last_timestamp() == 990
+    timestamps, lines = cache.read_before(None, 3)
+    assert lines == ['line 97', 'line 98', 'line 99']
+    timestamps, lines = cache.read_before(500, 2)
+    assert timestamps == [480, 490]
+    _, lines = cache.read_before(500, 100, since=470)
+    assert lines == ['line 47', 'line 48', 'line 49']
+
+
+def test_read_before_spans_blocks_and_pending_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_cache, 'BLOCK_LINES', 16)
+    cache = LogCache(tmp_path / 'c')
+    fill(cache, 40)
+    cache.append([400, 410], ['pending 0', 'pending 1'])
+    timestamps, lines = cache.read_before(None, 30)
+    assert timestamps == sorted(timestamps)
+    assert lines[0] == 'line 12'
+    assert lines[-2:] == ['pending 0', 'pending 1']
+
+
+def test_segments_roll_over_and_are_reopened(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_cache, 'BLOCK_LINES', 16)
+    monkeypatch.setattr(log_cache, 'SEGMENT_MAX_BYTES', 64)
+    directory = tmp_path / 'c'
+    cache = LogCache(directory)
+    for start in range(0, 64, 16):
+        fill(cache, 16, start)
+    assert len(list(directory.glob('*.seg'))) > 1
+    cache.close()
+    reopened = LogCache(directory)
+    timestamps, lines = reopened.read_before(None, 1000)
+    assert lines == [f'line {i}' for i in range(64)]
+    assert [lines for _, lines in reopened.read_between(200, 230)] == [['line 20', 'line 21', 'line 22']]
+
+
+def test_budget_deletes_oldest_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_cache, 'SEGMENT_MAX_BYTES', 1)
+    cache = LogCache(tmp_path / 'c', max_bytes=1)
+    for start in range(0, 30, 10):
+        fill(cache, 10, start)
+    # the segment being written is always kept
+    _, lines = cache.read_before(None, 100)
+    assert lines == [f'line {i}' for i in range(20, 30)]
+
+
+def test_interrupted_write_is_repaired(tmp_path):
+    directory = tmp_path / 'c'
+    cache = LogCache(directory)
+    fill(cache, 10)
+    fill(cache, 10, 10)
+    cache.close()
+    segment = next(directory.glob('*.seg'))
+    with open(segment, 'ab') as seg_file:
+        seg_file.write(b'\x01partial block')
+    _, lines = LogCache(directory).read_before(None, 100)
+    assert lines == [f'line {i}' for i in range(20)]
+
+
+def test_prune_removes_stale_caches(tmp_path):
+    cache = LogCache(tmp_path / 'c')
+    fill(cache, 5)
+    cache.close()
+    prune_cache(tmp_path, max_age=3600)
+    assert (tmp_path / 'c').exists()
+    prune_cache(tmp_path, max_age=-1)
+    assert not (tmp_path / 'c').exists()
+
+
+def test_directory_is_locked_while_written(tmp_path):
+    directory = tmp_path / 'c'
+    cache = LogCache(directory)
+    fill(cache, 5)
+    with pytest.raises(LogCacheLocked):
+        LogCache(directory)
+    reader = LogCache(directory, read_only=True)
+    assert reader.read_before(None, 2)[1] == ['line 3', 'line 4']
+    with pytest.raises(LogCacheError):
+        reader.append([0], ['nope'])
+    # locked caches are not pruned
+    prune_cache(tmp_path, max_age=-1)
+    assert directory.exists()
+    cache.close()
+    LogCache(directory).close()
+    prune_cache(tmp_path, max_age=-1)
+    assert not directory.exists()
+
+
+def test_cache_directory_is_keyed_by_sanitized_name(tmp_path):
+    assert cache_directory('web/1@host', tmp_path) == tmp_path / 'web_1_host'
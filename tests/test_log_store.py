@@ -0,0 +1,80 @@
+from CaptainsLog.log_store import LogStore
+
+
+def make_store(n_lines: int, max_lines: int = 100, max_bytes: int = 2 ** 20) -> LogStore:
+    store = LogStore(max_lines=max_lines, max_bytes=max_bytes)
+    store.extend(list(range(1, n_lines + 1)), [f'line {i}' for i in range(n_lines)])
+    return store
+
+
+def test_extend_and_read():
+    store = make_store(10)
+    assert store.seq_range() == (0, 10)
+    assert store.get(3) == 'line 3'
+    assert store.get_timestamp(3) == 4
+    assert store.lines(2, 5) == ['line 2', 'line 3', 'line 4']
+    assert store.read_timestamped(8, 20) == (8, [9, 10], ['line 8', 'line 9'])
+
+
+def test_ring_evicts_oldest_lines_and_keeps_seqs():
+    store = make_store(250, max_lines=100)
+    assert store.seq_range() == (150, 250)
+    assert store.get(149) is None
+    assert store.get(150) == 'line 150'
+    assert store.get(249) == 'line 249'
+    assert store.read(0, 160) == (150, [f'line {i}' for i in range(150, 160)])
+
+
+def test_byte_budget_evicts_oldest_lines():
+    store = make_store(10, max_bytes=30)
+    # 'line N' plus newline is 7 bytes, at most 4 lines fit in 30 bytes
+    assert len(store) == 4
+    assert store.n_bytes <= 30
+    assert store.lines() == ['line 6', 'line 7', 'line 8', 'line 9']
+
+
+def test_resize_keeps_seqs():
+    store = make_store(50, max_lines=100)
+    store.resize(20, store.max_bytes)
+    assert store.seq_range() == (30, 50)
+    assert store.get(30) == 'line 30'
+    store.resize(200, store.max_bytes)
+    store.extend([100], ['new'])
+    assert store.seq_range() == (30, 51)
+    assert store.get(50) == 'new'
+
+
+def test_backfill_keeps_seqs_of_held_lines():
+    store = make_store(10)
+    seq = store.find('line 7', 0)
+    store.backfill([-2, -1], ['older 0', 'older 1'])
+    assert store.seq_range() == (-2, 10)
+    assert store.get(seq) == 'line 7'
+    assert store.lines(-2, 1) == ['older 0', 'older 1', 'line 0']
+    assert store.get_timestamp(-2) == -2
+    assert store.backfills == 1
+
+
+def test_backfill_beyond_capacity_drops_oldest_inserted_lines():
+    store = make_store(95, max_lines=100)
+    store.backfill(list(range(-10, 0)), [f'older {i}' for i in range(10)])
+    assert store.seq_range() == (-5, 95)
+    assert store.get(-5) == 'older 5'
+    assert store.get(0) == 'line 0'
+
+
+def test_backfill_does_not_call_listeners():
+    store = make_store(5)
+    received = []
+    store.add_listener(lambda timestamps, lines: received.append(lines))
+    store.backfill([0], ['older'])
+    store.extend([10], ['newer'])
+    assert received == [['newer']]
+
+
+def test_find_forwards_and_backwards():
+    store = make_store(20)
+    assert store.find('LINE 1', 0) == 1
+    assert store.find('line 1', 2) == 10
+    assert store.find('line 1', 9, backwards=True) == 1
+    assert store.find('missing', 0) is None
@@ -0,0 +1,64 @@
+from CaptainsLog.log_stream import FrameDecoder, LineDecoder, format_since, split_timestamp
+
+
+def frame(stream: int, payload: bytes) -> bytes:
+    return bytes([stream, 0, 0, 0]) + len(payload).to_bytes(4, 'big') + payload
+
+
+def test_line_decoder_joins_lines_split_across_chunks():
+    decoder = LineDecoder()
+    assert decoder.feed(b'first li') == []
+    assert decoder.feed(b'ne\nsecond') == ['first line']
+    assert decoder.feed(b' line\nthird\n') == ['second line', 'third']
+    assert decoder.flush() == []
+
+
+def test_line_decoder_keeps_split_multibyte_characters():
+    data = 'café 日本\n'.encode('utf-8')
+    decoder = LineDecoder()
+    lines = []
+    for i in range(len(data)):
+        lines += decoder.feed(data[i:i + 1])
+    assert lines == ['café 日本']
+
+
+def test_line_decoder_removes_control_characters_but_not_escapes():
+    decoder = LineDecoder()
+    assert decoder.feed(b'a\x00b\x07c \x1b[31mred\x1b[0m\tend\n') == ['abc \x1b[31mred\x1b[0m\tend']
+
+
+def test_line_decoder_flushes_trailing_partial_line():
+    decoder = LineDecoder()
+    assert decoder.feed(b'no newline') == []
+    assert decoder.flush() == ['no newline']
+    assert decoder.flush() == []
+
+
+def test_frame_decoder_splits_frames_across_chunks():
+    data = frame(1, b'out line\n') + frame(2, b'err line\n') + frame(1, b'')
+    decoder = FrameDecoder()
+    frames = []
+    for start in range(0, len(data), 5):
+        frames += decoder.feed(data[start:start + 5])
+    assert frames == [(1, b'out line\n'), (2, b'err line\n'), (1, b'')]
+
+
+def test_frame_decoder_waits_for_complete_frame():
+    data = frame(1, b'x' * 100)
+    decoder = FrameDecoder()
+    assert decoder.feed(data[:50]) == []
+    assert decoder.feed(data[50:]) == [(1, b'x' * 100)]
+
+
+def test_split_timestamp():
+    timestamp, text = split_timestamp('2023-08-26T12:34:56.123456789Z hello world')
+    assert text == 'hello world'
+    assert timestamp % 1_000_000_000 == 123456789
+    # the daemon trims trailing zeros of the fraction
+    trimmed, _ = split_timestamp('2023-08-26T12:34:56.5Z x')
+    assert trimmed % 1_000_000_000 == 500_000_000
+    assert split_timestamp('not a timestamp') == (None, 'not a timestamp')
+
+
+def test_format_since_round_trips_nanoseconds():
+    assert format_since(1_700_000_000_000_000_123) == '1700000000.000000123'
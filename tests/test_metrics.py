@@ -0,0 +1,43 @@
+import re
+
+from CaptainsLog.metrics import LogMetrics
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_rates_count_bytes_and_errors():
+    metrics = LogMetrics(pattern=re.compile(r'\berror\b', re.IGNORECASE), window=10, clock=FakeClock())
+    metrics.record([0, 0, 0], ['ok', 'ERROR: disk', 'errors'])
+    rates = metrics.rates()
+    assert rates.total_lines == 3
+    assert rates.total_errors == 1
+    assert rates.bytes_per_s == 19 / 10
+    assert rates.lines_per_s == 3 / 10
+
+
+def test_rates_count_utf8_bytes():
+    metrics = LogMetrics(pattern=re.compile('error'), window=10, clock=FakeClock())
+    metrics.record([0, 0], ['ok', 'café 日本'])
+    # 2 + 12 bytes of UTF-8 text
+    assert metrics.rates().bytes_per_s == 14 / 10
+
+
+def test_rates_forget_lines_older_than_the_window():
+    clock = FakeClock()
+    metrics = LogMetrics(pattern=re.compile('error'), window=10, clock=clock)
+    metrics.record([0], ['error'])
+    clock.now += 5
+    metrics.record([0, 0], ['a', 'b'])
+    assert metrics.rates().lines_per_s == 0.3
+    clock.now += 6
+    rates = metrics.rates()
+    assert rates.lines_per_s == 0.2
+    assert rates.errors_per_s == 0
+    assert rates.total_errors == 1
@@ -0,0 +1,78 @@
+import pytest
+
+from CaptainsLog import search
+from CaptainsLog.log_store import LogStore
+from CaptainsLog.search import BLOCK_LINES, SearchIndex
+
+
+def make_store(lines, max_lines: int = 10_000) -> LogStore:
+    store = LogStore(max_lines=max_lines)
+    store.extend([0] * len(lines), lines)
+    return store
+
+
+def test_substring_search_is_case_insensitive():
+    store = make_store([f'request {i} handled' for i in range(300)] + ['ERROR: disk full'])
+    index = SearchIndex(store)
+    result = index.search('error')
+    assert result.count == 1
+    assert result.matches == [(300, 0, 5)]
+    assert index.search('request 12 ').count == 1
+
+
+def test_short_and_regex_queries_scan_every_line():
+    store = make_store(['ab', 'xab', 'b'])
+    index = SearchIndex(store)
+    assert [seq for seq, _, _ in index.search('ab').matches] == [0, 1]
+    result = index.search(r'^x?a', regex=True)
+    assert [seq for seq, _, _ in result.matches] == [0, 1]
+
+
+def test_search_only_returns_lines_still_held():
+    store = make_store([f'line {i}' for i in range(10)], max_lines=4 * BLOCK_LINES)
+    index = SearchIndex(store)
+    assert index.search('line 3').count == 1
+    store.extend([0] * 4 * BLOCK_LINES, ['filler'] * 4 * BLOCK_LINES)
+    # the block holding 'line 3' is still in the posting lists, but evicted
+    assert index.search('line 3').count == 0
+
+
+def test_compaction_drops_evicted_blocks(monkeypatch):
+    monkeypatch.setattr(search, 'COMPACT_BLOCKS', 2)
+    store = make_store(['alpha'] * BLOCK_LINES, max_lines=BLOCK_LINES)
+    index = SearchIndex(store)
+    index.update()
+    store.extend([0] * 3 * BLOCK_LINES, ['beta'] * 3 * BLOCK_LINES)
+    assert index.search('alpha').count == 0
+    assert 'alp' not in index._postings
+    assert index.search('beta').count == BLOCK_LINES
+
+
+def test_search_sees_backfilled_lines_and_keeps_seqs():
+    store = make_store([f'new {i}' for i in range(200)])
+    index = SearchIndex(store)
+    before = index.search('new 150').matches
+    store.backfill([0] * 100, [f'old {i}' for i in range(100)])
+    assert index.search('new 150').matches == before
+    assert index.search('old 42').matches == [(-58, 0, 6)]
+
+
+def test_search_after_backfill_of_evicted_seqs():
+    store = make_store([f'a{i}' for i in range(300)], max_lines=100)
+    index = SearchIndex(store)
+    assert index.search('a250').matches == [(250, 0, 4)]
+    store.resize(200, store.max_bytes)
+    # the inserted lines take the numbers of lines evicted before
+    store.backfill([0] * 50, [f'b{i}' for i in range(50)])
+    assert store.get(160) == 'b10'
+    assert index.search('b10').matches == [(160, 0, 3)]
+    assert index.search('a250').matches == [(250, 0, 4)]
+
+
+def test_cancelled_job_raises():
+    store = make_store(['x'] * 10)
+    index = SearchIndex(store)
+    job = search.SearchJob(index, 'xx', False, callback=lambda result: None)
+    job.cancel()
+    with pytest.raises(search.SearchCancelled):
+        index.search('x', job=job)
@@ -0,0 +1,71 @@
+import pytest
+
+from CaptainsLog.log_store import LogStore
+from CaptainsLog.structured import StructuredFields, parse_filter, parse_json, parse_logfmt
+
+LINES = [
+    '{"level": "info", "service": "api", "latency_ms": 12}',
+    'level=warn service=worker msg="queue is slow"',
+    'plain text line',
+    '2024-05-01 {"level": "error", "service": "api", "latency_ms": 900, "http": {"status": 500}}',
+    'level=debug service=api latency_ms=3',
+]
+
+
+def make_fields(lines=LINES) -> StructuredFields:
+    store = LogStore()
+    store.extend([0] * len(lines), lines)
+    return StructuredFields(store)
+
+
+def test_parse_json_flattens_nested_keys_after_a_prefix():
+    fields = parse_json(LINES[3])
+    assert fields == {'level': 'error', 'service': 'api', 'latency_ms': '900', 'http.status': '500'}
+    assert parse_json('{not json}') is None
+
+
+def test_parse_logfmt_unquotes_values():
+    assert parse_logfmt(LINES[1]) == {'level': 'warn', 'service': 'worker', 'msg': 'queue is slow'}
+    assert parse_logfmt('a=1 only') is None
+
+
+def test_parse_filter_validates_terms():
+    assert parse_filter('level>=warn msg="a b"')[1].value == 'a b'
+    with pytest.raises(ValueError):
+        parse_filter('level>=loud')
+    with pytest.raises(ValueError):
+        parse_filter('latency_ms>fast')
+    with pytest.raises(ValueError):
+        parse_filter('nonsense')
+
+
+def test_filter_by_level_text_and_number():
+    fields = make_fields()
+    assert fields.filter(parse_filter('level>=warn')).seqs == [1, 3]
+    assert fields.filter(parse_filter('service=api')).seqs == [0, 3, 4]
+    assert fields.filter(parse_filter('service=api latency_ms>10')).seqs == [0, 3]
+    assert fields.filter(parse_filter('http.status=500')).seqs == [3]
+    assert fields.filter(parse_filter('missing=1')).seqs == []
+
+
+def test_incremental_filter_from_previous_end():
+    fields = make_fields()
+    result = fields.filter(parse_filter('service=api'))
+    assert result.end_seq == len(LINES)
+    fields.store.extend([0], ['{"service": "api"}'])
+    assert fields.filter(parse_filter('service=api'), result.end_seq).seqs == [5]
+
+
+def test_filter_includes_backfilled_lines():
+    fields = make_fields()
+    assert fields.filter(parse_filter('level>=error')).seqs == [3]
+    fields.store.backfill([0, 0], ['{"level": "fatal"}', 'nothing'])
+    assert fields.filter(parse_filter('level>=error')).seqs == [-2, 3]
+    assert fields.filter(parse_filter('service=api')).seqs == [0, 3, 4]
+
+
+def test_filter_skips_evicted_lines():
+    store = LogStore(max_lines=3)
+    store.extend([0] * len(LINES), LINES)
+    fields = StructuredFields(store)
+    assert fields.filter(parse_filter('service=api')).seqs == [3, 4]
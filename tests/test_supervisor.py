@@ -0,0 +1,135 @@
+import asyncio
+import time
+
+import pytest
+
+from CaptainsLog.log_store import LogStore
+from CaptainsLog.supervisor import (RESTART_DELAY_MAX, TAILER_LIVE, TAILER_RETRYING, TAILER_STOPPED, Tailer,
+                                    TailerSupervisor, backoff_delay, describe_tailer)
+
+
+def make_tailer(container_id: str = 'c1', cursor=None) -> Tailer:
+    return Tailer(container_id, LogStore(), notify=lambda: None, tail=None, cursor=cursor, docker_host=None)
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert [backoff_delay(attempt, jitter=0) for attempt in range(7)] == [1, 2, 4, 8, 16, 30, 30]
+    assert backoff_delay(10_000, jitter=0) == RESTART_DELAY_MAX
+
+
+@pytest.mark.parametrize('rng_value', [0.0, 0.5, 0.999])
+def test_backoff_jitter_stays_within_bounds(rng_value):
+    delay = backoff_delay(3, jitter=0.5, rng=lambda: rng_value)
+    assert 4 <= delay <= 8
+
+
+def test_describe_tailer():
+    tailer = make_tailer()
+    tailer.state = TAILER_RETRYING
+    tailer.last_error = 'connection reset'
+    tailer.retry_at = time.monotonic() + 10
+    assert describe_tailer(tailer.status()).startswith("Log stream reconnecting in")
+    assert "connection reset" in describe_tailer(tailer.status())
+
+
+def test_stream_reopened_from_cursor_until_container_is_gone():
+    calls = []
+
+    async def stream(tailer: Tailer) -> bool:
+        calls.append(tailer.cursor)
+        tailer.state = TAILER_LIVE
+        if len(calls) == 1:
+            tailer.cursor = 42
+            tailer.received = True
+            raise ConnectionError("dropped")
+        return False
+
+    async def run():
+        supervisor = TailerSupervisor(asyncio.get_running_loop(), stream)
+        tailer = make_tailer()
+        supervisor.start(tailer)
+        # the first attempt received lines, so the retry comes after the shortest delay
+        await asyncio.wait_for(tailer.task, 5)
+        return tailer
+
+    tailer = asyncio.run(run())
+    assert calls == [None, 42]
+    assert tailer.state == TAILER_STOPPED
+    assert tailer.restarts == 1
+    assert tailer.last_error == "dropped"
+
+
+def test_wake_skips_the_backoff_of_a_container_that_starts_again():
+    calls = []
+
+    async def stream(tailer: Tailer) -> bool:
+        calls.append(time.monotonic())
+        # a stopped container: the stream ends right away without new lines, after a long downtime
+        tailer.failures = 10
+        return True
+
+    async def run():
+        supervisor = TailerSupervisor(asyncio.get_running_loop(), stream)
+        tailer = make_tailer()
+        supervisor.start(tailer)
+        await asyncio.sleep(0.05)
+        assert tailer.state == TAILER_RETRYING
+        assert tailer.status().retry_in > 10
+        woken = time.monotonic()
+        assert supervisor.wake(tailer.container_id)
+        assert tailer.failures == 0
+        await asyncio.sleep(0.05)
+        supervisor.stop(tailer.container_id)
+        return woken
+
+    woken = asyncio.run(run())
+    assert len(calls) == 2
+    assert calls[1] - woken < 0.05
+
+
+def test_wake_of_unknown_container():
+    async def run():
+        supervisor = TailerSupervisor(asyncio.get_running_loop(), stream=None)
+        return supervisor.wake('missing')
+
+    assert not asyncio.run(run())
+
+
+def test_restart_after_stop_keeps_cursor():
+    async def stream(tailer: Tailer) -> bool:
+        tailer.cursor = (tailer.cursor or 0) + 1
+        return False
+
+    async def run():
+        supervisor = TailerSupervisor(asyncio.get_running_loop(), stream)
+        first = make_tailer()
+        supervisor.start(first)
+        assert not supervisor.start(make_tailer())
+        await first.task
+        second = make_tailer()
+        assert supervisor.start(second)
+        await second.task
+        return second
+
+    assert asyncio.run(run()).cursor == 2
+
+
+def test_stop_cancels_without_waiting():
+    async def stream(tailer: Tailer) -> bool:
+        tailer.state = TAILER_LIVE
+        await asyncio.sleep(3600)
+        return True
+
+    async def run():
+        supervisor = TailerSupervisor(asyncio.get_running_loop(), stream)
+        tailers = [make_tailer(f'c{i}') for i in range(100)]
+        for tailer in tailers:
+            supervisor.start(tailer)
+        await asyncio.sleep(0)
+        for tailer in tailers:
+            supervisor.stop(tailer.container_id)
+        assert supervisor.statuses() == []
+        await asyncio.gather(*(tailer.task for tailer in tailers), return_exceptions=True)
+        return tailers
+
+    assert all(tailer.task.cancelled() for tailer in asyncio.run(run()))
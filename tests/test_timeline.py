@@ -0,0 +1,66 @@
+from CaptainsLog.log_store import LogStore
+from CaptainsLog.timeline import SOURCE_SEPARATOR, MergedTimeline, TimelineMerge, source_span
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_merge_interleaves_sources_in_time_order():
+    merge = TimelineMerge(reorder_window=0, clock=FakeClock())
+    merge.push(0, [1, 4, 6], ['a1', 'a4', 'a6'])
+    merge.push(1, [2, 3, 7], ['b2', 'b3', 'b7'])
+    merge.push(0, [8], ['a8'])
+    sources, timestamps, lines = merge.pop()
+    assert lines == ['a1', 'b2', 'b3', 'a4', 'a6', 'b7', 'a8']
+    assert sources == [0, 1, 1, 0, 0, 1, 0]
+    assert timestamps == sorted(timestamps)
+    assert merge.n_pending() == 0
+
+
+def test_lines_are_held_back_for_the_reorder_window():
+    clock = FakeClock()
+    merge = TimelineMerge(reorder_window=1.0, clock=clock)
+    merge.push(0, [10], ['late source'])
+    assert merge.pop() == ([], [], [])
+    clock.now = 0.5
+    # logged earlier, received later: still merged first
+    merge.push(1, [5], ['early'])
+    clock.now = 1.0
+    # the first line is due, but the earlier line received after it is not
+    assert merge.pop() == ([], [], [])
+    clock.now = 1.5
+    assert merge.pop()[2] == ['early', 'late source']
+    assert merge.late_lines == 0
+
+
+def test_pop_limit_and_remove():
+    merge = TimelineMerge(reorder_window=0, clock=FakeClock())
+    merge.push(0, [1, 2, 3], ['a', 'b', 'c'])
+    merge.push(1, [1], ['x'])
+    assert merge.pop(limit=2)[2] == ['a', 'x']
+    merge.remove(0)
+    assert merge.pop() == ([], [], [])
+    assert merge.n_pending() == 0
+
+
+def test_merged_timeline_backfills_and_follows_stores():
+    web, db = LogStore(), LogStore()
+    web.extend([1_000_000_000], ['web started'])
+    timeline = MergedTimeline(reorder_window=0)
+    timeline.add_source('web', web)
+    timeline.add_source('db', db)
+    db.extend([2_000_000_000], ['db ready'])
+    assert timeline.flush() == 2
+    lines = timeline.store.lines()
+    assert [line.split(SOURCE_SEPARATOR)[1] for line in lines] == ['web started', 'db ready']
+    start, end = source_span(lines[1])
+    assert lines[1][start:end] == 'db'
+    timeline.close()
+    db.extend([3_000_000_000], ['ignored'])
+    assert timeline.flush() == 0